@@ -3,20 +3,28 @@
 Run this script ONCE to create all database tables before running Celery workers
 Usage: python init_database.py
 """
+import os
+import sys
+
+# Add DB folder to path so "import DB.db_utils" resolves database/models
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from database import engine, Base
-from models import GA4Metric, GSCMetric, IndexingStatus, SEOReport, PreprocessedMetric
+from models import GA4Metric, GSCMetric, IndexingStatus, SEOReport, ReportStage, PreprocessedMetric
+from migrations import run_migrations
 
 def create_tables():
     """Create all database tables"""
     try:
         print("🔧 Creating database tables...")
         Base.metadata.create_all(bind=engine)
+        run_migrations(engine, Base.metadata)
         print("✅ Database tables created successfully!")
         print("\nCreated tables:")
         print("  - ga4_metrics")
         print("  - gsc_metrics")
         print("  - indexing_status")
         print("  - seo_reports")
+        print("  - report_stages")
         print("  - preprocessed_metrics")
         print("\n🚀 You can now run your Celery workers!")
     except Exception as e:
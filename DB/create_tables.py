@@ -32,6 +32,10 @@ try:
     # Create tables
     print("\n🔧 Creating database tables...")
     Base.metadata.create_all(bind=engine)
+
+    # Columns added to existing tables (create_all does not alter them)
+    from migrations import run_migrations
+    run_migrations(engine, Base.metadata)
     
     print("✅ Database tables created successfully!")
     print("\nCreated tables:")
@@ -39,6 +43,7 @@ try:
     print("  - gsc_metrics")
     print("  - indexing_status")
     print("  - seo_reports")
+    print("  - report_stages")
     print("  - preprocessed_metrics")
     print("\n🚀 You can now run your Celery workers!")
     
@@ -1,21 +1,29 @@
 # db_utils.py
 import os
 import sys
+import json
+import time
 import pandas as pd
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from sqlalchemy.orm import Session
 
 # Add DB folder to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'DB'))
+from metrics import track_call, observe_rows, observe_stage
+from csv_schemas import read_report_csv
+from dtype_policy import apply_dtype_policy
 from database import SessionLocal, engine, Base
-from models import GA4Metric, GSCMetric, IndexingStatus, SEOReport, PreprocessedMetric
+from models import GA4Metric, GSCMetric, IndexingStatus, SEOReport, ReportStage, PreprocessedMetric
+from migrations import run_migrations
 
 # -------------------------
 # Create all tables
 # -------------------------
 def init_db():
-    """Create all database tables"""
+    """Create all database tables and add columns introduced since they were created"""
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine, Base.metadata)
     print("✅ Database tables created successfully")
 
 
@@ -38,7 +46,7 @@ def store_ga4_csv(csv_path: str, date_col: str = "date", db: Session = None, def
         should_close = True
     
     try:
-        df = pd.read_csv(csv_path, engine="python", on_bad_lines="skip")
+        df = read_report_csv(csv_path)
         if df.empty:
             print(f"⚠️ Empty CSV file: {csv_path}")
             return 0
@@ -56,25 +64,29 @@ def store_ga4_csv(csv_path: str, date_col: str = "date", db: Session = None, def
             # Convert date to proper format
             df[date_col] = pd.to_datetime(df[date_col]).dt.date
         
-        count = 0
-        for _, row in df.iterrows():
-            metric = GA4Metric(
-                date=row.get(date_col),
-                page=str(row.get("page", row.get("landing_page", row.get("page_title", "")))),
-                users=int(row.get("users", row.get("total_users", 0))),
-                sessions=int(row.get("sessions", 0)),
-                engaged_sessions=int(row.get("engaged_sessions", 0)),
-                engagement_rate=float(row.get("engagement_rate", 0.0)),
-                bounce_rate=float(row.get("bounce_rate", 0.0)),
-                average_session_duration=float(row.get("average_session_duration", 0.0)),
-                event_count=int(row.get("event_count", 0)),
-                conversions=int(row.get("conversions", 0)),
-                total_revenue=float(row.get("total_revenue", 0.0))
-            )
-            db.add(metric)
-            count += 1
-        
-        db.commit()
+        df = apply_dtype_policy(df, "db_ga4")
+
+        with track_call("postgres", "store_ga4_csv"):
+            count = 0
+            for _, row in df.iterrows():
+                metric = GA4Metric(
+                    date=row.get(date_col),
+                    page=str(row.get("page", row.get("landing_page", row.get("page_title", "")))),
+                    users=int(row.get("users", row.get("total_users", 0))),
+                    sessions=int(row.get("sessions", 0)),
+                    engaged_sessions=int(row.get("engaged_sessions", 0)),
+                    engagement_rate=float(row.get("engagement_rate", 0.0)),
+                    bounce_rate=float(row.get("bounce_rate", 0.0)),
+                    average_session_duration=float(row.get("average_session_duration", 0.0)),
+                    event_count=int(row.get("event_count", 0)),
+                    conversions=int(row.get("conversions", 0)),
+                    total_revenue=float(row.get("total_revenue", 0.0))
+                )
+                db.add(metric)
+                count += 1
+            
+            db.commit()
+        observe_rows("db_ga4_metrics", count)
         print(f"✅ Stored {count} GA4 records from {os.path.basename(csv_path)}")
         return count
         
@@ -121,21 +133,25 @@ def store_gsc_csv(csv_path: str, date_col: str = "date", db: Session = None):
         # Convert date to proper format
         df[date_col] = pd.to_datetime(df[date_col]).dt.date
         
-        count = 0
-        for _, row in df.iterrows():
-            metric = GSCMetric(
-                date=row.get(date_col),
-                page=str(row.get("page", row.get("url", ""))),
-                query=str(row.get("query", None)) if pd.notna(row.get("query")) else None,
-                clicks=int(row.get("clicks", 0)),
-                impressions=int(row.get("impressions", 0)),
-                ctr=float(row.get("ctr", 0.0)),
-                position=float(row.get("position", 0.0))
-            )
-            db.add(metric)
-            count += 1
-        
-        db.commit()
+        df = apply_dtype_policy(df, "db_gsc")
+
+        with track_call("postgres", "store_gsc_csv"):
+            count = 0
+            for _, row in df.iterrows():
+                metric = GSCMetric(
+                    date=row.get(date_col),
+                    page=str(row.get("page", row.get("url", ""))),
+                    query=str(row.get("query", None)) if pd.notna(row.get("query")) else None,
+                    clicks=int(row.get("clicks", 0)),
+                    impressions=int(row.get("impressions", 0)),
+                    ctr=float(row.get("ctr", 0.0)),
+                    position=float(row.get("position", 0.0))
+                )
+                db.add(metric)
+                count += 1
+            
+            db.commit()
+        observe_rows("db_gsc_metrics", count)
         print(f"✅ Stored {count} GSC records from {os.path.basename(csv_path)}")
         return count
         
@@ -174,40 +190,44 @@ def store_indexing_csv(csv_path: str, date_col: str = "date", db: Session = None
         # Normalize column names
         df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
         
-        count = 0
-        for _, row in df.iterrows():
-            # Handle date
-            date_val = datetime.now().date()
-            if date_col in df.columns and pd.notna(row.get(date_col)):
-                date_val = pd.to_datetime(row.get(date_col)).date()
-            
-            # Handle last_crawl_time
-            last_crawl = None
-            if "last_crawl_time" in df.columns and pd.notna(row.get("last_crawl_time")):
-                try:
-                    last_crawl = pd.to_datetime(row.get("last_crawl_time"))
-                except:
-                    pass
+        df = apply_dtype_policy(df, "db_indexing")
+
+        with track_call("postgres", "store_indexing_csv"):
+            count = 0
+            for _, row in df.iterrows():
+                # Handle date
+                date_val = datetime.now().date()
+                if date_col in df.columns and pd.notna(row.get(date_col)):
+                    date_val = pd.to_datetime(row.get(date_col)).date()
+                
+                # Handle last_crawl_time
+                last_crawl = None
+                if "last_crawl_time" in df.columns and pd.notna(row.get("last_crawl_time")):
+                    try:
+                        last_crawl = pd.to_datetime(row.get("last_crawl_time"))
+                    except:
+                        pass
+                
+                metric = IndexingStatus(
+                    date=date_val,
+                    url=str(row.get("url", row.get("page", ""))),
+                    verdict=str(row.get("verdict")) if pd.notna(row.get("verdict")) else None,
+                    coverage_state=str(row.get("coverage_state")) if pd.notna(row.get("coverage_state")) else None,
+                    crawled_as=str(row.get("crawled_as")) if pd.notna(row.get("crawled_as")) else None,
+                    indexing_state=str(row.get("indexing_state")) if pd.notna(row.get("indexing_state")) else None,
+                    last_crawl_time=last_crawl,
+                    page_fetch_state=str(row.get("page_fetch_state")) if pd.notna(row.get("page_fetch_state")) else None,
+                    robots_txt_state=str(row.get("robots_txt_state")) if pd.notna(row.get("robots_txt_state")) else None,
+                    http_status=int(row.get("http_status")) if pd.notna(row.get("http_status")) else None,
+                    lcp=float(row.get("lcp")) if pd.notna(row.get("lcp")) else None,
+                    inp=float(row.get("inp")) if pd.notna(row.get("inp")) else None,
+                    cls=float(row.get("cls")) if pd.notna(row.get("cls")) else None
+                )
+                db.add(metric)
+                count += 1
             
-            metric = IndexingStatus(
-                date=date_val,
-                url=str(row.get("url", row.get("page", ""))),
-                verdict=str(row.get("verdict")) if pd.notna(row.get("verdict")) else None,
-                coverage_state=str(row.get("coverage_state")) if pd.notna(row.get("coverage_state")) else None,
-                crawled_as=str(row.get("crawled_as")) if pd.notna(row.get("crawled_as")) else None,
-                indexing_state=str(row.get("indexing_state")) if pd.notna(row.get("indexing_state")) else None,
-                last_crawl_time=last_crawl,
-                page_fetch_state=str(row.get("page_fetch_state")) if pd.notna(row.get("page_fetch_state")) else None,
-                robots_txt_state=str(row.get("robots_txt_state")) if pd.notna(row.get("robots_txt_state")) else None,
-                http_status=int(row.get("http_status")) if pd.notna(row.get("http_status")) else None,
-                lcp=float(row.get("lcp")) if pd.notna(row.get("lcp")) else None,
-                inp=float(row.get("inp")) if pd.notna(row.get("inp")) else None,
-                cls=float(row.get("cls")) if pd.notna(row.get("cls")) else None
-            )
-            db.add(metric)
-            count += 1
-        
-        db.commit()
+            db.commit()
+        observe_rows("db_indexing_status", count)
         print(f"✅ Stored {count} indexing records from {os.path.basename(csv_path)}")
         return count
         
@@ -259,6 +279,269 @@ def store_report_metadata(week_start, week_end, report_type, pdf_path=None,
             db.close()
 
 
+# -------------------------
+# Report run tracking (runs + stages)
+# -------------------------
+def start_report_run(report_type, week_start, week_end, run_id=None, task_id=None,
+                     db: Session = None):
+    """
+    Create a SEOReport row in 'running' state for a pipeline run
+
+    Returns:
+        The report id, or None if the database is unavailable
+    """
+    should_close = False
+    if db is None:
+        db = SessionLocal()
+        should_close = True
+
+    try:
+        report = SEOReport(
+            run_id=run_id,
+            task_id=task_id,
+            week_start=week_start,
+            week_end=week_end,
+            report_type=report_type,
+            status='running'
+        )
+        db.add(report)
+        db.commit()
+        return report.id
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error starting report run: {e}")
+        return None
+    finally:
+        if should_close:
+            db.close()
+
+
+def finish_report_run(report_id, status, pdf_path=None, csv_paths=None, run_id=None,
+                      db: Session = None):
+    """
+    Mark a pipeline run as finished ('generated', 'sent' or 'failed')
+    """
+    if report_id is None:
+        return
+    should_close = False
+    if db is None:
+        db = SessionLocal()
+        should_close = True
+
+    try:
+        report = db.get(SEOReport, report_id)
+        if report is None:
+            return
+        now = datetime.now(timezone.utc)
+        report.status = status
+        report.finished_at = now
+        if status == 'sent':
+            report.sent_at = now
+        if pdf_path:
+            report.pdf_path = pdf_path
+        if csv_paths:
+            report.csv_paths = json.dumps(csv_paths)
+        if run_id:
+            report.run_id = run_id
+        db.commit()
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error finishing report run {report_id}: {e}")
+    finally:
+        if should_close:
+            db.close()
+
+
+def start_report_stage(report_id, name, db: Session = None):
+    """
+    Record the start of a pipeline stage
+
+    Returns:
+        The stage id, or None if the database is unavailable
+    """
+    should_close = False
+    if db is None:
+        db = SessionLocal()
+        should_close = True
+
+    try:
+        stage = ReportStage(
+            report_id=report_id,
+            name=name,
+            status='running',
+            started_at=datetime.now(timezone.utc)
+        )
+        db.add(stage)
+        db.commit()
+        return stage.id
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error starting stage {name}: {e}")
+        return None
+    finally:
+        if should_close:
+            db.close()
+
+
+def finish_report_stage(stage_id, status, duration_seconds=None, row_count=None,
+                        artifact_paths=None, error=None, db: Session = None):
+    """
+    Record the outcome of a pipeline stage ('success', 'failed' or 'skipped')
+    """
+    if stage_id is None:
+        return
+    should_close = False
+    if db is None:
+        db = SessionLocal()
+        should_close = True
+
+    try:
+        stage = db.get(ReportStage, stage_id)
+        if stage is None:
+            return
+        stage.status = status
+        stage.finished_at = datetime.now(timezone.utc)
+        stage.duration_seconds = duration_seconds
+        stage.row_count = row_count
+        stage.artifact_paths = json.dumps(artifact_paths) if artifact_paths else None
+        stage.error = error
+        db.commit()
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error finishing stage {stage_id}: {e}")
+    finally:
+        if should_close:
+            db.close()
+
+
+@contextmanager
+def track_stage(report_id, name):
+    """
+    Time a pipeline stage and record it against a report run.
+
+    The caller may set stage["rows"] and stage["artifacts"] inside the block.
+    Tracking failures never interrupt the pipeline; stage failures are
+    recorded and re-raised.
+    """
+    stage = {"rows": None, "artifacts": None, "status": "success"}
+    stage_id = start_report_stage(report_id, name) if report_id else None
+    started = time.monotonic()
+
+    try:
+        yield stage
+    except Exception as e:
+        duration = time.monotonic() - started
+        print(f"⏱️ Stage {name} failed after {duration:.1f}s")
+        observe_stage(name, 'failed', duration)
+        finish_report_stage(stage_id, 'failed', duration_seconds=duration, error=str(e))
+        raise
+
+    duration = time.monotonic() - started
+    print(f"⏱️ Stage {name} finished in {duration:.1f}s")
+    observe_stage(name, stage["status"], duration)
+    finish_report_stage(
+        stage_id,
+        stage["status"],
+        duration_seconds=duration,
+        row_count=stage["rows"],
+        artifact_paths=stage["artifacts"]
+    )
+
+
+def count_csv_rows(paths):
+    """Count data rows (lines minus header) across CSV files without parsing them"""
+    total = 0
+    for path in paths or []:
+        try:
+            with open(path, "rb") as f:
+                total += max(sum(1 for _ in f) - 1, 0)
+        except OSError:
+            continue
+    return total
+
+
+def _stage_to_dict(stage):
+    return {
+        "id": stage.id,
+        "name": stage.name,
+        "status": stage.status,
+        "started_at": stage.started_at.isoformat() if stage.started_at else None,
+        "finished_at": stage.finished_at.isoformat() if stage.finished_at else None,
+        "duration_seconds": stage.duration_seconds,
+        "row_count": stage.row_count,
+        "artifact_paths": json.loads(stage.artifact_paths) if stage.artifact_paths else [],
+        "error": stage.error,
+    }
+
+
+def _report_to_dict(report):
+    return {
+        "id": report.id,
+        "run_id": report.run_id,
+        "task_id": report.task_id,
+        "report_type": report.report_type,
+        "week_start": report.week_start.isoformat() if report.week_start else None,
+        "week_end": report.week_end.isoformat() if report.week_end else None,
+        "status": report.status,
+        "pdf_path": report.pdf_path,
+        "csv_paths": json.loads(report.csv_paths) if report.csv_paths else [],
+        "created_at": report.created_at.isoformat() if report.created_at else None,
+        "finished_at": report.finished_at.isoformat() if report.finished_at else None,
+        "sent_at": report.sent_at.isoformat() if report.sent_at else None,
+    }
+
+
+def list_report_runs(limit: int = 50, report_type: str = None, db: Session = None):
+    """
+    Most recent report runs first
+    """
+    should_close = False
+    if db is None:
+        db = SessionLocal()
+        should_close = True
+
+    try:
+        query = db.query(SEOReport)
+        if report_type:
+            query = query.filter(SEOReport.report_type == report_type)
+        reports = query.order_by(SEOReport.id.desc()).limit(limit).all()
+        return [_report_to_dict(r) for r in reports]
+    finally:
+        if should_close:
+            db.close()
+
+
+def get_report_run(report_id: int, db: Session = None):
+    """
+    One report run with its stages in execution order, or None
+    """
+    should_close = False
+    if db is None:
+        db = SessionLocal()
+        should_close = True
+
+    try:
+        report = db.get(SEOReport, report_id)
+        if report is None:
+            return None
+        stages = (
+            db.query(ReportStage)
+            .filter(ReportStage.report_id == report_id)
+            .order_by(ReportStage.id)
+            .all()
+        )
+        result = _report_to_dict(report)
+        result["stages"] = [_stage_to_dict(s) for s in stages]
+        return result
+    finally:
+        if should_close:
+            db.close()
+
+
 # -------------------------
 # Batch store all CSV files in a directory
 # -------------------------
@@ -0,0 +1,32 @@
+# migrations.py
+"""
+Idempotent schema upgrades for existing databases.
+
+Base.metadata.create_all only creates missing tables; columns added to a
+table after it was first created are added here, with their indexes.
+Safe to run on every start (init_db, create_tables.py).
+"""
+from sqlalchemy import inspect, text
+
+# table -> columns added after the table's first release
+ADDED_COLUMNS = {
+    "seo_reports": ["run_id", "task_id", "finished_at"],
+}
+
+
+def run_migrations(engine, metadata):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table_name, columns in ADDED_COLUMNS.items():
+            if not inspector.has_table(table_name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table_name)}
+            table = metadata.tables[table_name]
+            for name in columns:
+                column = table.c[name]
+                if name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}"))
+                    print(f"🔧 Added column {table_name}.{name}")
+                if column.index:
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table_name}_{name} ON {table_name} ({name})"))
@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, Boolean, ForeignKey
 from sqlalchemy.sql import func
 import sys
 import os
@@ -76,17 +76,38 @@ class SEOReport(Base):
     __tablename__ = "seo_reports"
     
     id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String(100), nullable=True, index=True)  # artifact store run id
+    task_id = Column(String(255), nullable=True, index=True)  # Celery task id
     week_start = Column(Date, nullable=False)
     week_end = Column(Date, nullable=False)
     report_type = Column(String(50), nullable=False)  # 'weekly', 'monthly', etc.
     pdf_path = Column(Text, nullable=True)
     csv_paths = Column(Text, nullable=True)  # JSON string of file paths
-    status = Column(String(50), default='generated')  # 'generated', 'sent', 'failed'
+    status = Column(String(50), default='generated')  # 'running', 'generated', 'sent', 'failed'
     gemini_summary = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
     sent_at = Column(DateTime(timezone=True), nullable=True)
 
 
+# -------------------------
+# Report Pipeline Stages Table
+# -------------------------
+class ReportStage(Base):
+    __tablename__ = "report_stages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    report_id = Column(Integer, ForeignKey("seo_reports.id"), nullable=False, index=True)
+    name = Column(String(100), nullable=False)
+    status = Column(String(50), default='running')  # 'running', 'success', 'failed', 'skipped'
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    duration_seconds = Column(Float, nullable=True)
+    row_count = Column(Integer, nullable=True)
+    artifact_paths = Column(Text, nullable=True)  # JSON string of file paths
+    error = Column(Text, nullable=True)
+
+
 # -------------------------
 # Preprocessed Data Table (Optional)
 # -------------------------
@@ -0,0 +1,381 @@
+# artifact_store.py
+import os
+import json
+import glob
+import hashlib
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+import zstandard as zstd
+from metrics import BYTES_WRITTEN
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: thread lock only
+    fcntl = None
+
+# -------------------------
+# CONFIG
+# -------------------------
+ARTIFACT_DIR = os.path.join(os.getcwd(), os.getenv("ARTIFACT_DIR", "artifacts"))
+ZSTD_LEVEL = int(os.getenv("ARTIFACT_ZSTD_LEVEL", "10"))
+
+# Only report files are versioned; weekly zips and logs stay out of the store
+DEFAULT_EXTENSIONS = (".csv", ".txt", ".pdf")
+
+CHUNK_SIZE = 1024 * 1024
+
+# A "running" run whose manifest has not been touched for this long is
+# treated as crashed and may be resumed
+RESUME_STALE_SECONDS = int(os.getenv("RESUME_STALE_SECONDS", str(6 * 3600)))
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+# -------------------------
+# HASHING
+# -------------------------
+def file_sha256(path: str) -> str:
+    """Content hash of a file, read in chunks so large CSVs stay out of memory."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _object_path(sha: str, store_dir: str = ARTIFACT_DIR) -> str:
+    return os.path.join(store_dir, "objects", sha[:2], f"{sha}.zst")
+
+
+# -------------------------
+# OBJECTS (content-addressed, zstd)
+# -------------------------
+def _object_complete(obj_path: str, size: int) -> bool:
+    """An existing object whose zstd frame header declares the source size."""
+    try:
+        with open(obj_path, "rb") as f:
+            return zstd.frame_content_size(f.read(18)) == size
+    except (OSError, zstd.ZstdError):
+        return False
+
+
+def store_file(path: str, store_dir: str = ARTIFACT_DIR) -> dict:
+    """
+    Store one file as a zstd object named by its content hash.
+    Identical content is written only once; "new" tells whether bytes were added.
+
+    Each writer compresses into its own temp file and publishes it with
+    os.replace, so concurrent snapshots of the same content never share a
+    half-written file; an object that does not look complete is rewritten.
+    """
+    sha = file_sha256(path)
+    obj_path = _object_path(sha, store_dir)
+    size = os.path.getsize(path)
+    is_new = not _object_complete(obj_path, size)
+
+    if is_new:
+        os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+        tmp_path = f"{obj_path}.{uuid.uuid4().hex}.tmp"
+        cctx = zstd.ZstdCompressor(level=ZSTD_LEVEL)
+        try:
+            with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+                cctx.copy_stream(src, dst, size=size)
+            os.replace(tmp_path, obj_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return {
+        "sha256": sha,
+        "size": size,
+        "stored_size": os.path.getsize(obj_path),
+        "new": is_new,
+    }
+
+
+def restore_file(sha: str, dest_path: str, store_dir: str = ARTIFACT_DIR) -> str:
+    """Decompress a stored object back to dest_path."""
+    obj_path = _object_path(sha, store_dir)
+    if not os.path.exists(obj_path):
+        raise FileNotFoundError(f"Artifact object missing: {sha}")
+
+    os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+    dctx = zstd.ZstdDecompressor()
+    with open(obj_path, "rb") as src, open(dest_path, "wb") as dst:
+        dctx.copy_stream(src, dst)
+    return dest_path
+
+
+# -------------------------
+# RUN MANIFESTS
+# -------------------------
+def new_run_id(kind: str) -> str:
+    """kind-<timestamp to the microsecond>-<random suffix>: unique, and name order is time order."""
+    return f"{kind}-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:6]}"
+
+
+def _manifest_path(run_id: str, store_dir: str = ARTIFACT_DIR) -> str:
+    return os.path.join(store_dir, "runs", run_id, "manifest.json")
+
+
+def run_dir(run_id: str, store_dir: str = ARTIFACT_DIR) -> str:
+    """Scratch directory of a run (progress files that must survive a crash)."""
+    path = os.path.join(store_dir, "runs", run_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def load_manifest(run_id: str, store_dir: str = ARTIFACT_DIR) -> dict:
+    path = _manifest_path(run_id, store_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, store_dir: str = ARTIFACT_DIR) -> str:
+    path = _manifest_path(manifest["run_id"], store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    manifest["updated_at"] = datetime.now().isoformat(timespec="seconds")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _empty_manifest(run_id: str, kind: str) -> dict:
+    return {
+        "run_id": run_id,
+        "kind": kind,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "files": {},
+        "stages": {},
+    }
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """Exclusive lock on lock_path across worker threads and processes."""
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(os.path.abspath(lock_path), threading.Lock())
+    with thread_lock, open(lock_path, "w") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _manifest_lock(run_id: str, store_dir: str = ARTIFACT_DIR):
+    """Serialize manifest updates across worker threads and processes."""
+    return file_lock(os.path.join(store_dir, "runs", run_id, "manifest.lock"))
+
+
+def update_manifest(run_id: str, kind: str, update, store_dir: str = ARTIFACT_DIR) -> dict:
+    """Read-modify-write a run manifest under the run lock. update(manifest) edits in place."""
+    with _manifest_lock(run_id, store_dir):
+        manifest = load_manifest(run_id, store_dir) or _empty_manifest(run_id, kind)
+        update(manifest)
+        save_manifest(manifest, store_dir)
+    return manifest
+
+
+def list_runs(kind: str = None, store_dir: str = ARTIFACT_DIR) -> list:
+    """Run ids, oldest first. Run ids embed their timestamp so name order is time order."""
+    pattern = os.path.join(store_dir, "runs", f"{kind}-*" if kind else "*", "manifest.json")
+    return sorted(os.path.basename(os.path.dirname(p)) for p in glob.glob(pattern))
+
+
+def latest_manifest(kind: str, before_run_id: str = None, store_dir: str = ARTIFACT_DIR) -> dict:
+    runs = [r for r in list_runs(kind, store_dir) if before_run_id is None or r < before_run_id]
+    return load_manifest(runs[-1], store_dir) if runs else None
+
+
+# -------------------------
+# SNAPSHOT / RESTORE
+# -------------------------
+def snapshot(src_dir: str, kind: str, run_id: str = None, prefix: str = None,
+             extensions=DEFAULT_EXTENSIONS, store_dir: str = ARTIFACT_DIR) -> dict:
+    """
+    Store every report file under src_dir into the artifact store and record it
+    in the run manifest. Calling it again with the same run_id adds to that run.
+    """
+    run_id = run_id or new_run_id(kind)
+    prefix = prefix if prefix is not None else os.path.basename(os.path.normpath(src_dir))
+    files = {}
+    new_bytes = 0
+
+    for path in sorted(glob.glob(os.path.join(src_dir, "**", "*"), recursive=True)):
+        if not os.path.isfile(path) or not path.lower().endswith(extensions):
+            continue
+
+        rel_path = os.path.join(prefix, os.path.relpath(path, src_dir)).replace(os.sep, "/")
+        entry = store_file(path, store_dir)
+        if entry.pop("new"):
+            new_bytes += entry["stored_size"]
+        files[rel_path] = entry
+
+    manifest = update_manifest(run_id, kind, lambda m: m["files"].update(files), store_dir)
+    if new_bytes:
+        BYTES_WRITTEN.labels("artifact_store").inc(new_bytes)
+    print(f"🗄️ Snapshot {run_id}: {len(manifest['files'])} files, {new_bytes} new bytes stored")
+    return manifest
+
+
+def restore_run(run_id: str, dest_dir: str, prefix: str = None, store_dir: str = ARTIFACT_DIR) -> list:
+    """Materialize the files of a run (optionally only those under prefix) into dest_dir."""
+    manifest = load_manifest(run_id, store_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"Unknown run: {run_id}")
+
+    restored = []
+    for rel_path, entry in manifest["files"].items():
+        if prefix and not rel_path.startswith(prefix.rstrip("/") + "/"):
+            continue
+        target_rel = rel_path[len(prefix.rstrip("/")) + 1:] if prefix else rel_path
+        restored.append(restore_file(entry["sha256"], os.path.join(dest_dir, target_rel), store_dir))
+    return restored
+
+
+# -------------------------
+# CHANGE DETECTION
+# -------------------------
+def diff_manifests(old: dict, new: dict) -> dict:
+    old_files = (old or {}).get("files", {})
+    new_files = (new or {}).get("files", {})
+
+    return {
+        "added": sorted(p for p in new_files if p not in old_files),
+        "removed": sorted(p for p in old_files if p not in new_files),
+        "changed": sorted(
+            p for p in new_files
+            if p in old_files and new_files[p]["sha256"] != old_files[p]["sha256"]
+        ),
+        "unchanged": sorted(
+            p for p in new_files
+            if p in old_files and new_files[p]["sha256"] == old_files[p]["sha256"]
+        ),
+    }
+
+
+def changes_since_previous(manifest: dict, store_dir: str = ARTIFACT_DIR) -> dict:
+    """Diff a run against the previous run of the same kind."""
+    previous = latest_manifest(manifest["kind"], before_run_id=manifest["run_id"], store_dir=store_dir)
+    return diff_manifests(previous, manifest)
+
+
+# -------------------------
+# CHECKPOINT / RESUME
+# -------------------------
+def start_run(kind: str, params: dict = None, run_id: str = None, store_dir: str = ARTIFACT_DIR) -> str:
+    """Create (or reopen) a run manifest in 'running' state and return its id."""
+    run_id = run_id or new_run_id(kind)
+
+    def _start(manifest):
+        manifest["status"] = "running"
+        if params:
+            manifest["params"] = params
+
+    update_manifest(run_id, kind, _start, store_dir)
+    return run_id
+
+
+def finish_run(run_id: str, status: str = "complete", store_dir: str = ARTIFACT_DIR):
+    """Close a run: 'complete', 'partial' (some stages failed) or 'failed'."""
+    manifest = load_manifest(run_id, store_dir)
+    if manifest is None:
+        return
+    update_manifest(run_id, manifest["kind"], lambda m: m.update(status=status), store_dir)
+
+
+def find_resumable_run(kind: str, params: dict = None, store_dir: str = ARTIFACT_DIR) -> str:
+    """
+    Latest run of this kind with the same params that did not complete:
+    failed/partial runs, or 'running' runs that went stale (crashed worker).
+    """
+    for run_id in reversed(list_runs(kind, store_dir)):
+        manifest = load_manifest(run_id, store_dir)
+        if manifest.get("params", {}) != (params or {}):
+            continue
+        status = manifest.get("status", "complete")
+        if status == "complete":
+            return None
+        if status in ("failed", "partial"):
+            return run_id
+        updated_at = datetime.fromisoformat(manifest["updated_at"])
+        if (datetime.now() - updated_at).total_seconds() > RESUME_STALE_SECONDS:
+            return run_id
+        return None
+    return None
+
+
+def mark_stage_complete(run_id: str, stage: str, outputs=None, result=None,
+                        store_dir: str = ARTIFACT_DIR):
+    """Store the stage outputs and record the completion marker in the run manifest."""
+    stored = {}
+    for path in outputs or []:
+        if path and os.path.isfile(path):
+            entry = store_file(path, store_dir)
+            entry.pop("new")
+            stored[os.path.abspath(path)] = entry
+
+    def _mark(manifest):
+        manifest["stages"][stage] = {
+            "completed_at": datetime.now().isoformat(timespec="seconds"),
+            "outputs": stored,
+            "result": result,
+        }
+
+    manifest = load_manifest(run_id, store_dir) or {}
+    update_manifest(run_id, manifest.get("kind", run_id.rsplit("-", 1)[0]), _mark, store_dir)
+
+
+def completed_stage(run_id: str, stage: str, store_dir: str = ARTIFACT_DIR) -> dict:
+    """
+    The completion record of a stage, or None if it has to run.
+    Outputs that were deleted or overwritten since are restored from the store.
+    """
+    manifest = load_manifest(run_id, store_dir) if run_id else None
+    record = (manifest or {}).get("stages", {}).get(stage)
+    if record is None:
+        return None
+
+    for path, entry in record["outputs"].items():
+        if os.path.isfile(path) and file_sha256(path) == entry["sha256"]:
+            continue
+        try:
+            restore_file(entry["sha256"], path, store_dir)
+            print(f"♻️ Restored checkpoint output: {path}")
+        except FileNotFoundError:
+            return None
+    return record
+
+
+def checkpoint(run_id: str, stage: str, fn, *args, outputs=None, store_dir: str = ARTIFACT_DIR, **kwargs):
+    """
+    Run fn(*args, **kwargs) once per run. If the stage already completed in
+    this run, its outputs are restored and its recorded result is returned.
+
+    outputs: list of output paths, or a callable mapping the result to them.
+    The result must be JSON-serializable. Without a run_id fn just runs.
+    """
+    if not run_id:
+        return fn(*args, **kwargs)
+
+    record = completed_stage(run_id, stage, store_dir)
+    if record is not None:
+        print(f"⏭️ Stage {stage} already completed in {run_id}, skipping")
+        return record["result"]
+
+    result = fn(*args, **kwargs)
+    paths = outputs(result) if callable(outputs) else outputs
+    mark_stage_complete(run_id, stage, outputs=paths, result=result, store_dir=store_dir)
+    return result
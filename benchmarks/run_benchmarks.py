@@ -0,0 +1,347 @@
+# benchmarks/run_benchmarks.py
+"""
+Benchmarks for the stages that grow with site size.
+
+    python -m benchmarks.run_benchmarks                      # 10k, 100k, 1m
+    python -m benchmarks.run_benchmarks --sizes 10k --repeat 3
+    python -m benchmarks.run_benchmarks --cases process_file_cwv,aggregate_errors
+
+Each case is timed over --repeat runs (best and mean wall time, CPU time),
+then run once more under tracemalloc for peak Python/NumPy memory. Results
+go to benchmarks/results/<commit>-<timestamp>.json for comparison across
+commits. Cases whose dependencies are unavailable are recorded as skipped.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.synthetic_data import SIZES, parse_size, ensure_site
+
+BENCH_DIR = os.path.join(ROOT_DIR, "benchmarks")
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+AGGREGATE_FILES = ["Landing page.csv", "pages.csv", "final_pages_indexing_performance_cwv.csv"]
+
+
+# -------------------------
+# CASES
+# -------------------------
+# Each case: setup(ctx) -> state (untimed), run(state) -> rows processed (timed)
+def _preprocessed_frame(ctx):
+    from preprocessing.preprocessing import normalize_columns, detect_seo_errors
+    df = pd.read_csv(ctx["files"]["final_cwv"])
+    df = df.rename(columns={"url": "page"})
+    return detect_seo_errors(normalize_columns(df))
+
+
+def _setup_process_file(role, stream=False):
+    def setup(ctx):
+        from preprocessing.preprocessing import process_file
+        out_dir = os.path.join(ctx["work_dir"], "preprocessed")
+        return process_file, ctx["files"][role], out_dir, ctx["data_dir"], stream
+    return setup
+
+
+def _run_process_file(state):
+    process_file, path, out_dir, input_base, stream = state
+    process_file(path, out_dir, AGGREGATE_FILES, input_base=input_base, stream=stream)
+    return None
+
+
+def _setup_aggregate(ctx):
+    from preprocessing.preprocessing import aggregate_page_metrics, aggregate_errors
+    return aggregate_page_metrics, aggregate_errors, _preprocessed_frame(ctx)
+
+
+def _run_aggregate_page_metrics(state):
+    aggregate_page_metrics, _, df = state
+    return len(aggregate_page_metrics(df.copy()))
+
+
+def _run_aggregate_errors(state):
+    _, aggregate_errors, df = state
+    return len(aggregate_errors(df.copy()))
+
+
+def _setup_gemini_summary(ctx):
+    from preprocessing.preprocessing import aggregate_page_metrics, aggregate_errors, build_gemini_summary
+    df = _preprocessed_frame(ctx)
+    return build_gemini_summary, aggregate_page_metrics(df.copy()), aggregate_errors(df.copy())
+
+
+def _run_gemini_summary(state):
+    build_gemini_summary, page_df, error_df = state
+    return len(build_gemini_summary(page_df, error_df).splitlines())
+
+
+def _setup_store(fn_name, role):
+    def setup(ctx):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        import DB.db_utils as db_utils
+        from DB.database import Base
+
+        db_path = os.path.join(ctx["work_dir"], "bench.db")
+        url = os.getenv("BENCH_DATABASE_URL", f"sqlite:///{db_path}")
+        engine = create_engine(url)
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+        return getattr(db_utils, fn_name), ctx["files"][role], session
+    return setup
+
+
+def _run_store(state):
+    store, path, session = state
+    return store(path, db=session)
+
+
+def _setup_merge_indexing(ctx):
+    from gsc_utils import merge_indexing_with_performance
+    return merge_indexing_with_performance, ctx["files"]["indexing"], ctx["data_dir"]
+
+
+def _run_merge_indexing(state):
+    merge_indexing_with_performance, indexing_csv, output_dir = state
+    return len(pd.read_csv(merge_indexing_with_performance(indexing_csv, output_dir), usecols=[0]))
+
+
+def _setup_pdf(ctx):
+    """A report with one bullet per 100 pages, in the numbered sections Gemini returns."""
+    from pdf_utils import generate_seo_pdf
+    from preprocessing.preprocessing import aggregate_page_metrics, aggregate_errors, build_gemini_summary
+    df = _preprocessed_frame(ctx)
+    limit = max(ctx["pages"] // 100, 20)
+    lines = build_gemini_summary(aggregate_page_metrics(df.copy()), aggregate_errors(df.copy()), limit=limit)
+    lines = lines.splitlines()
+    sections = ["Executive Summary", "Indexing Issues", "Core Web Vitals Issues", "CTR Issues",
+                "Content Issues", "Technical SEO Issues", "Fix Priority Roadmap", "Final SEO Verdict"]
+    per_section = max(len(lines) // len(sections), 1)
+    text = "\n".join(
+        f"{i}. {title}\n" + "\n".join(f"- {line}" for line in lines[(i - 1) * per_section:i * per_section])
+        for i, title in enumerate(sections, start=1)
+    )
+    return generate_seo_pdf, os.path.join(ctx["work_dir"], "Weekly_SEO_Report.pdf"), text
+
+
+def _run_pdf(state):
+    generate_seo_pdf, pdf_path, text = state
+    generate_seo_pdf(pdf_path, text)
+    return len(text.splitlines())
+
+
+def _setup_pdf_batch(ctx):
+    """Eight copies of the generate_seo_pdf report, rendered on PDF_WORKERS processes."""
+    from pdf_utils import generate_seo_pdfs
+    _, _, text = _setup_pdf(ctx)
+    jobs = [(os.path.join(ctx["work_dir"], "batch", f"Weekly_SEO_Report_{i}.pdf"), text) for i in range(8)]
+    return generate_seo_pdfs, jobs
+
+
+def _run_pdf_batch(state):
+    generate_seo_pdfs, jobs = state
+    _quiet(generate_seo_pdfs, jobs)
+    return sum(len(text.splitlines()) for _, text in jobs)
+
+
+def _setup_findings(ctx):
+    """The report task's inputs: top-level preprocessed CSVs plus the raw indexing status file."""
+    from preprocessing.preprocessing import process_file
+    from findings import compute_findings, render_findings_report, report_inputs
+    out_dir = os.path.join(ctx["work_dir"], "findings")
+    _quiet(process_file, ctx["files"]["final_cwv"], out_dir, AGGREGATE_FILES, ctx["data_dir"])
+    csv_files = sorted(os.path.join(out_dir, f) for f in os.listdir(out_dir) if f.endswith(".csv"))
+    return compute_findings, render_findings_report, report_inputs(csv_files, ctx["files"]["indexing"])
+
+
+def _run_findings(state):
+    compute_findings, render_findings_report, csv_files = state
+    findings = _quiet(compute_findings, csv_files)
+    render_findings_report(findings)
+    return len(findings)
+
+
+def _setup_gemini_stub(ctx):
+    """Client against the local stub: 100 ms answers, 20% random 503s, fast backoff."""
+    from gemini_client import GeminiClient, CircuitBreaker
+    from gemini_stub import start_stub
+    from prompt_budget import compact_dataset
+    _, _, base_url = start_stub(latency=0.1, jitter=0.05, fail_rate=0.2)
+    client = GeminiClient("stub-model", "stub-key", base_url=base_url, backoff_base=0.05,
+                          breaker=CircuitBreaker(failures=1000))
+    prompt, _ = _quiet(compact_dataset, [ctx["files"]["final_cwv"], ctx["files"]["indexing"]])
+    return client, prompt
+
+
+def _run_gemini_stub(state):
+    client, prompt = state
+    calls = 20
+    for _ in range(calls):
+        _quiet(client.generate, prompt)
+    return calls
+
+
+CASES = {
+    "process_file_cwv": (_setup_process_file("final_cwv"), _run_process_file),
+    "process_file_cwv_streaming": (_setup_process_file("final_cwv", stream=True), _run_process_file),
+    "process_file_landing_page": (_setup_process_file("landing_page"), _run_process_file),
+    "aggregate_page_metrics": (_setup_aggregate, _run_aggregate_page_metrics),
+    "aggregate_errors": (_setup_aggregate, _run_aggregate_errors),
+    "build_gemini_summary": (_setup_gemini_summary, _run_gemini_summary),
+    "store_ga4_csv": (_setup_store("store_ga4_csv", "landing_page"), _run_store),
+    "store_gsc_csv": (_setup_store("store_gsc_csv", "gsc_queries"), _run_store),
+    "store_indexing_csv": (_setup_store("store_indexing_csv", "final_cwv"), _run_store),
+    "merge_indexing_with_performance": (_setup_merge_indexing, _run_merge_indexing),
+    "generate_seo_pdf": (_setup_pdf, _run_pdf),
+    "generate_seo_pdf_batch": (_setup_pdf_batch, _run_pdf_batch),
+    "findings": (_setup_findings, _run_findings),
+    "gemini_client_stub": (_setup_gemini_stub, _run_gemini_stub),
+}
+
+
+# -------------------------
+# RUNNER
+# -------------------------
+def _quiet(fn, *args):
+    """The pipeline functions print per file/row; keep the benchmark output readable."""
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        return fn(*args)
+
+
+def run_case(name: str, ctx: dict, repeat: int = 1, memory: bool = True) -> dict:
+    setup, run = CASES[name]
+    result = {"case": name, "size": ctx["size"], "pages": ctx["pages"], "repeat": repeat}
+
+    try:
+        state = _quiet(setup, ctx)
+    except ImportError as e:
+        return {**result, "status": "skipped", "error": f"{type(e).__name__}: {e}"}
+
+    try:
+        wall, cpu = [], []
+        for _ in range(repeat):
+            started, cpu_started = time.perf_counter(), time.process_time()
+            rows = _quiet(run, state)
+            wall.append(time.perf_counter() - started)
+            cpu.append(time.process_time() - cpu_started)
+
+        peak_mb = None
+        if memory:
+            tracemalloc.start()
+            try:
+                _quiet(run, state)
+                peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            finally:
+                tracemalloc.stop()
+    except Exception as e:
+        return {**result, "status": "error", "error": f"{type(e).__name__}: {e}"}
+
+    return {
+        **result,
+        "status": "ok",
+        "rows": rows,
+        "wall_seconds_best": round(min(wall), 4),
+        "wall_seconds_mean": round(sum(wall) / len(wall), 4),
+        "cpu_seconds_mean": round(sum(cpu) / len(cpu), 4),
+        "peak_memory_mb": round(peak_mb, 2) if peak_mb is not None else None,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(sizes, cases, repeat: int = 1, memory: bool = True, seed: int = 42,
+                   data_dir: str = DATA_DIR) -> dict:
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "results": [],
+    }
+
+    for size in sizes:
+        pages = parse_size(size)
+        site_dir = os.path.join(data_dir, f"{size}-seed{seed}")
+        files = ensure_site(site_dir, pages, seed)
+        work_dir = os.path.join(site_dir, "work")
+        os.makedirs(work_dir, exist_ok=True)
+        ctx = {"size": size, "pages": pages, "files": files, "data_dir": site_dir, "work_dir": work_dir}
+
+        for name in cases:
+            result = run_case(name, ctx, repeat=repeat, memory=memory)
+            report["results"].append(result)
+            if result["status"] == "ok":
+                print(
+                    f"⏱️ {size:>5} {name:<32} {result['wall_seconds_best']:>9.3f}s "
+                    f"cpu {result['cpu_seconds_mean']:>8.3f}s  peak {result['peak_memory_mb'] or 0:>9.1f} MB"
+                )
+            else:
+                print(f"⚠️ {size:>5} {name:<32} {result['status']}: {result['error']}")
+
+    report["meta"]["finished_at"] = datetime.now().isoformat(timespec="seconds")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the size-dependent pipeline stages")
+    parser.add_argument("--sizes", default=",".join(SIZES), help="comma-separated: 10k,100k,1m or page counts")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma-separated case names")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--output", help="results JSON path (default: benchmarks/results/<commit>-<time>.json)")
+    args = parser.parse_args(argv)
+
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    report = run_benchmarks(
+        [s.strip() for s in args.sizes.split(",") if s.strip()],
+        cases,
+        repeat=args.repeat,
+        memory=not args.no_memory,
+        seed=args.seed,
+        data_dir=args.data_dir,
+    )
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{report['meta']['commit']}-{datetime.now().strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"📄 Results written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# benchmarks/synthetic_data.py
+"""
+Synthetic large-site data in the same layout and columns the fetchers write
+to output/ (GA4 landing pages, GSC performance, URL inspection, PSI/CWV).
+
+Distributions are skewed like a real site: a few pages get most of the
+impressions, CTR falls with position, most pages are indexed and most
+CWV values are fine with a long slow tail.
+"""
+import os
+import json
+import argparse
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+SECTIONS = ["blog", "product", "category", "docs", "landing", "support", "news", "tag"]
+QUERY_WORDS = ["seo", "wordpress", "plugin", "import", "export", "crm", "free", "best",
+               "how", "to", "guide", "download", "review", "vs", "tutorial", "pricing"]
+
+COVERAGE_STATES = {
+    "PASS": ["Submitted and indexed", "Indexed, not submitted in sitemap"],
+    "NEUTRAL": ["Crawled - currently not indexed", "Discovered - currently not indexed",
+                "Alternate page with proper canonical tag"],
+    "FAIL": ["Not found (404)", "Server error (5xx)", "Blocked by robots.txt"],
+}
+
+GENERATOR_VERSION = 1
+
+
+def parse_size(size) -> int:
+    if isinstance(size, int):
+        return size
+    return SIZES.get(size.lower()) or int(size)
+
+
+def _urls(rng, pages: int, site: str) -> np.ndarray:
+    sections = rng.choice(SECTIONS, size=pages)
+    return np.char.add(
+        np.char.add(f"{site}/", sections.astype(str)),
+        np.char.add("/page-", np.arange(pages).astype(str))
+    )
+
+
+def _performance(rng, pages: int) -> pd.DataFrame:
+    """Zipf-like impressions, position-dependent CTR."""
+    impressions = np.floor(rng.pareto(1.2, pages) * 40).astype(np.int64)
+    position = np.round(np.clip(rng.gamma(2.0, 8.0, pages) + 1, 1, 100), 1)
+    expected_ctr = 0.3 / position
+    clicks = rng.binomial(impressions, np.clip(expected_ctr, 0, 1))
+    ctr = np.where(impressions > 0, np.round(clicks / np.maximum(impressions, 1), 4), 0.0)
+    return pd.DataFrame({"clicks": clicks, "impressions": impressions, "ctr": ctr, "position": position})
+
+
+def _indexing(rng, pages: int) -> pd.DataFrame:
+    verdict = rng.choice(["PASS", "NEUTRAL", "FAIL"], size=pages, p=[0.85, 0.12, 0.03])
+    coverage = np.empty(pages, dtype=object)
+    for v, states in COVERAGE_STATES.items():
+        mask = verdict == v
+        coverage[mask] = rng.choice(states, size=mask.sum())
+    indexing_state = np.where(verdict == "FAIL", "BLOCKED_BY_ROBOTS_TXT", "INDEXING_ALLOWED")
+    last_crawl = pd.Timestamp(date.today()) - pd.to_timedelta(rng.integers(0, 90 * 86400, pages), unit="s")
+    return pd.DataFrame({
+        "coverage_state": coverage,
+        "indexing_state": indexing_state,
+        "last_crawl": last_crawl.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "verdict": verdict,
+    })
+
+
+def _cwv(rng, pages: int) -> pd.DataFrame:
+    """Lognormal lab metrics; ~20% of pages without PSI data."""
+    http_status = rng.choice([200, 301, 404, 500], size=pages, p=[0.96, 0.01, 0.02, 0.01])
+    cwv = pd.DataFrame({
+        "http_status": http_status,
+        "lcp": np.round(rng.lognormal(np.log(2500), 0.5, pages), 1),
+        "inp": np.round(rng.lognormal(np.log(180), 0.6, pages), 1),
+        "cls": np.round(rng.exponential(0.08, pages), 3),
+        "fcp": np.round(rng.lognormal(np.log(1600), 0.4, pages), 1),
+    })
+    missing = rng.random(pages) < 0.2
+    cwv.loc[missing, ["lcp", "inp", "cls", "fcp"]] = np.nan
+    return cwv
+
+
+def generate_site(output_dir: str, pages: int, seed: int = 42,
+                  site: str = "https://www.example.com") -> dict:
+    """
+    Write one synthetic site of `pages` URLs under output_dir (output/ layout).
+    Returns the paths of the generated files by role.
+    """
+    rng = np.random.default_rng(seed)
+    urls = _urls(rng, pages, site)
+    perf = _performance(rng, pages)
+    indexing = _indexing(rng, pages)
+    cwv = _cwv(rng, pages)
+    end = date.today() - timedelta(days=2)
+
+    paths = {
+        "top_pages": os.path.join(output_dir, "GSC Reports", "Performance Reports", "Top pages.csv"),
+        "gsc_queries": os.path.join(output_dir, "GSC Reports", "Performance Reports", "Queries by page.csv"),
+        "landing_page": os.path.join(output_dir, "Engagement Reports", "Landing page.csv"),
+        "indexing": os.path.join(output_dir, "url_indexing_status.csv"),
+        "final_cwv": os.path.join(output_dir, "final_pages_indexing_performance_cwv.csv"),
+    }
+    for path in paths.values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # GSC performance (fetch_gsc_performance_full)
+    top_pages = pd.DataFrame({"Top pages": urls}).join(perf.rename(columns=str.capitalize))
+    top_pages.rename(columns={"Ctr": "CTR"}).sort_values("Clicks", ascending=False).to_csv(
+        paths["top_pages"], index=False
+    )
+
+    # GSC page x query x day rows (DB ingest input), ~1.5 rows per page
+    rows = int(pages * 1.5)
+    idx = rng.integers(0, pages, rows)
+    words = rng.choice(QUERY_WORDS, size=(rows, 3))
+    queries = pd.DataFrame(words).agg(" ".join, axis=1)
+    days = rng.integers(0, 7, rows)
+    gsc = perf.iloc[idx].reset_index(drop=True)
+    pd.DataFrame({
+        "date": (pd.Timestamp(end) - pd.to_timedelta(days, unit="D")).strftime("%Y-%m-%d"),
+        "page": urls[idx],
+        "query": queries,
+    }).join(gsc).to_csv(paths["gsc_queries"], index=False)
+
+    # GA4 landing pages: path + query string variants, ~1.3 rows per page
+    rows = int(pages * 1.3)
+    idx = rng.integers(0, pages, rows)
+    paths_only = np.char.replace(urls[idx], site, "")
+    variant = np.where(rng.random(rows) < 0.25, np.char.add("?utm_source=", rng.choice(["news", "ads", "social"], rows)), "")
+    sessions = rng.poisson(np.maximum(perf["clicks"].to_numpy()[idx], 1) * 1.4)
+    pd.DataFrame({
+        "Landing page": np.char.add(paths_only, variant),
+        "Active users": np.maximum(sessions - rng.poisson(0.2 * sessions + 0.1), 0),
+        "New users": rng.binomial(sessions, 0.6),
+        "Total revenue": np.round(np.where(rng.random(rows) < 0.05, rng.gamma(2, 40, rows), 0.0), 2),
+        "Bounce rate": np.round(rng.beta(4, 6, rows), 4),
+        "Average session duration": np.round(rng.gamma(2, 45, rows), 2),
+        "Sessions": sessions,
+    }).to_csv(paths["landing_page"], index=False)
+
+    # URL inspection (combine_weekly_indexing_status output)
+    pd.DataFrame({"url": urls}).join(indexing).to_csv(paths["indexing"], index=False)
+
+    # Indexing + performance + CWV (merge_cwv_with_indexing output)
+    final = pd.DataFrame({"url": urls}).join(indexing).join(perf.rename(columns=str.capitalize)).join(cwv)
+    final.rename(columns={"Ctr": "CTR"}).to_csv(paths["final_cwv"], index=False)
+
+    with open(os.path.join(output_dir, "dataset.json"), "w", encoding="utf-8") as f:
+        json.dump({"pages": pages, "seed": seed, "version": GENERATOR_VERSION, "files": paths}, f, indent=2)
+
+    return paths
+
+
+def ensure_site(data_dir: str, pages: int, seed: int = 42) -> dict:
+    """Reuse a previously generated dataset with the same size, seed and generator version."""
+    meta_path = os.path.join(data_dir, "dataset.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if (meta["pages"], meta["seed"], meta.get("version")) == (pages, seed, GENERATOR_VERSION) \
+                and all(os.path.exists(p) for p in meta["files"].values()):
+            return meta["files"]
+    print(f"🧪 Generating synthetic site: {pages:,} pages → {data_dir}")
+    return generate_site(data_dir, pages, seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic GA4/GSC/indexing CSVs")
+    parser.add_argument("size", help="10k, 100k, 1m or a page count")
+    parser.add_argument("output_dir")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    for role, path in generate_site(args.output_dir, parse_size(args.size), args.seed).items():
+        print(f"{role}: {path}")
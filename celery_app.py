@@ -1,9 +1,11 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_shutdown
 from dotenv import load_dotenv
 
 load_dotenv()
+from metrics import mark_process_dead
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
 celery_app = Celery(
@@ -17,21 +19,36 @@ import tasks.seo_tasks   # ✅ DO NOT REMOVE
 
 celery_app.conf.timezone = "Asia/Kolkata"
 
-QUEUE_NAME = "seo_reports"
+# I/O-bound API fetching runs on a threaded pool with high concurrency;
+# CPU-bound pandas work runs on a prefork pool sized to the cores.
+IO_QUEUE = os.getenv("SEO_IO_QUEUE", "seo_io")
+CPU_QUEUE = os.getenv("SEO_CPU_QUEUE", "seo_cpu")
 
 celery_app.conf.beat_schedule = {
     "fetch_seo_report": {
         "task": "tasks.seo_tasks.fetch_and_email_report",
         "schedule": crontab(minute="*/15"),
-        "options": {"queue": QUEUE_NAME},
+        "options": {"queue": IO_QUEUE},
     }
 }
 
 celery_app.conf.task_routes = {
-    "tasks.seo_tasks.fetch_and_email_report": {"queue": QUEUE_NAME}
+    "tasks.seo_tasks.fetch_and_email_report": {"queue": IO_QUEUE},
+    "tasks.seo_tasks.fetch_ga4_section": {"queue": IO_QUEUE},
+    "tasks.seo_tasks.fetch_gsc_reports": {"queue": IO_QUEUE},
+    "tasks.seo_tasks.email_seo_report": {"queue": IO_QUEUE},
+    "tasks.seo_tasks.finalize_seo_report": {"queue": CPU_QUEUE},
 }
 
+# Long tasks: take one message at a time so idle workers can pick up the rest
+celery_app.conf.worker_prefetch_multiplier = 1
+
+# Drop live metric gauges of worker children that exit (Prometheus multiprocess mode)
+@worker_process_shutdown.connect
+def cleanup_metrics(pid=None, **kwargs):
+    mark_process_dead(pid)
+
 # 🔥 IMMEDIATE TRIGGER ON WORKER START
 @celery_app.on_after_configure.connect
 def trigger_immediately(sender, **kwargs):
-    sender.send_task("tasks.seo_tasks.fetch_and_email_report", queue=QUEUE_NAME)
+    sender.send_task("tasks.seo_tasks.fetch_and_email_report", queue=IO_QUEUE)
@@ -2,12 +2,14 @@ import os
 from celery import Celery
 from dotenv import load_dotenv
 from celery.schedules import crontab
+from celery.signals import worker_process_shutdown
 import sys
 
 load_dotenv()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, BASE_DIR)
+from metrics import mark_process_dead
 
 # -------------------------
 # Redis URL
@@ -25,11 +27,20 @@ celery_pdf_app = Celery(
 
 celery_pdf_app.conf.timezone = "Asia/Kolkata"
 
-# Dedicated queue
-QUEUE_NAME = "seo_pdf_reports"
+# Dedicated queues: preprocessing + ReportLab on a prefork pool sized to the
+# cores, email delivery on a threaded pool
+CPU_QUEUE = os.getenv("SEO_PDF_CPU_QUEUE", "seo_pdf_cpu")
+IO_QUEUE = os.getenv("SEO_PDF_IO_QUEUE", "seo_pdf_io")
 celery_pdf_app.conf.task_routes = {
-    "tasks.generate_pdf_report": {"queue": QUEUE_NAME}
+    "tasks.generate_pdf_report": {"queue": CPU_QUEUE},
+    "tasks.send_pdf_report_email": {"queue": IO_QUEUE},
 }
+celery_pdf_app.conf.worker_prefetch_multiplier = 1
+
+# Drop live metric gauges of worker children that exit (Prometheus multiprocess mode)
+@worker_process_shutdown.connect
+def cleanup_metrics(pid=None, **kwargs):
+    mark_process_dead(pid)
 
 # Auto-discover tasks
 celery_pdf_app.autodiscover_tasks(["tasks.pdf_tasks"])
@@ -41,7 +52,7 @@ celery_pdf_app.conf.beat_schedule = {
     "weekly_pdf_report": {
         "task": "tasks.generate_pdf_report",
         "schedule": crontab(hour=9, minute=0, day_of_week=1),  # Every Monday 9:00 AM
-        "options": {"queue": QUEUE_NAME}
+        "options": {"queue": CPU_QUEUE}
     }
 }
 
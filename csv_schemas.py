@@ -0,0 +1,237 @@
+# csv_schemas.py
+"""
+Schema registry and typed CSV reader for the report files in output/.
+
+Known reports are registered by file name with canonical column names,
+dtypes and the header aliases the fetchers write (GA4 display names,
+camelCase API names, GSC capitalized headers). Unknown files get a schema
+inferred from a sample, cached by header signature so the next file with
+the same header is read without inference.
+
+Files are read with the C engine (or pyarrow, CSV_ENGINE=pyarrow) and
+explicit dtypes. Malformed rows are no longer dropped silently: the file is
+re-read tolerantly and the number of skipped rows is reported.
+"""
+import os
+import csv
+import json
+import hashlib
+import tempfile
+
+import pandas as pd
+
+CSV_ENGINE = os.getenv("CSV_ENGINE", "c")
+SCHEMA_CACHE_DIR = os.path.join(os.getcwd(), os.getenv("SCHEMA_CACHE_DIR", "schema_cache"))
+INFER_SAMPLE_ROWS = 1000
+
+_INDEXING_COLUMNS = {
+    "url": "object",
+    "coverage_state": "object",
+    "indexing_state": "object",
+    "last_crawl": "object",
+    "verdict": "object",
+}
+
+# None = numeric, left to the parser: int when complete, float when a value
+# is missing (pages without GSC rows after the left merge, URLs without PSI)
+_MERGED_PERFORMANCE_COLUMNS = {
+    "clicks": None,
+    "impressions": None,
+    "ctr": "float64",
+    "position": "float64",
+}
+
+_GSC_ALIASES = {"Top pages": "page", "Clicks": "clicks", "Impressions": "impressions",
+                "CTR": "ctr", "Position": "position"}
+
+REPORT_SCHEMAS = {
+    "Top pages.csv": {
+        "columns": {"page": "object", "clicks": "int64", "impressions": "int64",
+                    "ctr": "float64", "position": "float64"},
+        "aliases": _GSC_ALIASES,
+    },
+    "url_indexing_status.csv": {
+        "columns": _INDEXING_COLUMNS,
+        "aliases": {},
+    },
+    "final_pages_indexing_performance.csv": {
+        "columns": {**_INDEXING_COLUMNS, **_MERGED_PERFORMANCE_COLUMNS},
+        "aliases": _GSC_ALIASES,
+    },
+    "final_pages_indexing_performance_cwv.csv": {
+        "columns": {**_INDEXING_COLUMNS, **_MERGED_PERFORMANCE_COLUMNS,
+                    "http_status": None, "lcp": None, "inp": None, "cls": None, "fcp": None},
+        "aliases": _GSC_ALIASES,
+    },
+    "Landing page.csv": {
+        "columns": {"page": "object", "active_users": "int64", "new_users": "int64",
+                    "total_revenue": "float64", "bounce_rate": "float64",
+                    "average_session_duration": "float64", "sessions": "int64"},
+        "aliases": {
+            "Landing page": "page", "landingPage": "page", "landingPagePlusQueryString": "page",
+            "Active users": "active_users", "activeUsers": "active_users",
+            "New users": "new_users", "newUsers": "new_users",
+            "Total revenue": "total_revenue", "totalRevenue": "total_revenue",
+            "Bounce rate": "bounce_rate", "bounceRate": "bounce_rate",
+            "Average session duration": "average_session_duration",
+            "averageSessionDuration": "average_session_duration",
+            "Sessions": "sessions",
+        },
+    },
+}
+
+_inferred_cache = {}
+
+
+# -------------------------
+# SCHEMA LOOKUP
+# -------------------------
+def read_header(path: str) -> list:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def header_signature(header: list) -> str:
+    return hashlib.sha1("\x1f".join(header).encode("utf-8")).hexdigest()
+
+
+def registered_dtypes(path: str, header: list) -> dict:
+    """dtypes by actual header name for a registered report, else None."""
+    schema = REPORT_SCHEMAS.get(os.path.basename(path))
+    if schema is None:
+        return None
+    aliases = schema["aliases"]
+    dtypes = {}
+    for column in header:
+        canonical = aliases.get(column, column)
+        if schema["columns"].get(canonical) is not None:
+            dtypes[column] = schema["columns"][canonical]
+    return dtypes
+
+
+def _cache_path(signature: str) -> str:
+    return os.path.join(SCHEMA_CACHE_DIR, f"{signature}.json")
+
+
+def _pinned(dtypes: dict) -> dict:
+    """
+    Only numeric columns are pinned in an inferred schema; text columns are
+    inferred per file, so one file with a stray token ("-" in LCP) cannot
+    turn a numeric column into text for every later file with that header.
+    """
+    return {column: dtype for column, dtype in dtypes.items() if dtype != "object"}
+
+
+def _store_inferred(signature: str, dtypes: dict):
+    """
+    Cache the schema for this process and on disk. Pool workers may store
+    the same signature at once: each writes its own temp file, and a failed
+    disk write only costs a re-inference later.
+    """
+    dtypes = _pinned(dtypes)
+    _inferred_cache[signature] = dtypes
+    tmp_path = None
+    try:
+        os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=SCHEMA_CACHE_DIR,
+                                         suffix=".tmp", delete=False) as f:
+            tmp_path = f.name
+            json.dump(dtypes, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, _cache_path(signature))
+    except OSError as e:
+        print(f"⚠️ Could not cache schema {signature[:12]}: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def frame_dtypes(df: pd.DataFrame) -> dict:
+    dtypes = {}
+    for column, dtype in df.dtypes.items():
+        if pd.api.types.is_integer_dtype(dtype):
+            dtypes[column] = "int64"
+        elif pd.api.types.is_float_dtype(dtype):
+            dtypes[column] = "float64"
+        else:
+            dtypes[column] = "object"
+    return dtypes
+
+
+def inferred_dtypes(path: str, header: list) -> dict:
+    """Schema of an unregistered file, inferred once per header signature."""
+    signature = header_signature(header)
+    if signature in _inferred_cache:
+        return _inferred_cache[signature]
+    if os.path.exists(_cache_path(signature)):
+        with open(_cache_path(signature), "r", encoding="utf-8") as f:
+            _inferred_cache[signature] = _pinned(json.load(f))
+        return _inferred_cache[signature]
+
+    sample = pd.read_csv(path, nrows=INFER_SAMPLE_ROWS, engine="c", on_bad_lines="skip")
+    _store_inferred(signature, frame_dtypes(sample))
+    return _inferred_cache[signature]
+
+
+def schema_for(path: str, header: list = None) -> dict:
+    header = header if header is not None else read_header(path)
+    dtypes = registered_dtypes(path, header)
+    return dtypes if dtypes is not None else inferred_dtypes(path, header)
+
+
+# -------------------------
+# READER
+# -------------------------
+def _read_tolerant(path: str, dtypes: dict) -> pd.DataFrame:
+    """Python engine, skipping malformed rows but counting them."""
+    bad_lines = []
+
+    def skip(line):
+        bad_lines.append(line)
+        return None
+
+    df = pd.read_csv(path, engine="python", dtype=dtypes, on_bad_lines=skip)
+    if bad_lines:
+        print(f"⚠️ Skipped {len(bad_lines)} malformed rows in {os.path.basename(path)}")
+    return df
+
+
+def read_report_csv(path: str, dtypes: dict = None) -> pd.DataFrame:
+    """
+    Read a report CSV with the registered (or cached inferred) dtypes.
+
+    Falls back to parser inference when the data does not fit the schema
+    (e.g. an int column with missing values) and refreshes the cached
+    schema of unregistered files.
+    """
+    header = read_header(path)
+    if not header:
+        return pd.DataFrame()
+    dtypes = dtypes if dtypes is not None else schema_for(path, header)
+
+    try:
+        try:
+            return pd.read_csv(path, engine=CSV_ENGINE, dtype=dtypes, on_bad_lines="error")
+        except pd.errors.ParserError:
+            return _read_tolerant(path, dtypes)
+    except (ValueError, TypeError):
+        # Values outside the schema: let the parser infer and relearn the schema
+        try:
+            df = pd.read_csv(path, engine=CSV_ENGINE, on_bad_lines="error")
+        except pd.errors.ParserError:
+            df = _read_tolerant(path, None)
+        if registered_dtypes(path, header) is None:
+            _store_inferred(header_signature(header), frame_dtypes(df))
+        return df
+
+
+def read_report_chunks(path: str, chunksize: int, dtypes: dict = None):
+    """
+    Iterate over a report CSV in DataFrame chunks with the same schema as
+    read_report_csv (C engine: pyarrow has no chunked reader). Raises on
+    malformed rows or values outside the schema; callers fall back to
+    read_report_csv.
+    """
+    header = read_header(path)
+    if not header:
+        return iter(())
+    dtypes = dtypes if dtypes is not None else schema_for(path, header)
+    return pd.read_csv(path, engine="c", dtype=dtypes, chunksize=chunksize, on_bad_lines="error")
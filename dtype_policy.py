@@ -0,0 +1,113 @@
+# dtype_policy.py
+"""
+Shared dtype policy for the pipeline DataFrames.
+
+    df = apply_dtype_policy(df, stage="normalize_columns")
+
+- text with few distinct values (verdicts, coverage states, devices,
+  channels) -> category
+- other text (URLs, page titles, queries) -> Arrow-backed strings
+- integers -> smallest integer type that holds the values
+- http_status -> nullable Int16; CWV timings stay float64 (NaN = no PSI data)
+  so averages keep their precision
+
+DTYPE_POLICY=off keeps the frames as read. Each application is recorded
+per stage (before/after bytes, deep) in MEMORY_REPORT and the
+seo_dataframe_memory_bytes gauge; print_memory_report() prints the summary.
+"""
+import os
+
+import pandas as pd
+
+from metrics import observe_frame_memory
+
+DTYPE_POLICY = os.getenv("DTYPE_POLICY", "lean").lower()
+
+# Text columns with at most this share of distinct values become categories
+CATEGORY_MAX_RATIO = 0.5
+CATEGORY_MIN_ROWS = 50
+
+NULLABLE_INT_COLUMNS = {"http_status": "Int16"}
+
+# Arrow strings with NaN semantics: missing values compare like in object
+# columns (NaN != "PASS" is True), so the SEO rules give the same flags.
+# Without pyarrow, text that is not a category stays object.
+try:
+    STRING_DTYPE = pd.StringDtype("pyarrow_numpy")
+except (ImportError, ValueError):
+    STRING_DTYPE = None
+
+MEMORY_REPORT = {}
+
+
+def frame_memory(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True).sum())
+
+
+def _lean_text(series: pd.Series) -> pd.Series:
+    distinct = series.nunique(dropna=True)
+    if len(series) >= CATEGORY_MIN_ROWS and distinct <= len(series) * CATEGORY_MAX_RATIO:
+        return series.astype("category")
+    return series.astype(STRING_DTYPE) if STRING_DTYPE is not None else series
+
+
+def lean_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """The policy itself, column by column, without the memory bookkeeping."""
+    converted = {}
+    for column in df.columns:
+        series = df[column]
+        if column in NULLABLE_INT_COLUMNS and pd.api.types.is_numeric_dtype(series):
+            rounded = series.round()
+            if (rounded.dropna() == series.dropna()).all():
+                converted[column] = rounded.astype(NULLABLE_INT_COLUMNS[column])
+        elif pd.api.types.is_object_dtype(series):
+            # Only real text: mixed columns (numbers read as objects) stay as they are
+            if pd.api.types.infer_dtype(series, skipna=True) == "string":
+                converted[column] = _lean_text(series)
+        elif pd.api.types.is_integer_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+            converted[column] = pd.to_numeric(series, downcast="integer")
+    if not converted:
+        return df
+    return df.assign(**converted)
+
+
+def apply_dtype_policy(df: pd.DataFrame, stage: str) -> pd.DataFrame:
+    if DTYPE_POLICY == "off" or df.empty:
+        return df
+    before = frame_memory(df)
+    df = lean_dtypes(df)
+    after = frame_memory(df)
+
+    entry = MEMORY_REPORT.setdefault(stage, {"calls": 0, "rows": 0, "before_bytes": 0, "after_bytes": 0})
+    entry["calls"] += 1
+    entry["rows"] += len(df)
+    entry["before_bytes"] += before
+    entry["after_bytes"] += after
+    observe_frame_memory(stage, before, after)
+    return df
+
+
+def take_memory_report() -> dict:
+    """The stages recorded in this process since the last call (then cleared)."""
+    report = {stage: dict(entry) for stage, entry in MEMORY_REPORT.items()}
+    MEMORY_REPORT.clear()
+    return report
+
+
+def merge_memory_reports(reports) -> dict:
+    """Sum per-stage reports, e.g. the ones returned by pool workers."""
+    merged = {}
+    for report in reports:
+        for stage, entry in (report or {}).items():
+            total = merged.setdefault(stage, dict.fromkeys(entry, 0))
+            for key, value in entry.items():
+                total[key] += value
+    return merged
+
+
+def print_memory_report(report: dict = None):
+    report = report if report is not None else MEMORY_REPORT
+    for stage, entry in report.items():
+        before, after = entry["before_bytes"] / 1024 ** 2, entry["after_bytes"] / 1024 ** 2
+        saved = 1 - after / before if before else 0
+        print(f"🧠 {stage}: {before:.1f} MB → {after:.1f} MB ({saved:.0%} less, {entry['rows']} rows)")
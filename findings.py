@@ -0,0 +1,371 @@
+# findings.py
+"""
+Deterministic SEO findings, computed from the preprocessed CSVs and the raw
+URL Inspection status file before any Gemini call: one row per (page, issue)
+with the observed metric, a fix, priority (P1/P2/P3) and owner.
+
+    findings = compute_findings(report_inputs(csv_files, indexing_status_csv))
+    table = findings_table(findings)                # compact text for the prompt
+    text = render_findings_report(findings)         # complete report, no LLM
+    text = render_findings_report(findings, commentary=gemini_answer)
+
+Issue thresholds come from preprocessing.SEO_RULES (SEO_RULES_FILE overrides
+apply here too). Priorities follow traffic: FINDINGS_P1_IMPRESSIONS and
+FINDINGS_P2_IMPRESSIONS weekly impressions.
+
+REPORT_MODE=findings asks Gemini only for commentary around the findings
+table; REPORT_MODE=local skips Gemini. In every mode the findings report
+replaces the answer when Gemini fails.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from csv_schemas import read_report_csv
+from preprocessing.preprocessing import load_seo_rules
+from prompt_budget import compact_csv, summarize_tail, estimate_tokens
+from report_sections import REPORT_ORDER, SUMMARY_TITLES, split_sections
+
+FINDINGS_P1_IMPRESSIONS = int(os.getenv("FINDINGS_P1_IMPRESSIONS", "1000"))
+FINDINGS_P2_IMPRESSIONS = int(os.getenv("FINDINGS_P2_IMPRESSIONS", "100"))
+FINDINGS_PROMPT_ROWS = int(os.getenv("FINDINGS_PROMPT_ROWS", "15"))
+FINDINGS_REPORT_ROWS = int(os.getenv("FINDINGS_REPORT_ROWS", "25"))
+
+COLUMNS = ["section", "page", "issue", "metric", "fix", "priority", "owner",
+           "total_impressions", "total_clicks"]
+PRIORITY_NAMES = {"P1": "Immediate", "P2": "High", "P3": "Medium"}
+
+# Coverage state pattern -> fix, first match wins
+INDEXING_FIXES = [
+    ("404", "Restore the page or 301-redirect it to its replacement; remove internal links to it"),
+    (r"5xx|server error", "Fix the server error (logs, hosting capacity), then request indexing"),
+    ("robots", "Allow the page in robots.txt if it should rank"),
+    ("not indexed", "Strengthen internal links and content, then request indexing in Search Console"),
+    ("canonical", "Confirm the canonical target is the intended page"),
+]
+CWV_ISSUES = {
+    "lcp": ("Poor LCP", "Optimize and preload the largest image, cut server response time"),
+    "inp": ("Poor INP", "Break up long JavaScript tasks and defer third-party scripts"),
+    "cls": ("High CLS", "Reserve space for images, ads and embeds; avoid late-loading fonts"),
+}
+SEARCH_METRICS = ["clicks", "impressions", "ctr", "position"]
+# URL Inspection status: written to the raw output dir, not preprocessed
+INDEXING_STATUS_FILE = "url_indexing_status.csv"
+
+FINDINGS_PROMPT_TEMPLATE = """
+You are a senior SEO consultant writing the commentary of a CLIENT-READY WEEKLY SEO REPORT.
+
+The findings below were computed from this week's GA4 + GSC data. Every finding
+(page, issue, metric, fix, priority, owner) is printed in the report under your
+commentary, so do not list individual findings again.
+
+Write these sections, each starting with its title alone on a line ending with a colon:
+{titles}
+
+RULES:
+- Bullet points only, 1-3 bullets per section, short & clear
+- Explain the impact and give an AI recommendation; refer to page groups or paths
+- Executive Summary: the most important findings; Fix Priority Roadmap: the order of work
+  with Priority (P1/P2/P3) and Owner; Final SEO Verdict: the overall state of the site
+- Only use facts from the findings below; never say "no data"
+
+FINDINGS:
+{findings}
+"""
+
+
+# -------------------------
+# INPUTS
+# -------------------------
+def rule_threshold(label: str, column: str, default):
+    """Threshold of `column` in the SEO rule `label`, else default."""
+    for rule in load_seo_rules():
+        if rule["label"] == label:
+            for col, _, value in rule["when"]:
+                if col == column:
+                    return value
+    return default
+
+
+def report_inputs(csv_files, indexing_status_csv: str = None) -> list:
+    """The preprocessed CSVs plus the raw URL Inspection status file, when it exists."""
+    csv_files = list(csv_files)
+    names = {os.path.basename(path) for path in csv_files}
+    if indexing_status_csv and os.path.exists(indexing_status_csv) and INDEXING_STATUS_FILE not in names:
+        csv_files.append(indexing_status_csv)
+    return csv_files
+
+
+def _read_inputs(csv_files) -> dict:
+    frames = {}
+    for path in csv_files:
+        name = os.path.basename(path)
+        try:
+            frames[name] = read_report_csv(path).rename(columns={"url": "page"})
+        except Exception as e:
+            print(f"⚠️ Findings without {name}: {e}")
+    return frames
+
+
+def _numeric(df: pd.DataFrame, column: str) -> pd.Series:
+    if column not in df.columns:
+        return pd.Series(np.nan, index=df.index)
+    return pd.to_numeric(df[column], errors="coerce")
+
+
+def _traffic_priority(impressions: pd.Series) -> np.ndarray:
+    return np.select([impressions >= FINDINGS_P1_IMPRESSIONS, impressions >= FINDINGS_P2_IMPRESSIONS],
+                     ["P1", "P2"], "P3")
+
+
+def _frame(section: str, page, issue, metric, fix, priority, owner) -> pd.DataFrame:
+    return pd.DataFrame({"section": section, "page": page, "issue": issue, "metric": metric,
+                         "fix": fix, "priority": priority, "owner": owner})
+
+
+# -------------------------
+# ISSUES (vectorized, one frame per section)
+# -------------------------
+def indexing_findings(status: pd.DataFrame) -> pd.DataFrame:
+    """Pages whose URL Inspection verdict is not PASS."""
+    passing = rule_threshold("Indexing issue", "verdict", "PASS")
+    df = status[status["verdict"].astype(object) != passing]
+    coverage = df["coverage_state"].astype(object).fillna("Unknown coverage state").astype(str)
+    lowered = coverage.str.lower()
+    fix = np.select([lowered.str.contains(pattern, regex=True) for pattern, _ in INDEXING_FIXES],
+                    [text for _, text in INDEXING_FIXES],
+                    "Inspect the URL in Search Console and fix the reported state")
+    failed = (df["verdict"].astype(object) == "FAIL").to_numpy()
+    priority = np.select([failed, lowered.str.contains("not indexed", regex=False).to_numpy()], ["P1", "P2"], "P3")
+    owner = np.where(failed, "Dev Team", "SEO Team")
+    return _frame("Indexing Issues", df["page"], "Not indexed", coverage, fix, priority, owner)
+
+
+def http_error_findings(errors: pd.DataFrame) -> pd.DataFrame:
+    """Pages with the "HTTP error" label in the error aggregation."""
+    df = errors[errors["errors"].astype(str) == "HTTP error"]
+    threshold = rule_threshold("HTTP error", "http_status", 400)
+    return _frame("Technical SEO Issues", df["page"], "HTTP error", f"HTTP status >= {threshold}",
+                  "Return 200 or 301-redirect to the replacement; update internal links and the sitemap",
+                  "P1", "Dev Team")
+
+
+def cwv_findings(pages: pd.DataFrame) -> pd.DataFrame:
+    """One finding per page and poor Core Web Vital."""
+    impressions = _numeric(pages, "total_impressions").fillna(0)
+    parts = []
+    for column, (label, fix) in CWV_ISSUES.items():
+        values = _numeric(pages, column)
+        threshold = rule_threshold(label, column, {"lcp": 4000, "inp": 500, "cls": 0.25}[column])
+        mask = (values > threshold).to_numpy(dtype=bool, na_value=False)
+        if not mask.any():
+            continue
+        values = values[mask]
+        if column == "lcp":
+            metric = "LCP " + (values / 1000).round(1).astype(str) + "s"
+        elif column == "inp":
+            metric = "INP " + values.round().astype("int64").astype(str) + "ms"
+        else:
+            metric = "CLS " + values.round(2).astype(str)
+        parts.append(_frame("Core Web Vitals Issues", pages["page"][mask], label, metric, fix,
+                            _traffic_priority(impressions[mask]), "Dev Team"))
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=COLUMNS[:7])
+
+
+def ctr_findings(pages: pd.DataFrame) -> pd.DataFrame:
+    """High impressions but no clicks; P1 when the page already ranks on page one."""
+    min_impressions = rule_threshold("High impressions but no clicks", "impressions", 1000)
+    impressions = _numeric(pages, "total_impressions")
+    position = _numeric(pages, "avg_position")
+    mask = ((impressions > min_impressions) & (_numeric(pages, "total_clicks") == 0)).to_numpy(dtype=bool)
+    metric = (impressions[mask].astype("int64").astype(str) + " impressions, 0 clicks, position "
+              + position[mask].round(1).astype(str))
+    priority = np.where(position[mask] <= 10, "P1", "P2")
+    return _frame("CTR Issues", pages["page"][mask], "High impressions but no clicks", metric,
+                  "Rewrite the title and meta description to match the query intent",
+                  priority, "Content Team")
+
+
+def content_findings(pages: pd.DataFrame, anomalies: pd.DataFrame = None) -> pd.DataFrame:
+    """Pages ranking on page two with real demand, and search metrics that got worse this week."""
+    impressions = _numeric(pages, "total_impressions")
+    position = _numeric(pages, "avg_position")
+    mask = ((position > 10) & (position <= 20) & (impressions >= FINDINGS_P2_IMPRESSIONS)).to_numpy(dtype=bool)
+    parts = [_frame("Content Issues", pages["page"][mask], "Ranking on page two",
+                    "position " + position[mask].round(1).astype(str) + ", "
+                    + impressions[mask].astype("int64").astype(str) + " impressions",
+                    "Expand the content for the page's top queries and add internal links",
+                    np.where(impressions[mask] >= FINDINGS_P1_IMPRESSIONS, "P2", "P3"), "Content Team")]
+
+    if anomalies is not None and not anomalies.empty and "page" in anomalies.columns:
+        df = anomalies[(anomalies["direction"] == "worse") & anomalies["metric"].isin(SEARCH_METRICS)]
+        z = _numeric(df, "z")
+        metric = (df["metric"].astype(str) + " " + _numeric(df, "value").round(3).astype(str)
+                  + " vs " + _numeric(df, "baseline_mean").round(3).astype(str) + " usual (z "
+                  + z.round(1).astype(str) + ")")
+        parts.append(_frame("Content Issues", df["page"], "Dropped this week", metric,
+                            "Check which queries dropped; refresh the content and its snippet",
+                            np.where(z.abs() >= 4, "P1", "P2"), "Content Team"))
+    return pd.concat(parts, ignore_index=True)
+
+
+def slow_underperforming_findings(pages: pd.DataFrame, cwv: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pages with a poor Core Web Vital, real demand and below-median CTR or a
+    position beyond page one.
+    """
+    if cwv.empty:
+        return pd.DataFrame(columns=COLUMNS[:7])
+    slow = cwv.groupby("page", sort=False)["metric"].agg(", ".join)
+    df = pages[pages["page"].isin(slow.index)]
+    impressions = _numeric(df, "total_impressions")
+    ctr = _numeric(df, "avg_ctr")
+    position = _numeric(df, "avg_position")
+    with_demand = _numeric(pages, "total_impressions") >= FINDINGS_P2_IMPRESSIONS
+    median_ctr = _numeric(pages, "avg_ctr")[with_demand].median()
+    mask = ((impressions >= FINDINGS_P2_IMPRESSIONS) & ((ctr < median_ctr) | (position > 10))).to_numpy(dtype=bool)
+    df = df[mask]
+    metric = (df["page"].map(slow) + "; CTR " + (ctr[mask] * 100).round(2).astype(str) + "%, position "
+              + position[mask].round(1).astype(str))
+    return _frame("Slow & Underperforming Pages (CRITICAL)", df["page"], "Slow and underperforming", metric,
+                  "Fix the Core Web Vitals first, then refresh the title and description", "P1", "Dev Team")
+
+
+# -------------------------
+# ENGINE
+# -------------------------
+def compute_findings(csv_files) -> pd.DataFrame:
+    """All findings from the report inputs (see report_inputs), P1 first, then by impressions."""
+    frames = _read_inputs(csv_files)
+    pages = frames.get("final_pages_indexing_performance_cwv.csv")
+    status = frames.get(INDEXING_STATUS_FILE)
+    errors = frames.get("error_aggregation.csv")
+
+    parts = []
+    if status is not None and {"page", "verdict"} <= set(status.columns):
+        parts.append(indexing_findings(status))
+    if errors is not None and {"page", "errors"} <= set(errors.columns):
+        parts.append(http_error_findings(errors))
+    if pages is not None and "page" in pages.columns:
+        cwv = cwv_findings(pages)
+        parts += [cwv, ctr_findings(pages), content_findings(pages, frames.get("week_over_week_anomalies.csv")),
+                  slow_underperforming_findings(pages, cwv)]
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.DataFrame(columns=COLUMNS)
+
+    findings = pd.concat(parts, ignore_index=True)
+    if pages is not None and "page" in pages.columns:
+        traffic = pages[["page"]].assign(total_impressions=_numeric(pages, "total_impressions"),
+                                         total_clicks=_numeric(pages, "total_clicks"))
+        findings = findings.merge(traffic.drop_duplicates("page"), on="page", how="left")
+    findings = findings.reindex(columns=COLUMNS)
+    findings[["total_impressions", "total_clicks"]] = (
+        findings[["total_impressions", "total_clicks"]].fillna(0).astype("int64")
+    )
+    findings = findings.sort_values(["priority", "total_impressions"], ascending=[True, False],
+                                    kind="stable", ignore_index=True)
+    print(f"🔎 Findings: {len(findings)} ({', '.join(f'{p} {n}' for p, n in findings['priority'].value_counts().sort_index().items())})")
+    return findings
+
+
+# -------------------------
+# RENDERING
+# -------------------------
+def _paths(pages: pd.Series) -> pd.Series:
+    paths = pages.astype(str).str.replace(r"^https?://[^/]+", "", regex=True)
+    return paths.mask(paths == "", "/")
+
+
+def _priority_counts(df: pd.DataFrame) -> str:
+    counts = df["priority"].value_counts().sort_index()
+    return ", ".join(f"{n} {p}" for p, n in counts.items())
+
+
+def findings_table(findings: pd.DataFrame, rows_per_section: int = None) -> str:
+    """Compact findings for the prompt: top rows per section plus a summary of the rest."""
+    rows_per_section = rows_per_section if rows_per_section is not None else FINDINGS_PROMPT_ROWS
+    blocks = []
+    for section in REPORT_ORDER:
+        df = findings[findings["section"] == section]
+        if df.empty:
+            continue
+        df = df.assign(page=_paths(df["page"]))[["page", "issue", "metric", "priority", "owner",
+                                                "total_impressions", "total_clicks"]]
+        lines = [f"--- {section}: {len(df)} findings ({_priority_counts(df)}) ---",
+                 compact_csv(df.head(rows_per_section))]
+        if len(df) > rows_per_section:
+            lines.append(summarize_tail(df.iloc[rows_per_section:][["issue", "priority", "owner",
+                                                                     "total_impressions"]]))
+        blocks.append("\n".join(lines))
+    table = "\n\n".join(blocks) or "No issues were found in this week's data."
+    print(f"🔎 Findings table: ~{estimate_tokens(table)} tokens")
+    return table
+
+
+def findings_prompt(findings: pd.DataFrame) -> tuple:
+    """(findings table, prompt) for REPORT_MODE=findings."""
+    table = findings_table(findings)
+    return table, FINDINGS_PROMPT_TEMPLATE.format(titles="\n".join(f"{t}:" for t in REPORT_ORDER), findings=table)
+
+
+def _finding_bullets(df: pd.DataFrame, limit: int) -> list:
+    shown = df.head(limit)
+    bullets = ("- " + _paths(shown["page"]) + ": " + shown["issue"] + " (" + shown["metric"].astype(str)
+               + ") - Fix: " + shown["fix"] + " [" + shown["priority"] + ", " + shown["owner"] + "]").tolist()
+    if len(df) > limit:
+        bullets.append(f"- ... and {len(df) - limit} more ({_priority_counts(df.iloc[limit:])})")
+    return bullets
+
+
+def _summary_bullets(findings: pd.DataFrame) -> dict:
+    if findings.empty:
+        return {"Executive Summary": ["- No issues were found in this week's data"],
+                "Fix Priority Roadmap": ["- Keep monitoring indexing and Core Web Vitals weekly"],
+                "Final SEO Verdict": ["- Healthy: no issues crossed the report thresholds"]}
+
+    summary = [f"- {len(findings)} issues found: "
+               + ", ".join(f"{n} {p} ({PRIORITY_NAMES.get(p, p)})"
+                           for p, n in findings["priority"].value_counts().sort_index().items())]
+    for section in REPORT_ORDER:
+        df = findings[findings["section"] == section]
+        if not df.empty:
+            summary.append(f"- {section}: {df['page'].nunique()} pages ({_priority_counts(df)})")
+
+    roadmap = []
+    grouped = findings.groupby(["priority", "owner", "issue"]).agg(
+        pages=("page", "nunique"), impressions=("total_impressions", "sum")).reset_index()
+    grouped = grouped.sort_values(["priority", "impressions"], ascending=[True, False])
+    for row in grouped.itertuples(index=False):
+        roadmap.append(f"- {row.priority} {row.owner}: {row.issue} on {row.pages} "
+                       f"page{'s' if row.pages != 1 else ''} ({row.impressions} weekly impressions)")
+
+    p1 = int((findings["priority"] == "P1").sum())
+    if p1:
+        verdict = [f"- Action needed: {p1} immediate (P1) fixes, start with the highest-traffic pages"]
+    else:
+        verdict = ["- Stable: no immediate (P1) issues this week"]
+    verdict.append(f"- {findings['page'].nunique()} pages need work across "
+                   f"{findings['section'].nunique()} report sections")
+    return {"Executive Summary": summary, "Fix Priority Roadmap": roadmap, "Final SEO Verdict": verdict}
+
+
+def render_findings_report(findings: pd.DataFrame, commentary: str = None, rows_per_section: int = None) -> str:
+    """
+    Report text (one "Title:" heading per section, REPORT_ORDER) from the
+    findings; Gemini's commentary, when given, opens each section.
+    """
+    rows_per_section = rows_per_section if rows_per_section is not None else FINDINGS_REPORT_ROWS
+    notes = split_sections(commentary, REPORT_ORDER) if commentary else {}
+    local = _summary_bullets(findings)
+    sections = []
+    for title in REPORT_ORDER:
+        lines = [notes[title]] if notes.get(title) else []
+        if title in SUMMARY_TITLES:
+            lines += local[title]
+        else:
+            df = findings[findings["section"] == title]
+            lines += _finding_bullets(df, rows_per_section) if not df.empty else ["- No issues found this week"]
+        sections.append(f"{title}:\n" + "\n".join(lines))
+    return "\n\n".join(sections)
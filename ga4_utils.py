@@ -1,11 +1,13 @@
 from datetime import date, timedelta, datetime
 import os
+import json
 import csv
 import pandas as pd
 from google.analytics.data_v1beta import BetaAnalyticsDataClient, RunReportRequest, DateRange, Dimension, Metric, Filter, FilterExpression
 from google.oauth2 import service_account
 from google.analytics.data_v1beta.types import (
     RunReportRequest,
+    RunReportResponse,
     CohortSpec,
     Cohort,
     CohortsRange,
@@ -14,11 +16,53 @@ from google.analytics.data_v1beta.types import (
     DateRange,
 )
 import pandas as pd
+from metrics import track_call, observe_rows
+from replay import recorded, is_replay
+from multi_table import MultiTableWriter
 def _load_credentials(service_account_file, scopes=None):
+    if is_replay():
+        return None  # fixtures only, no service account needed offline
     if scopes:
         return service_account.Credentials.from_service_account_file(service_account_file, scopes=scopes)
     return service_account.Credentials.from_service_account_file(service_account_file)
 
+class _InstrumentedGA4Client:
+    """BetaAnalyticsDataClient whose run_report calls are timed and counted."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def run_report(self, request, **kwargs):
+        with track_call("ga4", "run_report"):
+            response = recorded(
+                "ga4", "run_report", _ga4_request_key(request),
+                lambda: self._client.run_report(request, **kwargs),
+                encode=lambda resp: json.loads(RunReportResponse.to_json(resp)),
+                decode=lambda payload: RunReportResponse.from_json(json.dumps(payload)),
+            )
+        observe_rows("ga4", len(response.rows))
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def _ga4_request_key(request):
+    """Fixture key of a report request: everything but the (rolling) dates."""
+    if not isinstance(request, RunReportRequest):
+        request = RunReportRequest(request)
+    key = RunReportRequest.to_dict(request)
+    key.pop("date_ranges", None)
+    for cohort in key.get("cohort_spec", {}).get("cohorts", []):
+        cohort.pop("date_range", None)
+    return key
+
+
+def _ga4_client(credentials):
+    if is_replay():
+        return _InstrumentedGA4Client(None)
+    return _InstrumentedGA4Client(BetaAnalyticsDataClient(credentials=credentials))
+
 def write_csv_from_response(response, filename):
     
     import csv
@@ -78,8 +122,8 @@ def fetch_ga4_acquisition_reports(service_account_file, property_id, output_dir,
     acquisition_dir = os.path.join(output_dir, "Acquisition Reports")
     os.makedirs(acquisition_dir, exist_ok=True)
 
-    creds = service_account.Credentials.from_service_account_file(service_account_file)
-    client = BetaAnalyticsDataClient(credentials=creds)
+    creds = _load_credentials(service_account_file)
+    client = _ga4_client(creds)
     written_files = []
 
     def write_csv(file_path, headers, rows):
@@ -105,8 +149,7 @@ def fetch_ga4_acquisition_reports(service_account_file, property_id, output_dir,
     # Acquisition Overview (10 tables)
     # -----------------------------
     overview_file = os.path.join(acquisition_dir, "Acquisition overview.csv")
-    with open(overview_file, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
+    with MultiTableWriter(overview_file) as writer:
 
         tables = [
     ("Nth day - Active users", ["nthDay"], ["activeUsers"]),
@@ -130,19 +173,13 @@ def fetch_ga4_acquisition_reports(service_account_file, property_id, output_dir,
 
 
         for title, dims, mets in tables:
-            f.write(f"Table: {title}\n")
             try:
                 resp = safe_report(client, property_id, dims, mets, start_date, end_date)
-                if not resp.rows:
-                    writer.writerow(["No data"])
-                else:
-                    rows = [row_to_values(row) for row in resp.rows]
-                    df = pd.DataFrame(rows, columns=dims + mets)
-                    df.to_csv(f, index=False)
+                rows = [row_to_values(row) for row in resp.rows]
+                writer.write_table(title, pd.DataFrame(rows, columns=dims + mets) if rows else None)
             except Exception as e:
                 print(f"⚠ Error fetching {title}: {e}")
-                writer.writerow(["Error fetching data"])
-            f.write("\n")
+                writer.write_error(title)
 
     written_files.append(overview_file)
     print(f" Saved: {overview_file}")
@@ -316,7 +353,7 @@ def fetch_ga4_engagement_reports(service_account_file, property_id, output_dir,
     os.makedirs(engagement_dir, exist_ok=True)
 
     creds = _load_credentials(service_account_file)
-    client = BetaAnalyticsDataClient(credentials=creds)
+    client = _ga4_client(creds)
     written_files = []
 
     
@@ -343,8 +380,7 @@ def fetch_ga4_engagement_reports(service_account_file, property_id, output_dir,
     # 1️⃣ Engagement Overview  (multi-table like Acquisition Overview)
     # ------------------------------------------------------------------
     overview_file = os.path.join(engagement_dir, "Engagement Overview.csv")
-    with open(overview_file, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
+    with MultiTableWriter(overview_file) as writer:
 
         tables = [
             ("Nth day - Active users", ["nthDay"], ["activeUsers"]),
@@ -358,19 +394,13 @@ def fetch_ga4_engagement_reports(service_account_file, property_id, output_dir,
         ]
 
         for title, dims, mets in tables:
-            f.write(f"Table: {title}\n")
             try:
                 resp = safe_report(client, property_id, dims, mets, start_date, end_date)
-                if not resp.rows:
-                    writer.writerow(["No data"])
-                else:
-                    rows = [row_to_values(row) for row in resp.rows]
-                    df = pd.DataFrame(rows, columns=dims + mets)
-                    df.to_csv(f, index=False)
+                rows = [row_to_values(row) for row in resp.rows]
+                writer.write_table(title, pd.DataFrame(rows, columns=dims + mets) if rows else None)
             except Exception as e:
                 print(f"⚠ Error fetching {title}: {e}")
-                writer.writerow(["Error fetching data"])
-            f.write("\n")
+                writer.write_error(title)
 
     written_files.append(overview_file)
     print(f"Saved: {overview_file}")
@@ -479,7 +509,7 @@ def fetch_ga4_monetization_reports(service_account_file, property_id, output_dir
     os.makedirs(monetization_dir, exist_ok=True)
 
     creds = _load_credentials(service_account_file)
-    client = BetaAnalyticsDataClient(credentials=creds)
+    client = _ga4_client(creds)
     written_files = []
 
     
@@ -506,8 +536,7 @@ def fetch_ga4_monetization_reports(service_account_file, property_id, output_dir
     # 1️⃣ Monetization Overview.csv  (multi-table format)
     # -----------------------------------------------------------------
     overview_file = os.path.join(monetization_dir, "Monetization Overview.csv")
-    with open(overview_file, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
+    with MultiTableWriter(overview_file) as writer:
 
         tables = [
             ("Nth day - Total revenue", ["nthDay"], ["totalRevenue"]),
@@ -522,19 +551,13 @@ def fetch_ga4_monetization_reports(service_account_file, property_id, output_dir
         ]
 
         for title, dims, mets in tables:
-            f.write(f"Table: {title}\n")
             try:
                 resp = safe_report(client, property_id, dims, mets, start_date, end_date)
-                if not resp.rows:
-                    writer.writerow(["No data"])
-                else:
-                    rows = [row_to_values(row) for row in resp.rows]
-                    df = pd.DataFrame(rows, columns=dims + mets)
-                    df.to_csv(f, index=False)
+                rows = [row_to_values(row) for row in resp.rows]
+                writer.write_table(title, pd.DataFrame(rows, columns=dims + mets) if rows else None)
             except Exception as e:
                 print(f"⚠ Error fetching {title}: {e}")
-                writer.writerow(["Error fetching data"])
-            f.write("\n")
+                writer.write_error(title)
 
     written_files.append(overview_file)
     print(f" Saved: {overview_file}")
@@ -680,8 +703,8 @@ def fetch_ga4_retention_reports(service_account_file, property_id, output_dir, s
     retention_dir = os.path.join(output_dir, "Retention Reports")
     os.makedirs(retention_dir, exist_ok=True)
 
-    creds = service_account.Credentials.from_service_account_file(service_account_file)
-    client = BetaAnalyticsDataClient(credentials=creds)
+    creds = _load_credentials(service_account_file)
+    client = _ga4_client(creds)
     written_files = []
 
     
@@ -718,8 +741,7 @@ def fetch_ga4_retention_reports(service_account_file, property_id, output_dir, s
     # -----------------------------------------------------------------
     print(" Fetching Retention Overview tables...")
     overview_file = os.path.join(retention_dir, "Retention Overview.csv")
-    with open(overview_file, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
+    with MultiTableWriter(overview_file) as writer:
 
         tables = [
             ("Cohort - Active users", ["cohort", "cohortNthDay"], ["activeUsers"]),
@@ -731,20 +753,14 @@ def fetch_ga4_retention_reports(service_account_file, property_id, output_dir, s
 
         for title, dims, mets in tables:
             print(f"   ⏳ Fetching {title} ...")
-            f.write(f"Table: {title}\n")
             try:
                 resp = run_cohort_report(dims, mets, start_date, end_date)
-                if not resp.rows:
-                    writer.writerow(["No data"])
-                else:
-                    rows = [row_to_values(row) for row in resp.rows]
-                    df = pd.DataFrame(rows, columns=dims + mets)
-                    df.to_csv(f, index=False)
-                    print(f"    Saved table: {title}")
+                rows = [row_to_values(row) for row in resp.rows]
+                writer.write_table(title, pd.DataFrame(rows, columns=dims + mets) if rows else None)
+                print(f"    Saved table: {title}")
             except Exception as e:
                 print(f"⚠ Error fetching {title}: {e}")
-                writer.writerow(["Error fetching data"])
-            f.write("\n")
+                writer.write_error(title)
 
     written_files.append(overview_file)
     print(f" Saved: {overview_file}")
@@ -778,8 +794,8 @@ def fetch_ga4_users_full(service_account_file, property_id, output_dir, start_da
     os.makedirs(user_attr_dir, exist_ok=True)
     os.makedirs(tech_dir, exist_ok=True)
 
-    creds = service_account.Credentials.from_service_account_file(service_account_file)
-    client = BetaAnalyticsDataClient(credentials=creds)
+    creds = _load_credentials(service_account_file)
+    client = _ga4_client(creds)
     saved_files = []
     
     def safe_report(dimensions, metrics):
@@ -837,8 +853,7 @@ def fetch_ga4_users_full(service_account_file, property_id, output_dir, start_da
     # 3. User Attributes Overview (multi-table)
     print(" Generating User Attributes Overview...")
     overview_user_attr = os.path.join(user_attr_dir, "User attributes Overview.csv")
-    with open(overview_user_attr, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
+    with MultiTableWriter(overview_user_attr) as writer:
         tables = [
             ("Country ID", ["countryId"], ["activeUsers"]),
             ("City", ["city"], ["activeUsers"]),
@@ -847,13 +862,8 @@ def fetch_ga4_users_full(service_account_file, property_id, output_dir, start_da
             ("Continent", ["continent"], ["activeUsers"]),
         ]
         for title, dims, mets in tables:
-            f.write(f"Table: {title}\n")
             df = safe_report(dims, mets)
-            if df.empty:
-                writer.writerow(["No data"])
-            else:
-                df.to_csv(f, index=False)
-            f.write("\n")
+            writer.write_table(title, df)
     saved_files.append(overview_user_attr)
     print(f" Saved: {overview_user_attr}")
 
@@ -874,8 +884,7 @@ def fetch_ga4_users_full(service_account_file, property_id, output_dir, start_da
     
     print(" Generating Tech Overview...")
     overview_tech = os.path.join(tech_dir, "Tech Overview.csv")
-    with open(overview_tech, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
+    with MultiTableWriter(overview_tech) as writer:
         tables = [
             ("Platform", ["platform"], ["activeUsers"]),
             ("Operating system", ["operatingSystem"], ["activeUsers"]),
@@ -885,13 +894,8 @@ def fetch_ga4_users_full(service_account_file, property_id, output_dir, start_da
             ("Screen resolution", ["screenResolution"], ["activeUsers"]),
         ]
         for title, dims, mets in tables:
-            f.write(f"Table: {title}\n")
             df = safe_report(dims, mets)
-            if df.empty:
-                writer.writerow(["No data"])
-            else:
-                df.to_csv(f, index=False)
-            f.write("\n")
+            writer.write_table(title, df)
     saved_files.append(overview_tech)
     print(f" Saved: {overview_tech}")
 
@@ -918,8 +922,8 @@ def fetch_generate_leads_full(service_account_file, property_id, output_dir, sta
     gen_dir = os.path.join(output_dir, "Generate Leads Reports")
     os.makedirs(gen_dir, exist_ok=True)
     saved_files = []
-    creds = service_account.Credentials.from_service_account_file(service_account_file)
-    client = BetaAnalyticsDataClient(credentials=creds)
+    creds = _load_credentials(service_account_file)
+    client = _ga4_client(creds)
     def safe_report(dimensions, metrics, dimension_filter=None):
         try:
             request = RunReportRequest(
@@ -1062,8 +1066,7 @@ def fetch_generate_leads_full(service_account_file, property_id, output_dir, sta
     # 8️⃣ Generate Leads Overview (multi-table + funnel summary)
     # -----------------------------------------------------------------
     overview_path = os.path.join(gen_dir, "Generate Leads Overview.csv")
-    with open(overview_path, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
+    with MultiTableWriter(overview_path) as writer:
 
         tables = [
             ("Nth day - New users", ["nthDay"], ["newUsers"]),
@@ -1075,7 +1078,6 @@ def fetch_generate_leads_full(service_account_file, property_id, output_dir, sta
         ]
 
         for title, dims, mets in tables:
-            f.write(f"Table: {title}\n")
             df = safe_report(dims, mets)
             if title == "Nth day - Returning users" and not df.empty:
                 df["Returning users"] = (
@@ -1083,14 +1085,9 @@ def fetch_generate_leads_full(service_account_file, property_id, output_dir, sta
                     - pd.to_numeric(df.get("newUsers", 0), errors="coerce").fillna(0)
                 )
                 df = df[["nthDay", "Returning users"]]
-            if df.empty:
-                writer.writerow(["No data"])
-            else:
-                df.to_csv(f, index=False)
-            f.write("\n")
+            writer.write_table(title, df)
 
-        
-        f.write("Table: Lead Funnel Summary\n")
+        summary = None
         if not df_leads.empty:
             total_new = df_leads["New leads"].sum()
             total_qual = df_leads["Qualified leads"].sum()
@@ -1116,10 +1113,7 @@ def fetch_generate_leads_full(service_account_file, property_id, output_dir, sta
                 ],
                 columns=["Metric", "Value"],
             )
-            summary.to_csv(f, index=False)
-        else:
-            writer.writerow(["No data"])
-        f.write("\n")
+        writer.write_table("Lead Funnel Summary", summary)
 
     saved_files.append(overview_path)
     print(f" Saved: {overview_path}")
@@ -1150,8 +1144,8 @@ def fetch_drive_sales_full(service_account_file, property_id, output_dir):
     print(" Fetching 'Drive Sales' reports...")
 
    
-    credentials = service_account.Credentials.from_service_account_file(service_account_file)
-    client = BetaAnalyticsDataClient(credentials=credentials)
+    credentials = _load_credentials(service_account_file)
+    client = _ga4_client(credentials)
 
     
     drive_dir = os.path.join(output_dir, "Drive Sales Reports")
@@ -1246,7 +1240,7 @@ def fetch_drive_sales_full(service_account_file, property_id, output_dir):
 
     # --- 6️⃣ Drive Sales Overview ---
     overview_path = os.path.join(drive_dir, "Drive Sales Overview.csv")
-    with open(overview_path, "w", encoding="utf-8", newline="") as f:
+    with MultiTableWriter(overview_path) as writer:
         tables = [
             ("Nth day - Total revenue", ["nthDay"], ["totalRevenue"]),
             ("Nth day - Ecommerce revenue", ["nthDay"], ["purchaseRevenue"]),
@@ -1257,15 +1251,9 @@ def fetch_drive_sales_full(service_account_file, property_id, output_dir):
             ("Order coupon - Items purchased", ["orderCoupon"], ["itemsPurchased"]),
             ("Item list name - Items purchased", ["itemListName"], ["itemsPurchased"]),
         ]
-        writer = csv.writer(f)
         for title, dims, mets in tables:
-            f.write(f"Table: {title}\n")
             df = run_report_to_df(dims, mets)
-            if df.empty:
-                writer.writerow(["No data"])
-            else:
-                df.to_csv(f, index=False)
-            f.write("\n")
+            writer.write_table(title, df)
 
     saved_files.append(overview_path)
     print(f" Saved: {overview_path}")
@@ -1301,8 +1289,8 @@ def fetch_understand_web_full(service_account_file, property_id, output_dir):
     print(" Fetching 'Understand Web' reports...")
 
     
-    credentials = service_account.Credentials.from_service_account_file(service_account_file)
-    client = BetaAnalyticsDataClient(credentials=credentials)
+    credentials = _load_credentials(service_account_file)
+    client = _ga4_client(credentials)
 
     uw_dir = os.path.join(output_dir, "Understand Web Reports")
     os.makedirs(uw_dir, exist_ok=True)
@@ -1395,8 +1383,7 @@ def fetch_understand_web_full(service_account_file, property_id, output_dir):
 
     # --- 3️⃣ Understand Web Overview.csv ---
     overview_path = os.path.join(uw_dir, "Understand Web Overview.csv")
-    with open(overview_path, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
+    with MultiTableWriter(overview_path) as writer:
         tables = [
             ("Country ID - Active users", ["countryId"], ["activeUsers"]),
             ("Country - Active users", ["country"], ["activeUsers"]),
@@ -1412,13 +1399,8 @@ def fetch_understand_web_full(service_account_file, property_id, output_dir):
         ]
 
         for title, dims, mets in tables:
-            f.write(f"Table: {title}\n")
             df = run_report_to_df(dims, mets)
-            if df.empty:
-                writer.writerow(["No data"])
-            else:
-                df.to_csv(f, index=False)
-            f.write("\n")
+            writer.write_table(title, df)
 
     saved_files.append(overview_path)
     print(f" Saved: {overview_path}")
@@ -1453,8 +1435,8 @@ def fetch_view_user_engagements_full(service_account_file, property_id, output_d
     print(" Fetching 'View User Engagements' reports...")
 
 
-    credentials = service_account.Credentials.from_service_account_file(service_account_file)
-    client = BetaAnalyticsDataClient(credentials=credentials)
+    credentials = _load_credentials(service_account_file)
+    client = _ga4_client(credentials)
 
     vue_dir = os.path.join(output_dir, "View User Engagements Reports")
     os.makedirs(vue_dir, exist_ok=True)
@@ -1568,8 +1550,7 @@ def fetch_view_user_engagements_full(service_account_file, property_id, output_d
 
     # --- 3️⃣ View User Engagements Overview.csv ---
     overview_path = os.path.join(vue_dir, "View User Engagements Overview.csv")
-    with open(overview_path, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
+    with MultiTableWriter(overview_path) as writer:
         tables = [
             ("Nth day - Active users", ["nthDay"], ["activeUsers"]),
             ("Nth day - New users", ["nthDay"], ["newUsers"]),
@@ -1579,13 +1560,8 @@ def fetch_view_user_engagements_full(service_account_file, property_id, output_d
         ]
 
         for title, dims, mets in tables:
-            f.write(f"Table: {title}\n")
             df = fetch_all_metrics(dims, mets)
-            if df.empty:
-                writer.writerow(["No data"])
-            else:
-                df.to_csv(f, index=False)
-            f.write("\n")
+            writer.write_table(title, df)
 
     saved_files.append(overview_path)
     print(f" Saved: {overview_path}")
@@ -1682,3 +1658,42 @@ def fetch_ga4_full(service_account_file, property_id, output_dir, start_date=Non
 
 
 
+
+
+# -------------------------
+# Per-section fetch (one Celery task per section)
+# -------------------------
+GA4_SECTIONS = {
+    "acquisition": fetch_ga4_acquisition_reports,
+    "engagement": fetch_ga4_engagement_reports,
+    "monetization": fetch_ga4_monetization_reports,
+    "retention": fetch_ga4_retention_reports,
+    "users": fetch_ga4_users_full,
+    "generate_leads": fetch_generate_leads_full,
+    "drive_sales": fetch_drive_sales_full,
+    "understand_web": fetch_understand_web_full,
+    "view_user_engagements": fetch_view_user_engagements_full,
+}
+
+# These sections pick their own date range
+UNDATED_SECTIONS = ("drive_sales", "understand_web", "view_user_engagements")
+
+
+def fetch_ga4_section(section, service_account_file, property_id, output_dir, start_date=None, end_date=None):
+    """Fetch one GA4 report section, as fetch_ga4_full would, and return its files."""
+    fetch = GA4_SECTIONS[section]
+    os.makedirs(output_dir, exist_ok=True)
+
+    if section in UNDATED_SECTIONS:
+        return fetch(
+            service_account_file=service_account_file,
+            property_id=property_id,
+            output_dir=output_dir
+        )
+    return fetch(
+        service_account_file=service_account_file,
+        property_id=property_id,
+        output_dir=output_dir,
+        start_date=start_date,
+        end_date=end_date
+    )
@@ -0,0 +1,328 @@
+# gemini_client.py
+"""
+Gemini client: pooled HTTP session, classified errors, retries with
+jittered backoff, a total deadline per call and a circuit breaker.
+
+    client = GeminiClient("gemini-2.5-flash", api_key)
+    text = client.generate(prompt, deadline=180)      # raises a GeminiError subclass
+    for chunk in client.stream(prompt, deadline=180): ...
+
+Retried (jittered exponential backoff, Retry-After honoured): 429, 5xx,
+timeouts and connection errors, as long as the deadline leaves room for
+another attempt. Not retried: 400/404 (bad request), 401/403 (auth),
+blocked prompts and empty answers.
+
+After GEMINI_BREAKER_FAILURES consecutive retryable failures the breaker
+opens and calls fail fast with CircuitOpen for GEMINI_BREAKER_RESET_SECONDS;
+then one trial call is let through.
+
+GEMINI_BASE_URL points the client at another endpoint, e.g. the local stub
+(gemini_stub.py) for offline tests. Requests go through the record/replay
+layer like every other external call.
+"""
+import os
+import time
+import json
+import random
+import hashlib
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import track_call
+from replay import http_request, http_stream
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", "8"))
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "5"))
+GEMINI_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "240"))
+GEMINI_ATTEMPT_TIMEOUT = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", "120"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1.0"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "30"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET_SECONDS = float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", "60"))
+
+# Not worth starting an attempt with less time than this left
+MIN_ATTEMPT_SECONDS = 1.0
+
+
+# -------------------------
+# ERRORS
+# -------------------------
+class GeminiError(Exception):
+    retryable = False
+
+
+class GeminiTimeout(GeminiError):
+    retryable = True
+
+
+class GeminiConnectionError(GeminiError):
+    retryable = True
+
+
+class GeminiRateLimited(GeminiError):
+    """429 / RESOURCE_EXHAUSTED: rate limit or quota."""
+    retryable = True
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GeminiServerError(GeminiError):
+    retryable = True
+
+
+class GeminiAuthError(GeminiError):
+    pass
+
+
+class GeminiBadRequest(GeminiError):
+    pass
+
+
+class GeminiBlocked(GeminiError):
+    """The prompt or the answer was blocked (safety, recitation)."""
+
+
+class GeminiEmptyResponse(GeminiError, ValueError):
+    pass
+
+
+class DeadlineExceeded(GeminiError):
+    pass
+
+
+class CircuitOpen(GeminiError):
+    pass
+
+
+def _retry_after(response) -> float:
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_message(response) -> str:
+    try:
+        return response.json()["error"]["message"]
+    except (ValueError, KeyError, TypeError):
+        return (response.text or "")[:200]
+
+
+def classify_response(response) -> GeminiError:
+    """GeminiError for a failed HTTP response, None for a 2xx."""
+    status = response.status_code
+    if status < 400:
+        return None
+    message = f"HTTP {status}: {_error_message(response)}"
+    if status == 429:
+        return GeminiRateLimited(message, _retry_after(response))
+    if status >= 500:
+        return GeminiServerError(message)
+    if status in (401, 403):
+        return GeminiAuthError(message)
+    return GeminiBadRequest(message)
+
+
+def classify_exception(e: Exception) -> GeminiError:
+    if isinstance(e, GeminiError):
+        return e
+    if isinstance(e, requests.Timeout):
+        return GeminiTimeout(str(e))
+    if isinstance(e, (requests.ConnectionError, requests.exceptions.ChunkedEncodingError)):
+        return GeminiConnectionError(str(e))
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return classify_response(e.response)
+    return GeminiError(f"{type(e).__name__}: {e}")
+
+
+def parse_answer(data: dict) -> str:
+    """Text of a generateContent answer; raises GeminiBlocked / GeminiEmptyResponse."""
+    block_reason = data.get("promptFeedback", {}).get("blockReason")
+    if block_reason:
+        raise GeminiBlocked(f"Prompt blocked: {block_reason}")
+    candidate = (data.get("candidates") or [{}])[0]
+    parts = candidate.get("content", {}).get("parts", [])
+    text = "".join(part.get("text", "") for part in parts)
+    if not text.strip():
+        if candidate.get("finishReason") in ("SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT"):
+            raise GeminiBlocked(f"Answer blocked: {candidate['finishReason']}")
+        raise GeminiEmptyResponse("Empty Gemini response")
+    return text
+
+
+# -------------------------
+# CIRCUIT BREAKER
+# -------------------------
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures -> half-open after `reset_seconds`."""
+
+    def __init__(self, failures: int = GEMINI_BREAKER_FAILURES, reset_seconds: float = GEMINI_BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half_open" and self._trial_running):
+                remaining = self.reset_seconds - (time.monotonic() - self._opened_at)
+                raise CircuitOpen(f"Gemini circuit open, retry in {max(remaining, 0):.0f}s")
+            if state == "half_open":
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._trial_running or self._consecutive >= self.failures:
+                if self._opened_at is None or self._trial_running:
+                    print(f"🔌 Gemini circuit opened after {self._consecutive} failures")
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+# -------------------------
+# CLIENT
+# -------------------------
+class GeminiClient:
+    def __init__(self, model: str, api_key: str = None, base_url: str = None,
+                 max_attempts: int = None, breaker: CircuitBreaker = None, backoff_base: float = None):
+        self.model = model
+        self.api_key = api_key if api_key is not None else os.getenv("GEMINI_API_KEY")
+        self.base_url = (base_url or GEMINI_BASE_URL).rstrip("/")
+        self.max_attempts = max_attempts or GEMINI_MAX_ATTEMPTS
+        self.backoff_base = backoff_base if backoff_base is not None else GEMINI_BACKOFF_BASE
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GEMINI_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _url(self, method: str, query: str = "") -> str:
+        return f"{self.base_url}/v1beta/models/{self.model}:{method}?{query}key={self.api_key}"
+
+    def _request_kwargs(self, prompt: str) -> dict:
+        return {
+            "key": {"model": self.model, "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest()},
+            "headers": {"Content-Type": "application/json"},
+            "json": {"contents": [{"parts": [{"text": prompt}]}]},
+            "session": self.session,
+        }
+
+    def backoff_seconds(self, attempt: int, error: GeminiError = None) -> float:
+        """Full jitter: uniform(0, min(max, base * 2^attempt)); at least Retry-After."""
+        delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, self.backoff_base * 2 ** attempt))
+        retry_after = getattr(error, "retry_after", None)
+        return max(delay, retry_after) if retry_after else delay
+
+    def _with_retries(self, operation: str, attempt_fn, deadline: float):
+        """Run attempt_fn(timeout) until it succeeds, fails for good or the deadline is spent."""
+        deadline = deadline if deadline is not None else GEMINI_DEADLINE_SECONDS
+        ends_at = time.monotonic() + deadline
+        last_error = None
+        for attempt in range(self.max_attempts):
+            remaining = ends_at - time.monotonic()
+            if remaining < MIN_ATTEMPT_SECONDS:
+                raise DeadlineExceeded(f"Gemini deadline of {deadline:.0f}s exceeded: {last_error}") from last_error
+            self.breaker.before_call()
+            try:
+                with track_call("gemini", operation):
+                    try:
+                        result = attempt_fn(min(GEMINI_ATTEMPT_TIMEOUT, remaining))
+                    except GeminiError:
+                        raise
+                    except Exception as e:
+                        raise classify_exception(e) from e
+            except GeminiError as error:
+                if not error.retryable:
+                    self.breaker.record_success()  # the service answered
+                    raise
+                self.breaker.record_failure()
+                last_error = error
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                delay = self.backoff_seconds(attempt, error)
+                if time.monotonic() + delay + MIN_ATTEMPT_SECONDS > ends_at:
+                    raise DeadlineExceeded(f"Gemini deadline of {deadline:.0f}s exceeded: {error}") from error
+                print(f"⚠️ Gemini {type(error).__name__} (attempt {attempt + 1}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def generate(self, prompt: str, deadline: float = None) -> str:
+        """generateContent: the answer text, or a GeminiError subclass."""
+        kwargs = self._request_kwargs(prompt)
+
+        def attempt(timeout):
+            response = http_request("gemini", "generate_content", "POST", self._url("generateContent"),
+                                    timeout=timeout, **kwargs)
+            error = classify_response(response)
+            if error is not None:
+                raise error
+            return parse_answer(response.json())
+
+        return self._with_retries("generate_content", attempt, deadline)
+
+    def stream(self, prompt: str, deadline: float = None):
+        """
+        streamGenerateContent (server-sent events): yields text chunks as they
+        arrive. Opening the stream is retried like generate(); once text has
+        arrived, a broken stream raises (the caller keeps what it received).
+        """
+        kwargs = self._request_kwargs(prompt)
+
+        def attempt(timeout):
+            lines = http_stream("gemini", "stream_generate_content", "POST",
+                                self._url("streamGenerateContent", "alt=sse&"), timeout=timeout, **kwargs)
+            first = _first_event(lines)  # status errors surface here, before any text
+            return first, lines
+
+        first, lines = self._with_retries("stream_generate_content", attempt, deadline)
+        try:
+            for data in _chain(first, lines):
+                for part in (data.get("candidates") or [{}])[0].get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        yield part["text"]
+        except Exception as e:
+            raise classify_exception(e) from e
+
+
+def _events(lines):
+    for line in lines:
+        if line and line.startswith("data:"):
+            yield json.loads(line[len("data:"):])
+
+
+def _first_event(lines):
+    for data in _events(lines):
+        if data.get("promptFeedback", {}).get("blockReason"):
+            raise GeminiBlocked(f"Prompt blocked: {data['promptFeedback']['blockReason']}")
+        return data
+    raise GeminiEmptyResponse("Empty Gemini stream")
+
+
+def _chain(first, lines):
+    yield first
+    yield from _events(lines)
@@ -0,0 +1,172 @@
+# gemini_stub.py
+"""
+Local stand-in for the Gemini API, for testing the client (retries,
+deadlines, circuit breaker, streaming) and its latency offline.
+
+    python gemini_stub.py --port 8089 --latency 2 --jitter 1 --script 429,500,ok
+    GEMINI_BASE_URL=http://127.0.0.1:8089 celery -A celery_pdf_app worker ...
+
+Serves generateContent and streamGenerateContent (alt=sse) for any model.
+--script is a comma-separated list of outcomes used in order, one per
+request, then "ok" for good: ok | 429 | 500 | 503 | 400 | 403 | timeout |
+empty | blocked | drop (streams: close the connection halfway).
+--fail-rate answers 503 to that share of the remaining requests at random.
+The answer is a fixed report skeleton (--answer-file to use another text).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = """Executive Summary:
+- Stub answer: organic clicks are stable week over week
+
+Indexing Issues:
+- /blog/example-page: Discovered - currently not indexed (P1, SEO Team)
+
+Core Web Vitals Issues:
+- /landing/example: LCP 5.2s on mobile (P2, Dev Team)
+
+Final SEO Verdict:
+- Stable, fix indexing first
+"""
+
+
+class StubState:
+    def __init__(self, script=(), latency: float = 0.0, jitter: float = 0.0, fail_rate: float = 0.0,
+                 answer: str = DEFAULT_ANSWER, chunk_chars: int = 40, hang_seconds: float = 600):
+        self.script = list(script)
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.answer = answer
+        self.chunk_chars = chunk_chars
+        self.hang_seconds = hang_seconds
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def next_outcome(self, path: str) -> str:
+        with self._lock:
+            outcome = self.script.pop(0) if self.script else "ok"
+            if outcome == "ok" and self.fail_rate and random.random() < self.fail_rate:
+                outcome = "503"
+            self.requests.append((path, outcome))
+            return outcome
+
+
+def _make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict, headers: dict = None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_error(self, status: int, message: str, headers: dict = None):
+            codes = {400: "INVALID_ARGUMENT", 403: "PERMISSION_DENIED", 429: "RESOURCE_EXHAUSTED",
+                     500: "INTERNAL", 503: "UNAVAILABLE"}
+            self._send_json(status, {"error": {"code": status, "message": message,
+                                               "status": codes.get(status, "UNKNOWN")}}, headers)
+
+        def _chunk(self, data: bytes):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def _stream(self, outcome: str):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            text = state.answer
+            pieces = [text[i:i + state.chunk_chars] for i in range(0, len(text), state.chunk_chars)]
+            for i, piece in enumerate(pieces):
+                if outcome == "drop" and i == len(pieces) // 2:
+                    self.wfile.write(b"ff\r\ntruncated")
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                event = {"candidates": [{"content": {"parts": [{"text": piece}], "role": "model"}}]}
+                self._chunk(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+                time.sleep(state.latency / max(len(pieces), 1))
+            self._chunk(b"")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self.rfile.read(length)
+            outcome = state.next_outcome(self.path)
+            streaming = ":streamGenerateContent" in self.path
+
+            if outcome == "timeout":
+                time.sleep(state.hang_seconds)
+                self.close_connection = True
+                return
+            if not streaming:
+                time.sleep(max(0.0, state.latency + random.uniform(-state.jitter, state.jitter)))
+
+            if outcome.isdigit():
+                headers = {"Retry-After": "1"} if outcome == "429" else None
+                return self._send_error(int(outcome), f"Stub error {outcome}", headers)
+            if outcome == "blocked":
+                return self._send_json(200, {"promptFeedback": {"blockReason": "SAFETY"}})
+            if outcome == "empty":
+                return self._send_json(200, {"candidates": [{"content": {"parts": [{"text": ""}]},
+                                                             "finishReason": "STOP"}]})
+            if streaming:
+                return self._stream(outcome)
+            self._send_json(200, {"candidates": [{"content": {"parts": [{"text": state.answer}], "role": "model"},
+                                                  "finishReason": "STOP"}]})
+
+    return Handler
+
+
+def start_stub(port: int = 0, **options):
+    """Start the stub on a background thread; returns (server, state, base_url)."""
+    state = StubState(**options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Gemini API stub")
+    parser.add_argument("--port", type=int, default=int(os.getenv("GEMINI_STUB_PORT", "8089")))
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="± seconds added to the latency")
+    parser.add_argument("--script", default="", help="outcomes in order, e.g. 429,500,ok")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of random 503 answers")
+    parser.add_argument("--answer-file", help="text file with the answer to serve")
+    args = parser.parse_args(argv)
+
+    answer = DEFAULT_ANSWER
+    if args.answer_file:
+        with open(args.answer_file, "r", encoding="utf-8") as f:
+            answer = f.read()
+    server, _, base_url = start_stub(
+        args.port, script=[s.strip() for s in args.script.split(",") if s.strip()],
+        latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate, answer=answer,
+    )
+    print(f"🧪 Gemini stub on {base_url} (GEMINI_BASE_URL={base_url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
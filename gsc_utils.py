@@ -15,6 +15,12 @@ import glob
 from urllib.parse import urlparse
 import re
 from time import sleep
+from metrics import track_call, observe_rows
+from replay import http_request, google_service, is_replay
+from artifact_store import checkpoint, run_dir
+from indexing_history import append_inspection, backfill_daily_files, export_current_state
+from sql_engine import use_duckdb, merge_indexing_with_performance_sql
+from dtype_policy import apply_dtype_policy
 # -------------------------
 # GLOBAL CONFIG
 # -------------------------
@@ -51,15 +57,34 @@ if not logger.handlers:
 # CREDENTIALS
 # -------------------------
 def _load_gsc_credentials(service_account_file):
+    if is_replay():
+        return None
     return service_account.Credentials.from_service_account_file(
         service_account_file, scopes=SCOPES
     )
 
 def _load_inspection_credentials(service_account_file):
+    if is_replay():
+        return None
     return service_account.Credentials.from_service_account_file(
         service_account_file, scopes=[INSPECTION_SCOPE]
     )
 
+# Fixture keys for recorded Search Console calls (dates and site left out of
+# search analytics so a replay works for any week)
+GSC_FIXTURE_KEYS = {
+    "searchanalytics.query": lambda kw: {"dimensions": kw["body"].get("dimensions")},
+    "urlInspection.index.inspect": lambda kw: {"url": kw["body"].get("inspectionUrl")},
+}
+
+
+def _searchconsole_service(creds):
+    return google_service(
+        "gsc",
+        lambda: build("searchconsole", "v1", credentials=creds),
+        keys=GSC_FIXTURE_KEYS
+    )
+
 # -------------------------
 # CLOUDFLARE-SAFE ROBOTS.TXT
 # -------------------------
@@ -78,7 +103,8 @@ def fetch_robots_txt(site_url, timeout=15):
     }
 
     try:
-        resp = requests.get(
+        resp = http_request(
+            "site", "robots_txt", "GET",
             robots_url,
             headers=headers,
             timeout=timeout,
@@ -102,7 +128,9 @@ def fetch_robots_txt(site_url, timeout=15):
 # -------------------------
 def fetch_http_status(url):
     try:
-        return requests.head(url, timeout=15, allow_redirects=True).status_code
+        return http_request(
+            "site", "http_status", "HEAD", url, timeout=15, allow_redirects=True
+        ).status_code
     except:
         return None
 
@@ -121,9 +149,10 @@ def fetch_cwv(url, api_key):
     }
 
     try:
-        r = requests.get(PSI_API_URL, params=params, timeout=120)
-        r.raise_for_status()
-        audits = r.json()["lighthouseResult"]["audits"]
+        with track_call("psi", "run_pagespeed"):
+            r = http_request("psi", "run_pagespeed", "GET", PSI_API_URL, params=params, timeout=120)
+            r.raise_for_status()
+            audits = r.json()["lighthouseResult"]["audits"]
 
         def metric(k):
             return audits.get(k, {}).get("numericValue")
@@ -151,10 +180,13 @@ def run_gsc_query(service, site_url, start_date, end_date, dimensions):
             "dimensions": dimensions,
             "rowLimit": 25000
         }
-        response = service.searchanalytics().query(
-            siteUrl=site_url, body=body
-        ).execute()
-        return response.get("rows", []) if isinstance(response, dict) else []
+        with track_call("gsc", "search_analytics_query"):
+            response = service.searchanalytics().query(
+                siteUrl=site_url, body=body
+            ).execute()
+        rows = response.get("rows", []) if isinstance(response, dict) else []
+        observe_rows("gsc_search_analytics", len(rows))
+        return rows
     except Exception as e:
         logger.warning(f"Error fetching {dimensions}: {e}")
         return []
@@ -179,7 +211,7 @@ def save_csv(file_path, headers, rows):
 def fetch_gsc_performance_full(service_account_file, site_url, output_dir, start_date, end_date):
     logger.info(f"Fetching GSC Performance Reports for {site_url}")
     creds = _load_gsc_credentials(service_account_file)
-    service = build("searchconsole", "v1", credentials=creds)
+    service = _searchconsole_service(creds)
 
     perf_dir = os.path.join(output_dir, "GSC Reports", "Performance Reports")
     os.makedirs(perf_dir, exist_ok=True)
@@ -216,7 +248,7 @@ def fetch_sitemap_urls(site_url=SITE, output_dir=OUTPUT_DIR):
         visited_sitemaps.add(sitemap_url)
 
         try:
-            res = requests.get(sitemap_url, timeout=30)
+            res = http_request("site", "sitemap", "GET", sitemap_url, timeout=30)
             tree = etree.parse(BytesIO(res.content))
         except Exception as e:
             logger.warning(f"Failed to parse sitemap {sitemap_url}: {e}")
@@ -279,7 +311,7 @@ def filter_sitemap_urls(pages_csv, output_dir=OUTPUT_DIR):
 # -------------------------
 def inspect_urls(service_account_file, site_url, filtered_csv, output_dir=OUTPUT_DIR):
     creds = _load_inspection_credentials(service_account_file)
-    service = build("searchconsole", "v1", credentials=creds)
+    service = _searchconsole_service(creds)
 
     df = pd.read_csv(filtered_csv)
     rows = []
@@ -301,9 +333,10 @@ def inspect_urls(service_account_file, site_url, filtered_csv, output_dir=OUTPUT
 
         logger.info(f"Inspecting URL: {url}")
         try:
-            resp = service.urlInspection().index().inspect(
-                body={"inspectionUrl": url, "siteUrl": site_url}
-            ).execute()
+            with track_call("gsc", "url_inspection"):
+                resp = service.urlInspection().index().inspect(
+                    body={"inspectionUrl": url, "siteUrl": site_url}
+                ).execute()
 
             result = resp["inspectionResult"]["indexStatusResult"]
 
@@ -316,6 +349,7 @@ def inspect_urls(service_account_file, site_url, filtered_csv, output_dir=OUTPUT
             })
 
             inspected_today += 1
+            observe_rows("gsc_url_inspection", 1)
             time.sleep(uniform(0.2, 0.5))
 
         except Exception as e:
@@ -325,6 +359,7 @@ def inspect_urls(service_account_file, site_url, filtered_csv, output_dir=OUTPUT
     today = datetime.now().strftime("%Y-%m-%d")
     out = os.path.join(output_dir, f"url_indexing_status_{today}.csv")
     pd.DataFrame(rows).to_csv(out, index=False)
+    append_inspection(out, today)
 
     logger.info(f"Saved daily inspection CSV: {out}")
     return out
@@ -333,29 +368,18 @@ def inspect_urls(service_account_file, site_url, filtered_csv, output_dir=OUTPUT
 # WEEKLY COMBINE
 # -------------------------
 def combine_weekly_indexing_status(output_dir=OUTPUT_DIR):
-    files = glob.glob(os.path.join(output_dir, "url_indexing_status_*.csv"))
-    if not files:
-        return None
-
-    df_list = []
-    for f in files:
-        df = pd.read_csv(f)
-        if df.empty:
-            continue
-        date = os.path.basename(f).replace("url_indexing_status_", "").replace(".csv", "")
-        df["inspection_date"] = pd.to_datetime(date)
-        df_list.append(df)
-
-    combined = pd.concat(df_list, ignore_index=True)
-    combined.sort_values("inspection_date", ascending=False, inplace=True)
-    master = combined.drop_duplicates("url")
+    """
+    Latest inspection per URL, exported from the indexing history. Daily files
+    are applied as they land (inspect_urls); only files the history has not
+    seen yet are read here.
+    """
+    backfill_daily_files(output_dir)
 
-    master_path = os.path.join(output_dir, "url_indexing_status.csv")
-    master.drop(columns=["inspection_date"]).to_csv(master_path, index=False)
+    master_path = export_current_state(os.path.join(output_dir, "url_indexing_status.csv"))
+    if not master_path:
+        return None
 
     logger.warning(f"🎉 MASTER FILE CREATED: {master_path}")
-    logger.warning(f"Final shape: {master.shape}")
-
     return master_path
 
 
@@ -372,12 +396,15 @@ def normalize_url(url):
 # MERGE WITH PERFORMANCE
 # -------------------------
 def merge_indexing_with_performance(indexing_csv, output_dir=OUTPUT_DIR):
-    indexing = pd.read_csv(indexing_csv)
-
     perf_csv = os.path.join(
         output_dir, "GSC Reports", "Performance Reports", "Top pages.csv"
     )
-    gsc = pd.read_csv(perf_csv)
+    out = os.path.join(output_dir, "final_pages_indexing_performance.csv")
+    if use_duckdb():
+        return merge_indexing_with_performance_sql(indexing_csv, perf_csv, out, normalize_url)
+
+    indexing = apply_dtype_policy(pd.read_csv(indexing_csv), "merge_indexing")
+    gsc = apply_dtype_policy(pd.read_csv(perf_csv), "merge_gsc_performance")
 
     # Rename column
     gsc.rename(columns={"Top pages": "url"}, inplace=True)
@@ -397,7 +424,6 @@ def merge_indexing_with_performance(indexing_csv, output_dir=OUTPUT_DIR):
     # Cleanup
     merged.drop(columns=["url_norm"], inplace=True)
 
-    out = os.path.join(output_dir, "final_pages_indexing_performance.csv")
     merged.to_csv(out, index=False)
 
     return out
@@ -406,7 +432,14 @@ def merge_indexing_with_performance(indexing_csv, output_dir=OUTPUT_DIR):
 # MERGE CWV WITH FINAL INDEXING CSV
 # -------------------------
 
-def merge_cwv_with_indexing(final_csv, output_dir=OUTPUT_DIR):
+CWV_COLUMNS = ["url", "http_status", "lcp", "inp", "cls", "fcp"]
+
+
+def merge_cwv_with_indexing(final_csv, output_dir=OUTPUT_DIR, progress_csv=None):
+    """
+    progress_csv: optional file every fetched row is appended to, so a rerun
+    after a crash only calls PSI for the URLs that are still missing.
+    """
     df = pd.read_csv(final_csv)
 
     PSI_API_KEY = os.getenv("PSI_API_KEY")
@@ -415,27 +448,51 @@ def merge_cwv_with_indexing(final_csv, output_dir=OUTPUT_DIR):
         return final_csv
 
     rows = []
+    done = set()
+    progress = None
 
-    for url in df["url"]:
-        http_status = fetch_http_status(url)
-        cwv = fetch_cwv(url, PSI_API_KEY)
-
-        if not cwv:
-            logger.info(f"CWV skipped for {url}")
-            cwv = {}
-
-        rows.append({
-            "url": url,
-            "http_status": http_status,
-            "lcp": cwv.get("lcp"),
-            "inp": cwv.get("inp"),
-            "cls": cwv.get("cls"),
-            "fcp": cwv.get("fcp")
-        })
-
-        time.sleep(uniform(1, 2))
-
-    cwv_df = pd.DataFrame(rows)
+    try:
+        if progress_csv:
+            if os.path.exists(progress_csv) and os.path.getsize(progress_csv):
+                rows = pd.read_csv(progress_csv).to_dict("records")
+                done = {r["url"] for r in rows}
+                logger.info(f"Resuming CWV: {len(done)} URLs already fetched")
+            progress = open(progress_csv, "a", newline="", encoding="utf-8")
+            writer = csv.DictWriter(progress, fieldnames=CWV_COLUMNS)
+            if not done:
+                writer.writeheader()
+
+        for url in df["url"]:
+            if url in done:
+                continue
+
+            http_status = fetch_http_status(url)
+            cwv = fetch_cwv(url, PSI_API_KEY)
+
+            if not cwv:
+                logger.info(f"CWV skipped for {url}")
+                cwv = {}
+
+            row = {
+                "url": url,
+                "http_status": http_status,
+                "lcp": cwv.get("lcp"),
+                "inp": cwv.get("inp"),
+                "cls": cwv.get("cls"),
+                "fcp": cwv.get("fcp")
+            }
+            rows.append(row)
+            if progress:
+                writer.writerow(row)
+                progress.flush()
+
+            time.sleep(uniform(1, 2))
+    finally:
+        # Closed on errors too: a leaked handle keeps the resume file locked on Windows
+        if progress:
+            progress.close()
+
+    cwv_df = pd.DataFrame(rows, columns=CWV_COLUMNS).drop_duplicates("url", keep="last")
 
     merged = pd.merge(
         df,
@@ -458,47 +515,65 @@ def merge_cwv_with_indexing(final_csv, output_dir=OUTPUT_DIR):
 def run_gsc_indexing_pipeline(
     service_account_file,
     site_url,
-    output_dir=OUTPUT_DIR
+    output_dir=OUTPUT_DIR,
+    run_id=None
 ):
+    """
+    With a run_id every step is checkpointed in the run manifest: a rerun
+    of a failed run skips the finished steps and restores their files.
+    """
     logger.info("🚀 Starting GSC Indexing Pipeline")
 
     # 1️⃣ Fetch sitemap URLs
-    sitemap_csv = fetch_sitemap_urls(
+    sitemap_csv = checkpoint(
+        run_id, "gsc_sitemap", fetch_sitemap_urls,
         site_url=site_url,
-        output_dir=output_dir
+        output_dir=output_dir,
+        outputs=lambda path: [path]
     )
 
     # 2️⃣ Filter sitemap URLs
-    filtered_csv = filter_sitemap_urls(
+    filtered_csv = checkpoint(
+        run_id, "gsc_filter_sitemap", filter_sitemap_urls,
         pages_csv=sitemap_csv,
-        output_dir=output_dir
+        output_dir=output_dir,
+        outputs=lambda path: [path]
     )
 
     # 3️⃣ URL Inspection (creates daily url_indexing_status_*.csv)
-    inspect_urls(
+    checkpoint(
+        run_id, "gsc_inspect_urls", inspect_urls,
         service_account_file=service_account_file,
         site_url=site_url,
         filtered_csv=filtered_csv,
-        output_dir=output_dir
+        output_dir=output_dir,
+        outputs=lambda path: [path]
     )
 
     # 4️⃣ Combine weekly/daily indexing status
-    master_csv = combine_weekly_indexing_status(
-        output_dir=output_dir
+    master_csv = checkpoint(
+        run_id, "gsc_combine_indexing", combine_weekly_indexing_status,
+        output_dir=output_dir,
+        outputs=lambda path: [path]
     )
 
     # 5️⃣ Merge indexing + GSC performance
     if master_csv:
-        final_csv = merge_indexing_with_performance(
+        final_csv = checkpoint(
+            run_id, "gsc_merge_performance", merge_indexing_with_performance,
             indexing_csv=master_csv,
-            output_dir=output_dir
+            output_dir=output_dir,
+            outputs=lambda path: [path]
         )
 
         # 6️⃣ Merge CWV LAST (correct place)
         if final_csv:
-            merge_cwv_with_indexing(
+            checkpoint(
+                run_id, "gsc_merge_cwv", merge_cwv_with_indexing,
                 final_csv=final_csv,
-                output_dir=output_dir
+                output_dir=output_dir,
+                progress_csv=os.path.join(run_dir(run_id), "cwv_progress.csv") if run_id else None,
+                outputs=lambda path: [path]
             )
 
     logger.info("✅ GSC Indexing Pipeline completed")
@@ -515,25 +590,29 @@ def fetch_gsc_full(
     site_url,
     start_date,
     end_date,
-    base_output_dir
+    base_output_dir,
+    run_id=None
 ):
     """
     This function is called from Celery (seo_tasks.py)
-    DO NOT change signature
+    DO NOT change signature (run_id is an optional trailing keyword for resume)
     """
 
-    perf_files = fetch_gsc_performance_full(
+    perf_files = checkpoint(
+        run_id, "gsc_performance", fetch_gsc_performance_full,
         service_account_file=service_account_file,
         site_url=site_url,
         output_dir=base_output_dir,
         start_date=start_date,
-        end_date=end_date
+        end_date=end_date,
+        outputs=lambda paths: paths
     )
 
     final_csv = run_gsc_indexing_pipeline(
         service_account_file=service_account_file,
         site_url=site_url,
-        output_dir=base_output_dir
+        output_dir=base_output_dir,
+        run_id=run_id
     )
 
     logger.info("✅GSC Performance + Indexing completed")
@@ -0,0 +1,239 @@
+# indexing_history.py
+"""
+Append-only per-URL indexing history.
+
+Layout (Parquet, partitioned by inspection date):
+
+    indexing_history/
+        inspections/date=YYYY-MM-DD/part.parquet   every inspection row, never deleted
+        changes/date=YYYY-MM-DD/part.parquet       state transitions found that day
+        current_state.parquet                      latest inspection per URL
+
+Each daily inspection is applied once: its rows are appended to the day's
+partition, compared with the current state (one row per URL) and the
+transitions are logged. "Current state" reads one small file and "what
+changed since last week" only reads the change partitions of those days.
+"""
+import os
+import glob
+from datetime import date, timedelta
+
+import pandas as pd
+
+from artifact_store import file_lock
+
+HISTORY_DIR = os.path.join(os.getcwd(), os.getenv("INDEXING_HISTORY_DIR", "indexing_history"))
+
+STATE_COLUMNS = ["url", "coverage_state", "indexing_state", "last_crawl", "verdict"]
+TRACKED_COLUMNS = ["coverage_state", "indexing_state", "verdict"]
+INDEXED_VERDICT = "PASS"
+
+DAILY_FILE_PREFIX = "url_indexing_status_"
+
+# url_indexing_status.csv only lists URLs inspected within this many days
+EXPORT_WINDOW_DAYS = int(os.getenv("INDEXING_EXPORT_DAYS", "7"))
+
+
+# -------------------------
+# STORAGE HELPERS
+# -------------------------
+def _partition_path(table: str, day: str, history_dir: str = HISTORY_DIR) -> str:
+    return os.path.join(history_dir, table, f"date={day}", "part.parquet")
+
+
+def _state_path(history_dir: str = HISTORY_DIR) -> str:
+    return os.path.join(history_dir, "current_state.parquet")
+
+
+def _lock_path(history_dir: str = HISTORY_DIR) -> str:
+    return os.path.join(history_dir, "history.lock")
+
+
+def _write_parquet(df: pd.DataFrame, path: str):
+    """Write atomically so a crash never leaves a truncated partition."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def partition_dates(table: str = "inspections", history_dir: str = HISTORY_DIR) -> list:
+    """Sorted ISO dates that have a partition in the table."""
+    paths = glob.glob(os.path.join(history_dir, table, "date=*", "part.parquet"))
+    return sorted(os.path.basename(os.path.dirname(p))[len("date="):] for p in paths)
+
+
+def _read_partitions(table: str, since: str = None, until: str = None,
+                     history_dir: str = HISTORY_DIR) -> pd.DataFrame:
+    """Read only the partitions within [since, until] (ISO dates, inclusive)."""
+    frames = [
+        pd.read_parquet(_partition_path(table, day, history_dir))
+        for day in partition_dates(table, history_dir)
+        if (since is None or day >= since) and (until is None or day <= until)
+    ]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+# -------------------------
+# CHANGE DETECTION
+# -------------------------
+def _classify_changes(previous: pd.DataFrame, latest: pd.DataFrame, day: str) -> pd.DataFrame:
+    """Transitions between the stored state and the latest inspection of each URL."""
+    merged = latest.merge(
+        previous[["url"] + TRACKED_COLUMNS],
+        on="url", how="left", suffixes=("", "_prev"), indicator=True
+    )
+
+    is_new = merged["_merge"] == "left_only"
+    was_indexed = merged["verdict_prev"] == INDEXED_VERDICT
+    is_indexed = merged["verdict"] == INDEXED_VERDICT
+    changed = pd.Series(False, index=merged.index)
+    for col in TRACKED_COLUMNS:
+        changed |= merged[col].fillna("") != merged[f"{col}_prev"].fillna("")
+
+    merged["change_type"] = "changed"
+    merged.loc[was_indexed & ~is_indexed, "change_type"] = "deindexed"
+    merged.loc[~was_indexed & is_indexed, "change_type"] = "indexed"
+    merged.loc[is_new, "change_type"] = "new"
+
+    changes = merged[is_new | changed].copy()
+    changes["change_date"] = day
+    return changes[
+        ["url", "change_date", "change_type"]
+        + [c for col in TRACKED_COLUMNS for c in (f"{col}_prev", col)]
+    ].reset_index(drop=True)
+
+
+# -------------------------
+# WRITE PATH
+# -------------------------
+def append_inspection(source, inspection_date: str = None, history_dir: str = HISTORY_DIR) -> dict:
+    """
+    Apply one daily inspection (CSV path or DataFrame) to the history.
+
+    The inspection date defaults to the date in a url_indexing_status_YYYY-MM-DD.csv
+    file name, else today. Re-applying a day replaces that day's rows only.
+    """
+    if isinstance(source, str):
+        if inspection_date is None:
+            name = os.path.basename(source)
+            if name.startswith(DAILY_FILE_PREFIX):
+                inspection_date = name[len(DAILY_FILE_PREFIX):-len(".csv")]
+        source = pd.read_csv(source) if os.path.getsize(source) > 1 else pd.DataFrame()
+
+    day = date.fromisoformat(inspection_date).isoformat() if inspection_date else date.today().isoformat()
+
+    if source.empty or "url" not in source.columns:
+        return {"date": day, "rows": 0, "changes": 0}
+
+    rows = source.reindex(columns=STATE_COLUMNS).astype("string")
+    rows = rows.drop_duplicates("url", keep="last")
+    rows["inspection_date"] = day
+
+    # Partitions and the state are read-modify-written: one writer at a time
+    with file_lock(_lock_path(history_dir)):
+        # Append-only log: same-day reruns are merged into the day's partition
+        part_path = _partition_path("inspections", day, history_dir)
+        if os.path.exists(part_path):
+            existing = pd.read_parquet(part_path)
+            rows_all = pd.concat([existing, rows], ignore_index=True).drop_duplicates("url", keep="last")
+        else:
+            rows_all = rows
+        _write_parquet(rows_all, part_path)
+
+        # Upsert the current state; older inspections never overwrite newer ones
+        state = current_state(history_dir)
+        if state.empty:
+            state = pd.DataFrame(columns=STATE_COLUMNS + ["inspection_date"])
+        newer = rows.merge(state[["url", "inspection_date"]], on="url", how="left", suffixes=("", "_state"))
+        newer = rows[(newer["inspection_date_state"].isna() | (newer["inspection_date_state"] <= day)).values]
+
+        changes = _classify_changes(state, newer, day)
+        if not changes.empty:
+            change_path = _partition_path("changes", day, history_dir)
+            if os.path.exists(change_path):
+                changes = pd.concat([pd.read_parquet(change_path), changes], ignore_index=True)
+                changes = changes.drop_duplicates(["url", "change_type"], keep="last")
+            _write_parquet(changes, change_path)
+
+        kept = state[~state["url"].isin(newer["url"])]
+        state = pd.concat([kept, newer], ignore_index=True) if not kept.empty else newer
+        _write_parquet(state.sort_values("url").reset_index(drop=True), _state_path(history_dir))
+
+    print(f"🗂️ Indexing history {day}: {len(rows)} URLs, {len(changes)} changes")
+    return {"date": day, "rows": len(rows), "changes": len(changes)}
+
+
+def backfill_daily_files(output_dir: str, history_dir: str = HISTORY_DIR) -> list:
+    """Apply daily url_indexing_status_*.csv files whose date is not in the history yet."""
+    known = set(partition_dates("inspections", history_dir))
+    applied = []
+    for path in sorted(glob.glob(os.path.join(output_dir, f"{DAILY_FILE_PREFIX}*.csv"))):
+        day = os.path.basename(path)[len(DAILY_FILE_PREFIX):-len(".csv")]
+        try:
+            date.fromisoformat(day)
+        except ValueError:
+            continue
+        if day not in known:
+            append_inspection(path, day, history_dir)
+            applied.append(path)
+    return applied
+
+
+# -------------------------
+# READ PATH
+# -------------------------
+def current_state(history_dir: str = HISTORY_DIR) -> pd.DataFrame:
+    """Latest inspection of every URL ever seen."""
+    path = _state_path(history_dir)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=STATE_COLUMNS + ["inspection_date"])
+    return pd.read_parquet(path)
+
+
+def export_current_state(path: str, days: int = EXPORT_WINDOW_DAYS,
+                         history_dir: str = HISTORY_DIR) -> str:
+    """
+    Write the url_indexing_status.csv the merge steps expect: the latest state
+    of URLs inspected in the last `days` days. URLs that dropped out of the
+    sitemap keep their history but leave the report.
+    """
+    since = (date.today() - timedelta(days=days)).isoformat()
+    state = current_state(history_dir)
+    state = state[state["inspection_date"] >= since]
+    if state.empty:
+        print(f"⚠️ No URL inspected since {since}; url_indexing_status.csv not written")
+        return None
+    state[STATE_COLUMNS].to_csv(path, index=False)
+    return path
+
+
+def changes_since(since: str = None, days: int = 7, change_types=None,
+                  history_dir: str = HISTORY_DIR) -> pd.DataFrame:
+    """Transitions logged on or after `since` (default: the last `days` days)."""
+    since = since or (date.today() - timedelta(days=days)).isoformat()
+    changes = _read_partitions("changes", since=since, history_dir=history_dir)
+    if changes.empty or change_types is None:
+        return changes
+    return changes[changes["change_type"].isin(change_types)].reset_index(drop=True)
+
+
+def newly_deindexed(since: str = None, days: int = 7, history_dir: str = HISTORY_DIR) -> pd.DataFrame:
+    """URLs that went from indexed (PASS) to not indexed and are still not indexed."""
+    changes = changes_since(since, days, ("deindexed",), history_dir)
+    if changes.empty:
+        return changes
+    state = current_state(history_dir)
+    still_out = state.loc[state["verdict"] != INDEXED_VERDICT, "url"]
+    latest = changes.sort_values("change_date").drop_duplicates("url", keep="last")
+    return latest[latest["url"].isin(still_out)].reset_index(drop=True)
+
+
+def url_history(url: str, since: str = None, history_dir: str = HISTORY_DIR) -> pd.DataFrame:
+    """Every stored inspection of one URL, oldest first."""
+    rows = _read_partitions("inspections", since=since, history_dir=history_dir)
+    if rows.empty:
+        return rows
+    return rows[rows["url"] == url].sort_values("inspection_date").reset_index(drop=True)
@@ -0,0 +1,86 @@
+# llm_cache.py
+"""
+Persistent cache of LLM answers.
+
+The key is the SHA-256 of the model name, the prompt template (version and
+text) and the dataset pasted into it, so an unchanged week of data with an
+unchanged prompt is answered from disk instead of another Gemini call:
+
+    report = cached_completion(call_gemini_checked, GEMINI_MODEL, template, version, dataset, prompt)
+
+One JSON file per entry under LLM_CACHE_DIR/<sha[:2]>/<sha>.json.
+LLM_CACHE=refresh ignores existing entries and overwrites them with a new
+answer (force regeneration), LLM_CACHE=off bypasses the cache.
+"""
+import os
+import json
+import hashlib
+import tempfile
+from datetime import datetime
+
+from metrics import observe_llm_cache
+
+LLM_CACHE_DIR = os.path.join(os.getcwd(), os.getenv("LLM_CACHE_DIR", "llm_cache"))
+LLM_CACHE_MODE = os.getenv("LLM_CACHE", "on").lower()  # on | refresh | off
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def cache_key(model: str, template: str, template_version, dataset: str) -> str:
+    parts = [model, str(template_version), _sha256(template), _sha256(dataset)]
+    return _sha256("\x1f".join(parts))
+
+
+def _entry_path(key: str, cache_dir: str = LLM_CACHE_DIR) -> str:
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+
+def load_response(key: str, cache_dir: str = LLM_CACHE_DIR) -> str:
+    """Cached answer for key, or None."""
+    try:
+        with open(_entry_path(key, cache_dir), "r", encoding="utf-8") as f:
+            return json.load(f)["response"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def store_response(key: str, response: str, meta: dict = None, cache_dir: str = LLM_CACHE_DIR) -> str:
+    path = _entry_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = {"key": key, "created_at": datetime.now().isoformat(timespec="seconds"),
+             **(meta or {}), "response": response}
+    # Own temp file per writer: section workers and concurrent runs may store the same key
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(path),
+                                     suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+        json.dump(entry, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def cached_completion(generate, model: str, template: str, template_version, dataset: str,
+                      prompt: str, mode: str = None, cache_dir: str = LLM_CACHE_DIR) -> str:
+    """
+    generate(prompt) on a cache miss, the stored answer on a hit. Answers
+    are only stored when generate returns (it raises on empty answers).
+    """
+    mode = (mode or LLM_CACHE_MODE).lower()
+    if mode == "off":
+        return generate(prompt)
+
+    key = cache_key(model, template, template_version, dataset)
+    if mode != "refresh":
+        response = load_response(key, cache_dir)
+        if response is not None:
+            print(f"💾 LLM cache hit {key[:12]} ({model}, template v{template_version})")
+            observe_llm_cache("hit")
+            return response
+
+    observe_llm_cache("refresh" if mode == "refresh" else "miss")
+    response = generate(prompt)
+    store_response(key, response, {"model": model, "template_version": template_version,
+                                   "dataset_sha256": _sha256(dataset),
+                                   "prompt_sha256": _sha256(prompt)}, cache_dir)
+    return response
@@ -1,28 +1,54 @@
 # main.py
 import os
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
-from celery_pdf_app import celery_app
+import json
+import time
+from typing import Optional
+from fastapi import FastAPI, Depends
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from sqlalchemy.orm import Session
+from celery_pdf_app import celery_pdf_app as celery_app, CPU_QUEUE
+from DB.database import get_db
+from DB.db_utils import init_db, list_report_runs, get_report_run
+from metrics import render_metrics
 
 app = FastAPI(title="SEO Report + PDF Trigger API")
 
+
+@app.on_event("startup")
+def migrate_database():
+    """Create missing tables and add new columns (e.g. seo_reports.run_id) before serving /runs."""
+    try:
+        init_db()
+    except Exception as e:
+        print(f"⚠️ Database migration failed: {e}")
+
 OUTPUT_DIR = os.path.join(os.getcwd(), os.getenv("OUTPUT_DIR", "output"))
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Queue served by the celery_app I/O worker (see celery_app.IO_QUEUE)
+SEO_IO_QUEUE = os.getenv("SEO_IO_QUEUE", "seo_io")
+
 # -------------------------
 # Trigger PDF Report via Celery
 # -------------------------
 @app.get("/trigger-pdf-report")
 @app.post("/trigger-pdf-report")
-def trigger_pdf_report():
+def trigger_pdf_report(run_id: Optional[str] = None, force_regenerate: bool = False):
     """
     Trigger the Celery task that:
       - Preprocesses GA4 & GSC CSVs
       - Generates SEO PDF
       - Sends email
+
+    run_id: resume a specific unfinished run (checkpointed stages are skipped)
+    force_regenerate: ask Gemini again even if the cached answer still matches
     """
     try:
-        task = celery_app.send_task("tasks.pdf_tasks.generate_pdf_report")
+        task = celery_app.send_task(
+            "tasks.generate_pdf_report",
+            kwargs={"run_id": run_id, "force_regenerate": force_regenerate},
+            queue=CPU_QUEUE,
+        )
         return JSONResponse(
             status_code=200,
             content={
@@ -44,18 +70,32 @@ def trigger_pdf_report():
 def root():
     return {"message": "SEO PDF Report Service Running 🚀"}
 
+# -------------------------
+# Prometheus metrics (API + Celery workers in multiprocess mode)
+# -------------------------
+@app.get("/metrics")
+def metrics():
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
 # -------------------------
 # Optional: Run weekly report (existing GA4 + GSC fetch)
 # -------------------------
 @app.get("/run-report")
 @app.post("/run-report")
-def run_report():
+def run_report(run_id: Optional[str] = None):
     """
     Trigger fetching raw GA4 + GSC CSV reports.
     This can call your existing fetch_and_email_report task if needed.
+
+    run_id: resume a specific unfinished run (checkpointed stages are skipped)
     """
     try:
-        task = celery_app.send_task("tasks.fetch_and_email_report")
+        task = celery_app.send_task(
+            "tasks.seo_tasks.fetch_and_email_report",
+            kwargs={"run_id": run_id},
+            queue=SEO_IO_QUEUE
+        )
         return JSONResponse(
             status_code=200,
             content={
@@ -68,4 +108,95 @@ def run_report():
         return JSONResponse(
             status_code=500,
             content={"status": "error", "message": str(e)}
-        )
\ No newline at end of file
+        )
+
+# -------------------------
+# Run history / stage timing
+# -------------------------
+RUN_EVENTS_POLL_SECONDS = float(os.getenv("RUN_EVENTS_POLL_SECONDS", "2"))
+TERMINAL_RUN_STATUSES = ("generated", "sent", "failed")
+# A run whose worker died stays "running": stop streaming after this long
+# without a stage change, or this long in total
+RUN_EVENTS_IDLE_SECONDS = float(os.getenv("RUN_EVENTS_IDLE_SECONDS", str(2 * 3600)))
+RUN_EVENTS_MAX_SECONDS = float(os.getenv("RUN_EVENTS_MAX_SECONDS", str(12 * 3600)))
+
+
+@app.get("/runs")
+def runs(limit: int = 50, report_type: str = None, db: Session = Depends(get_db)):
+    """
+    Most recent pipeline runs with their status and timing.
+    """
+    try:
+        return {"runs": list_report_runs(limit=limit, report_type=report_type, db=db)}
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"status": "error", "message": str(e)}
+        )
+
+
+@app.get("/runs/{report_id}")
+def run_detail(report_id: int, db: Session = Depends(get_db)):
+    """
+    One pipeline run with per-stage state, start/end times, row counts and artifacts.
+    """
+    try:
+        run = get_report_run(report_id, db=db)
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"status": "error", "message": str(e)}
+        )
+    if run is None:
+        return JSONResponse(
+            status_code=404,
+            content={"status": "error", "message": f"Run {report_id} not found"}
+        )
+    return run
+
+
+def _run_events(report_id: int):
+    """
+    Poll the run and emit a server-sent event whenever a stage changes.
+    Ends with "done", or "timeout" when the run stalls or the stream is too old.
+    """
+    seen = {}
+    started = last_change = time.monotonic()
+    while True:
+        run = get_report_run(report_id)
+        if run is None:
+            yield f"event: error\ndata: {json.dumps({'message': 'run not found'})}\n\n"
+            return
+
+        for stage in run["stages"]:
+            key = (stage["status"], stage["finished_at"])
+            if seen.get(stage["id"]) != key:
+                seen[stage["id"]] = key
+                last_change = time.monotonic()
+                yield f"event: stage\ndata: {json.dumps(stage)}\n\n"
+
+        if run["status"] in TERMINAL_RUN_STATUSES:
+            run.pop("stages")
+            yield f"event: done\ndata: {json.dumps(run)}\n\n"
+            return
+
+        now = time.monotonic()
+        if now - last_change >= RUN_EVENTS_IDLE_SECONDS or now - started >= RUN_EVENTS_MAX_SECONDS:
+            message = {"status": run["status"], "idle_seconds": round(now - last_change)}
+            yield f"event: timeout\ndata: {json.dumps(message)}\n\n"
+            return
+
+        yield ": keep-alive\n\n"
+        time.sleep(RUN_EVENTS_POLL_SECONDS)
+
+
+@app.get("/runs/{report_id}/events")
+def run_events(report_id: int):
+    """
+    Live progress of a run as a server-sent events stream.
+    """
+    return StreamingResponse(
+        _run_events(report_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
@@ -0,0 +1,170 @@
+# metrics.py
+import os
+import time
+from contextlib import contextmanager
+
+# -------------------------
+# MULTIPROCESS MODE
+# -------------------------
+# Celery workers and the API run in separate processes. When
+# PROMETHEUS_MULTIPROC_DIR is set (shared volume), every process writes its
+# samples there and /metrics aggregates them. It must be set before
+# prometheus_client is imported.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# API latencies range from ~100 ms (GSC query) to minutes (PSI, Gemini)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 180, 300)
+STAGE_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400)
+
+# -------------------------
+# METRICS
+# -------------------------
+EXTERNAL_CALL_SECONDS = Histogram(
+    "seo_external_call_duration_seconds",
+    "Latency of calls to external services (GA4, GSC, PSI, Gemini, Brevo, DB, PDF)",
+    ["service", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+EXTERNAL_CALLS = Counter(
+    "seo_external_calls_total",
+    "Calls to external services by outcome",
+    ["service", "operation", "outcome"],
+)
+
+EXTERNAL_CALL_ERRORS = Counter(
+    "seo_external_call_errors_total",
+    "Failed calls to external services by error type",
+    ["service", "operation", "error_type"],
+)
+
+EXTERNAL_CALLS_IN_FLIGHT = Gauge(
+    "seo_external_calls_in_flight",
+    "Calls to external services currently in progress",
+    ["service", "operation"],
+    multiprocess_mode="livesum",
+)
+
+ROWS_FETCHED = Counter(
+    "seo_rows_fetched_total",
+    "Rows returned by external APIs or ingested into the database",
+    ["source"],
+)
+
+BYTES_WRITTEN = Counter(
+    "seo_bytes_written_total",
+    "Bytes written to report files, PDFs and the artifact store",
+    ["kind"],
+)
+
+STAGE_SECONDS = Histogram(
+    "seo_pipeline_stage_duration_seconds",
+    "Duration of pipeline stages",
+    ["stage", "status"],
+    buckets=STAGE_BUCKETS,
+)
+
+LLM_CACHE_LOOKUPS = Counter(
+    "seo_llm_cache_lookups_total",
+    "LLM response cache lookups by outcome (hit, miss, refresh)",
+    ["outcome"],
+)
+
+DATAFRAME_MEMORY = Gauge(
+    "seo_dataframe_memory_bytes",
+    "Deep memory of the last DataFrame per pipeline stage, before and after the dtype policy",
+    ["stage", "phase"],
+    multiprocess_mode="max",
+)
+
+
+# -------------------------
+# INSTRUMENTATION HELPERS
+# -------------------------
+@contextmanager
+def track_call(service: str, operation: str):
+    """
+    Time one external call and count its outcome.
+
+    Exceptions are recorded by class name and re-raised. Callers that detect
+    a failure without an exception (e.g. HTTP 500) set call["error"].
+    """
+    call = {"error": None}
+    in_flight = EXTERNAL_CALLS_IN_FLIGHT.labels(service, operation)
+    in_flight.inc()
+    started = time.perf_counter()
+
+    try:
+        yield call
+    except Exception as e:
+        call["error"] = type(e).__name__
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.labels(service, operation).observe(time.perf_counter() - started)
+        in_flight.dec()
+        if call["error"]:
+            EXTERNAL_CALL_ERRORS.labels(service, operation, call["error"]).inc()
+            EXTERNAL_CALLS.labels(service, operation, "error").inc()
+        else:
+            EXTERNAL_CALLS.labels(service, operation, "success").inc()
+
+
+def observe_rows(source: str, count: int):
+    if count:
+        ROWS_FETCHED.labels(source).inc(count)
+
+
+def observe_files_written(kind: str, paths):
+    total = 0
+    for path in paths or []:
+        try:
+            total += os.path.getsize(path)
+        except (OSError, TypeError):
+            continue
+    if total:
+        BYTES_WRITTEN.labels(kind).inc(total)
+
+
+def observe_stage(stage: str, status: str, duration_seconds: float):
+    STAGE_SECONDS.labels(stage, status).observe(duration_seconds)
+
+
+def observe_llm_cache(outcome: str):
+    LLM_CACHE_LOOKUPS.labels(outcome).inc()
+
+
+def observe_frame_memory(stage: str, before_bytes: int, after_bytes: int):
+    DATAFRAME_MEMORY.labels(stage, "before").set(before_bytes)
+    DATAFRAME_MEMORY.labels(stage, "after").set(after_bytes)
+
+
+# -------------------------
+# EXPOSITION
+# -------------------------
+def render_metrics():
+    """Return (payload, content_type) for the /metrics endpoint."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int = None):
+    """Drop live gauges of an exited worker process (multiprocess mode only)."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,198 @@
+# multi_table.py
+"""
+Multi-table container for the GA4 overview reports
+("Acquisition overview.csv", "Engagement Overview.csv", ...).
+
+The data file keeps its readable layout, one block per table:
+
+    Table: <title>
+    <csv header>
+    <csv rows>
+    <blank line>
+
+and a sidecar index "<file>.toc.json" lists every table with the byte offset
+and length of its CSV block, row count, status (ok | no_data | error) and
+column dtypes. read_table() seeks straight to one block and parses only
+that table. Files without an index (older runs, restored artifacts) are
+indexed by scanning the "Table:" lines; only MultiTableWriter writes the
+sidecar, reading never does.
+"""
+import io
+import os
+import json
+
+import pandas as pd
+
+from csv_schemas import frame_dtypes
+
+TABLE_PREFIX = "Table: "
+INDEX_SUFFIX = ".toc.json"
+INDEX_VERSION = 1
+
+NO_DATA = "No data"
+ERROR_FETCHING = "Error fetching data"
+
+
+def index_path(path: str) -> str:
+    return f"{path}{INDEX_SUFFIX}"
+
+
+def _block_schema(block: bytes) -> dict:
+    """Dtypes of the whole block: a sample misses late NaNs and strings."""
+    return frame_dtypes(pd.read_csv(io.BytesIO(block)))
+
+
+def _table_entry(title: str, offset: int, block: bytes) -> dict:
+    """TOC entry for one CSV block (header line included)."""
+    first_line = block.split(b"\n", 1)[0].strip().decode("utf-8")
+    if first_line in (NO_DATA, ERROR_FETCHING):
+        status = "no_data" if first_line == NO_DATA else "error"
+        return {"title": title, "offset": offset, "length": len(block), "rows": 0,
+                "status": status, "columns": {}}
+    return {
+        "title": title,
+        "offset": offset,
+        "length": len(block),
+        "rows": block.rstrip(b"\r\n").count(b"\n"),
+        "status": "ok",
+        "columns": _block_schema(block),
+    }
+
+
+def _write_index(path: str, tables: list):
+    index = {
+        "version": INDEX_VERSION,
+        "size": os.path.getsize(path),
+        "tables": tables,
+    }
+    tmp_path = f"{index_path(path)}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path(path))
+
+
+# -------------------------
+# WRITER
+# -------------------------
+class MultiTableWriter:
+    """
+    with MultiTableWriter(path) as writer:
+        writer.write_table("Nth day - Active users", df)   # empty/None -> "No data"
+        writer.write_error("Platform - Active users")
+
+    The index is written when the container is closed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tables = []
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.path, "wb")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self._f is None:
+            return
+        self._f.close()
+        self._f = None
+        _write_index(self.path, self.tables)
+
+    def _write_block(self, title: str, block: bytes):
+        self._f.write(f"{TABLE_PREFIX}{title}\n".encode("utf-8"))
+        offset = self._f.tell()
+        self._f.write(block)
+        self._f.write(b"\n")
+        self.tables.append(_table_entry(title, offset, block))
+
+    def write_table(self, title: str, df: pd.DataFrame = None):
+        if df is None or df.empty:
+            self._write_block(title, f"{NO_DATA}\n".encode("utf-8"))
+        else:
+            self._write_block(title, df.to_csv(index=False, lineterminator="\n").encode("utf-8"))
+
+    def write_error(self, title: str):
+        self._write_block(title, f"{ERROR_FETCHING}\n".encode("utf-8"))
+
+
+# -------------------------
+# READER
+# -------------------------
+def is_multi_table(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.readline().decode("utf-8-sig", errors="replace").startswith(TABLE_PREFIX)
+
+
+def scan_tables(path: str) -> list:
+    """Build the TOC of a container by scanning its "Table:" lines."""
+    tables = []
+    title, offset, end = None, None, None
+
+    def flush(f):
+        if title is not None:
+            f_pos = f.tell()
+            f.seek(offset)
+            tables.append(_table_entry(title, offset, f.read(end - offset)))
+            f.seek(f_pos)
+
+    with open(path, "rb") as f:
+        position = 0
+        for line in iter(f.readline, b""):
+            text = line.decode("utf-8-sig", errors="replace").rstrip("\r\n")
+            position += len(line)
+            if text.startswith(TABLE_PREFIX):
+                flush(f)
+                title, offset = text[len(TABLE_PREFIX):], position
+                end = offset
+            elif title is not None and text.strip():
+                end = position
+        flush(f)
+    return tables
+
+
+def read_index(path: str) -> list:
+    """TOC of a container; the sidecar index if it matches the file, else a scan."""
+    try:
+        with open(index_path(path), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") == INDEX_VERSION and index.get("size") == os.path.getsize(path):
+            return index["tables"]
+    except (OSError, ValueError):
+        pass
+    return scan_tables(path)
+
+
+def list_tables(path: str) -> list:
+    return [table["title"] for table in read_index(path)]
+
+
+def read_block(path: str, entry: dict) -> pd.DataFrame:
+    """The table of one TOC entry (empty for no_data / error tables)."""
+    if entry["status"] != "ok":
+        return pd.DataFrame()
+    with open(path, "rb") as f:
+        f.seek(entry["offset"])
+        block = f.read(entry["length"])
+    try:
+        return pd.read_csv(io.BytesIO(block), dtype=entry["columns"] or None)
+    except (ValueError, TypeError):
+        # Values outside the indexed dtypes (stale index): let the parser infer
+        return pd.read_csv(io.BytesIO(block))
+
+
+def read_table(path: str, title: str) -> pd.DataFrame:
+    """Load one table by title without parsing the others."""
+    for entry in read_index(path):
+        if entry["title"] == title:
+            return read_block(path, entry)
+    raise KeyError(f"No table '{title}' in {os.path.basename(path)}")
+
+
+def read_tables(path: str) -> dict:
+    """{title: DataFrame} for every table, in file order."""
+    return {entry["title"]: read_block(path, entry) for entry in read_index(path)}
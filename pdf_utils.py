@@ -1,7 +1,9 @@
 # pdf_utils.py
 import os
 import html
+import time
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from reportlab.platypus import (
     SimpleDocTemplate, Paragraph, Spacer, PageBreak
 )
@@ -9,6 +11,13 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 from reportlab.lib import colors
+from metrics import track_call
+
+# Batch rendering (generate_seo_pdfs): one process per core by default
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+
+PAGE_LAYOUT = dict(pagesize=A4, rightMargin=36, leftMargin=36, topMargin=36, bottomMargin=36)
+HEADING_COLORS = [colors.darkgreen, colors.darkred, colors.darkblue, colors.darkorange]
 
 # ────────────── Utility ──────────────
 def _sanitize(text: str) -> str:
@@ -25,20 +34,11 @@ def _add_footer(canvas, doc):
         f"Page {doc.page} | Generated by SEO Automation System"
     )
 
-# ────────────── Main PDF Function ──────────────
-def generate_seo_pdf(pdf_path: str, seo_text: str):
-    os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
-
-    doc = SimpleDocTemplate(
-        pdf_path,
-        pagesize=A4,
-        rightMargin=36,
-        leftMargin=36,
-        topMargin=36,
-        bottomMargin=36
-    )
+# ────────────── Styles (built once per process) ──────────────
+_STYLES = None
 
-    # ────────────── Styles ──────────────
+
+def _build_styles():
     styles = getSampleStyleSheet()
 
     styles.add(ParagraphStyle(
@@ -91,61 +91,187 @@ def generate_seo_pdf(pdf_path: str, seo_text: str):
         spaceAfter=30
     ))
 
-    story = []
+    # One numbered-heading style per heading colour, used in rotation
+    for i, heading_color in enumerate(HEADING_COLORS):
+        styles.add(ParagraphStyle(
+            name=f"NumberedHeading{i}",
+            fontSize=16,
+            textColor=colors.white,
+            backColor=heading_color,
+            leftIndent=0,
+            spaceBefore=18,
+            spaceAfter=10,
+            leading=22,
+            alignment=TA_LEFT,
+            bold=True
+        ))
+    return styles
+
+
+def get_styles():
+    """The report stylesheet, built on first use and shared by every PDF of the process."""
+    global _STYLES
+    if _STYLES is None:
+        _STYLES = _build_styles()
+    return _STYLES
 
-    # ───────────── Title Page ─────────────
-    story.append(Paragraph("Weekly SEO Report", styles["TitleStyle"]))
-    story.append(Paragraph(
-        f"Generated on: {datetime.now().strftime('%d %B %Y')}",
-        styles["MetaStyle"]
-    ))
 
-    # ───────────── Directly start content, no extra page break ─────────────
-    if not seo_text or not seo_text.strip():
-        story.append(Paragraph(
-            "⚠️ No SEO insights were generated.",
-            styles["BodyStyle"]
+# ────────────── Incremental PDF Builder ──────────────
+class SeoPdfBuilder:
+    """
+    Turns report text into flowables line by line (add_line), so the text
+    can be fed as it arrives (e.g. a streamed Gemini answer); build() lays
+    out and writes the PDF.
+    """
+
+    def __init__(self, pdf_path: str):
+        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+        self.pdf_path = pdf_path
+        self.doc = SimpleDocTemplate(pdf_path, **PAGE_LAYOUT)
+
+        self.styles = styles = get_styles()
+
+        self.story = []
+
+        # ───────────── Title Page ─────────────
+        self.story.append(Paragraph("Weekly SEO Report", styles["TitleStyle"]))
+        self.story.append(Paragraph(
+            f"Generated on: {datetime.now().strftime('%d %B %Y')}",
+            styles["MetaStyle"]
         ))
-    else:
-        heading_colors = [colors.darkgreen, colors.darkred, colors.darkblue, colors.darkorange]
-        heading_counter = 0
-
-        for raw_line in seo_text.split("\n"):
-            line = raw_line.strip()
-            if not line:
-                story.append(Spacer(1, 6))  # extra space for empty lines
-                continue
-
-            safe_line = _sanitize(line)
-
-            # Numbered Headings
-            if safe_line.endswith(":") and len(safe_line) < 60:
-                color_index = heading_counter % len(heading_colors)
-                heading_color = heading_colors[color_index]
-
-                styles.add(ParagraphStyle(
-                    name=f"NumberedHeading{heading_counter}",
-                    fontSize=16,
-                    textColor=colors.white,
-                    backColor=heading_color,
-                    leftIndent=0,
-                    spaceBefore=18,
-                    spaceAfter=10,
-                    leading=22,
-                    alignment=TA_LEFT,
-                    bold=True
-                ))
-
-                story.append(Paragraph(f"{heading_counter + 1}. {safe_line}", styles[f"NumberedHeading{heading_counter}"]))
-                heading_counter += 1
-
-            # Subheadings (smaller)
-            elif safe_line.startswith("###") or safe_line.endswith("**"):
-                story.append(Paragraph(safe_line.replace("###", ""), styles["SubHeadingStyle"]))
-
-            # Normal content
-            else:
-                story.append(Paragraph(safe_line, styles["BodyStyle"]))
-
-    # ───────────── Build PDF ─────────────
-    doc.build(story, onFirstPage=_add_footer, onLaterPages=_add_footer)
+        self._header_length = len(self.story)
+
+        self.heading_counter = 0
+        self.has_content = False
+
+    def add_line(self, raw_line: str):
+        styles = self.styles
+        line = raw_line.strip()
+        if not line:
+            self.story.append(Spacer(1, 6))  # extra space for empty lines
+            return
+        self.has_content = True
+
+        safe_line = _sanitize(line)
+
+        # Numbered Headings
+        if safe_line.endswith(":") and len(safe_line) < 60:
+            color_index = self.heading_counter % len(HEADING_COLORS)
+            self.story.append(Paragraph(f"{self.heading_counter + 1}. {safe_line}",
+                                        styles[f"NumberedHeading{color_index}"]))
+            self.heading_counter += 1
+
+        # Subheadings (smaller)
+        elif safe_line.startswith("###") or safe_line.endswith("**"):
+            self.story.append(Paragraph(safe_line.replace("###", ""), styles["SubHeadingStyle"]))
+
+        # Normal content
+        else:
+            self.story.append(Paragraph(safe_line, styles["BodyStyle"]))
+
+    def add_text(self, text: str):
+        for raw_line in text.split("\n"):
+            self.add_line(raw_line)
+
+    def build(self) -> str:
+        if not self.has_content:
+            del self.story[self._header_length:]
+            self.story.append(Paragraph(
+                "⚠️ No SEO insights were generated.",
+                self.styles["BodyStyle"]
+            ))
+
+        # ───────────── Build PDF ─────────────
+        with track_call("reportlab", "build_pdf"):
+            self.doc.build(self.story, onFirstPage=_add_footer, onLaterPages=_add_footer)
+        return self.pdf_path
+
+
+# ────────────── Main PDF Function ──────────────
+def generate_seo_pdf(pdf_path: str, seo_text: str):
+    builder = SeoPdfBuilder(pdf_path)
+    builder.add_text(seo_text or "")
+    builder.build()
+
+
+# ────────────── Batch Rendering ──────────────
+def _render_job(pdf_path: str, seo_text: str) -> dict:
+    started = time.perf_counter()
+    try:
+        generate_seo_pdf(pdf_path, seo_text)
+        status, error = "ok", None
+    except Exception as e:
+        status, error = "failed", f"{type(e).__name__}: {e}"
+    return {"pdf": pdf_path, "status": status, "seconds": round(time.perf_counter() - started, 3), "error": error}
+
+
+def generate_seo_pdfs(jobs, workers: int = None) -> list:
+    """
+    Render many reports (e.g. one per site or stakeholder): jobs is
+    [(pdf_path, seo_text), ...]. Reports are rendered on a process pool,
+    PDF_WORKERS processes by default; workers=1 renders in-process. Returns
+    one {pdf, status, seconds, error} record per job, in job order.
+    """
+    jobs = list(jobs)
+    started = time.perf_counter()
+    workers = max(1, min(workers or PDF_WORKERS, len(jobs) or 1))
+
+    results = None
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=get_styles) as pool:
+                futures = [pool.submit(_render_job, pdf_path, text) for pdf_path, text in jobs]
+                results = []
+                for (pdf_path, _), future in zip(jobs, futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:  # worker died (e.g. out of memory)
+                        results.append({"pdf": pdf_path, "status": "failed", "seconds": 0.0,
+                                        "error": f"{type(e).__name__}: {e}"})
+        except (AssertionError, OSError) as e:
+            # No child processes available here (e.g. a daemonic Celery worker)
+            print(f"⚠️ Process pool unavailable ({e}), rendering PDFs serially")
+            workers = 1
+            results = None
+    if results is None:
+        results = [_render_job(pdf_path, text) for pdf_path, text in jobs]
+
+    failed = [r for r in results if r["status"] == "failed"]
+    print(f"📄 Rendered {len(results) - len(failed)}/{len(results)} PDFs in "
+          f"{time.perf_counter() - started:.2f}s ({workers} workers)")
+    for r in failed:
+        print(f"   ❌ {r['pdf']}: {r['error']}")
+    return results
+
+
+INTERRUPTED_NOTICE = "⚠️ The AI answer was interrupted; this report contains the part received."
+
+
+def generate_seo_pdf_from_stream(pdf_path: str, chunks):
+    """
+    Build the PDF while text chunks arrive: every finished line becomes
+    flowables immediately, so the PDF is written as soon as the stream ends.
+    If the stream breaks, the text received so far is kept (with a notice).
+    Returns (text, complete); nothing is written when no text arrived.
+    """
+    builder = SeoPdfBuilder(pdf_path)
+    received, pending, complete = [], "", True
+    try:
+        for chunk in chunks:
+            received.append(chunk)
+            *lines, pending = (pending + chunk).split("\n")
+            for line in lines:
+                builder.add_line(line)
+    except Exception as e:
+        complete = False
+        print(f"⚠️ Stream interrupted after {sum(map(len, received))} characters: {e}")
+
+    text = "".join(received)
+    if not text.strip():
+        return text, complete
+    builder.add_line(pending)
+    if not complete:
+        builder.add_line("")
+        builder.add_line(INTERRUPTED_NOTICE)
+    builder.build()
+    return text, complete
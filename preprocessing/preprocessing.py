@@ -1,7 +1,31 @@
 # combined_preprocessing_aggregation.py
 import os
 import glob
+import json
+import time
+import hashlib
+import operator
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
+from csv_schemas import read_header, read_report_csv, read_report_chunks
+from sql_engine import use_duckdb
+from multi_table import MultiTableWriter, is_multi_table, read_index, read_block
+from dtype_policy import apply_dtype_policy, take_memory_report, merge_memory_reports, print_memory_report
+
+# Worker processes for the preprocessing runner (files are independent)
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+
+# Bump when a code change alters the preprocessed outputs, so cached
+# results in the manifest are rebuilt
+PREPROCESS_VERSION = 1
+MANIFEST_NAME = ".preprocess_manifest.json"
+
+# Aggregate files at least this large are aggregated chunk by chunk, with
+# memory bounded by the number of distinct pages instead of rows. With
+# ANALYTICS_ENGINE=duckdb every aggregate file is aggregated in SQL instead.
+STREAM_AGGREGATE_BYTES = int(os.getenv("STREAM_AGGREGATE_BYTES", str(256 * 1024 * 1024)))
+AGGREGATE_CHUNK_ROWS = int(os.getenv("AGGREGATE_CHUNK_ROWS", "200000"))
 
 # -------------------------
 # Column mapping (dynamic)
@@ -13,50 +37,145 @@ COLUMN_MAP = {
     "ctr": ["ctr", "click through rate", "clickthroughrate"],
     "position": ["position", "avg position", "avgposition"]
 }
+# Numeric columns the SEO rules compare against
+RULE_NUMERIC_COLUMNS = ["lcp", "inp", "cls", "fcp", "http_status"]
 
 # -------------------------
 # Normalize columns
 # -------------------------
 def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     df.columns = [c.strip().lower() for c in df.columns]
+    renames = {}
     for canonical, variants in COLUMN_MAP.items():
-        for v in variants:
-            if v in df.columns:
-                df.rename(columns={v: canonical}, inplace=True)
-                break
+        found = next((v for v in variants if v in df.columns), None)
+        if found is not None:
+            renames[found] = canonical
+    df.rename(columns=renames, inplace=True)
     for col in ["clicks", "impressions", "ctr", "position"]:
         if col not in df.columns:
             df[col] = 0
-    for col in ["clicks", "impressions", "ctr", "position"]:
-        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
-    return df
+        elif not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+        if df[col].hasnans:
+            df[col] = df[col].fillna(0)
+    # Rule columns: stray tokens ("-", "n/a") become missing instead of failing the rules
+    for col in RULE_NUMERIC_COLUMNS:
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return apply_dtype_policy(df, "normalize_columns")
+
+# -------------------------
+# SEO rules
+# -------------------------
+# Each rule is one error label and the conditions (all must hold) that
+# trigger it. A rule is skipped when a column it needs is missing. Rule i is
+# stored as bit 1 << i of the integer error_flags column; labels are only
+# decoded when writing output. Override with a JSON list in SEO_RULES_FILE.
+SEO_RULES = [
+    {"label": "Indexing issue", "when": [["verdict", "!=", "PASS"]]},
+    {"label": "HTTP error", "when": [["http_status", ">=", 400]]},
+    {"label": "Poor LCP", "when": [["lcp", ">", 4000]]},
+    {"label": "Poor INP", "when": [["inp", ">", 500]]},
+    {"label": "High CLS", "when": [["cls", ">", 0.25]]},
+    {"label": "High impressions but no clicks", "when": [["impressions", ">", 1000], ["clicks", "==", 0]]},
+]
+
+ERROR_SEPARATOR = " | "
+
+RULE_OPERATORS = {
+    "==": operator.eq, "!=": operator.ne,
+    ">": operator.gt, ">=": operator.ge,
+    "<": operator.lt, "<=": operator.le,
+}
+
+
+def load_seo_rules(path: str = None) -> list:
+    path = path or os.getenv("SEO_RULES_FILE")
+    if not path:
+        return SEO_RULES
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compile_seo_rules(rules: list = None) -> list:
+    """[(bit, label, [(column, op_fn, value), ...]), ...]"""
+    rules = rules if rules is not None else load_seo_rules()
+    if len(rules) > 63:
+        raise ValueError("At most 63 SEO rules fit in the error_flags bitmask")
+    return [
+        (1 << i, rule["label"], [(col, RULE_OPERATORS[op], value) for col, op, value in rule["when"]])
+        for i, rule in enumerate(rules)
+    ]
+
+
+COMPILED_SEO_RULES = compile_seo_rules()
+
+
+def evaluate_seo_rules(df: pd.DataFrame, compiled: list = None) -> np.ndarray:
+    """Vectorized: one boolean mask per rule, OR-ed into an int64 bitmask."""
+    compiled = compiled if compiled is not None else COMPILED_SEO_RULES
+    flags = np.zeros(len(df), dtype=np.int64)
+    for bit, _, conditions in compiled:
+        if any(col not in df.columns for col, _, _ in conditions):
+            continue
+        mask = np.ones(len(df), dtype=bool)
+        for col, op_fn, value in conditions:
+            mask &= op_fn(df[col], value).to_numpy(dtype=bool, na_value=False)
+        flags[mask] |= bit
+    return flags
+
+
+def decode_error_flags(flags, compiled: list = None) -> pd.Series:
+    """Bitmask -> "Label A | Label B" strings, decoded once per distinct combination."""
+    compiled = compiled if compiled is not None else COMPILED_SEO_RULES
+    flags = pd.Series(flags)
+    labels = {
+        value: ERROR_SEPARATOR.join(label for bit, label, _ in compiled if value & bit)
+        for value in flags.unique()
+    }
+    return flags.map(labels)
+
+
+def encode_error_labels(errors: pd.Series, compiled: list = None) -> np.ndarray:
+    """ "Label A | Label B" strings (e.g. read back from CSV) -> bitmask."""
+    compiled = compiled if compiled is not None else COMPILED_SEO_RULES
+    errors = errors.fillna("").astype(str)
+    codes = {label: bit for bit, label, _ in compiled}
+    lookup = {}
+    for value in errors.unique():
+        lookup[value] = sum(codes.get(label.strip(), 0) for label in value.split(ERROR_SEPARATOR) if label.strip())
+    return errors.map(lookup).to_numpy(dtype=np.int64)
+
+
+def _error_flags(df: pd.DataFrame) -> np.ndarray:
+    if "error_flags" in df.columns:
+        return df["error_flags"].to_numpy(dtype=np.int64)
+    if "errors" in df.columns:
+        return encode_error_labels(df["errors"])
+    return np.zeros(len(df), dtype=np.int64)
+
+
+def with_error_labels(df: pd.DataFrame) -> pd.DataFrame:
+    """Replace error_flags with the readable errors column (output time)."""
+    if "error_flags" not in df.columns:
+        return df
+    out = df.drop(columns=["error_flags"])
+    out["errors"] = decode_error_flags(df["error_flags"]).to_numpy()
+    return out
 
 # -------------------------
 # Detect SEO errors
 # -------------------------
 def detect_seo_errors(df: pd.DataFrame) -> pd.DataFrame:
-    df["errors"] = ""
-    if "verdict" in df.columns:
-        df.loc[df["verdict"] != "PASS", "errors"] += "Indexing issue | "
-    if "http_status" in df.columns:
-        df.loc[df["http_status"] >= 400, "errors"] += "HTTP error | "
-    if "lcp" in df.columns:
-        df.loc[df["lcp"] > 4000, "errors"] += "Poor LCP | "
-    if "inp" in df.columns:
-        df.loc[df["inp"] > 500, "errors"] += "Poor INP | "
-    if "cls" in df.columns:
-        df.loc[df["cls"] > 0.25, "errors"] += "High CLS | "
-    if "impressions" in df.columns and "clicks" in df.columns:
-        df.loc[(df["impressions"] > 1000) & (df["clicks"] == 0), "errors"] += "High impressions but no clicks | "
-    df["errors"] = df["errors"].str.strip(" |")
+    df["error_flags"] = evaluate_seo_rules(df)
     return df
 
 # -------------------------
 # Sort top problem pages first
 # -------------------------
 def sort_seo_priority(df: pd.DataFrame) -> pd.DataFrame:
-    if "errors" in df.columns:
-        df["has_error"] = df["errors"].notna() & (df["errors"] != "")
+    if "error_flags" in df.columns or "errors" in df.columns:
+        df["has_error"] = _error_flags(df) != 0
         df_sorted = df.sort_values(
             by=["has_error", "impressions", "clicks"],
             ascending=[False, False, False]
@@ -72,7 +191,7 @@ def generate_top_pages_summary(df: pd.DataFrame, limit: int = 10) -> list:
     summaries = []
     if df.empty or "page" not in df.columns:
         return summaries
-    top_df = df.sort_values("clicks", ascending=False).head(limit)
+    top_df = with_error_labels(df.sort_values("clicks", ascending=False).head(limit))
     for _, row in top_df.iterrows():
         summaries.append(
             f"Page {row.get('page','N/A')} has {int(row.get('clicks',0))} clicks, "
@@ -91,7 +210,7 @@ def aggregate_page_metrics(df: pd.DataFrame) -> pd.DataFrame:
     for col in required_cols:
         if col not in df.columns:
             df[col] = 0
-    return df.groupby("page", dropna=True).agg(
+    return df.groupby("page", dropna=True, observed=True).agg(
         total_clicks=("clicks", "sum"),
         total_impressions=("impressions", "sum"),
         avg_ctr=("ctr", "mean"),
@@ -102,81 +221,473 @@ def aggregate_cwv(df: pd.DataFrame) -> pd.DataFrame:
     cwv_cols = [c for c in ["lcp", "inp", "cls"] if c in df.columns]
     if not cwv_cols or "page" not in df.columns:
         return pd.DataFrame()
-    return df.groupby("page")[cwv_cols].mean().reset_index()
+    return df.groupby("page", observed=True)[cwv_cols].mean().reset_index()
 
 def aggregate_errors(df: pd.DataFrame) -> pd.DataFrame:
-    if "errors" not in df.columns or "page" not in df.columns:
+    """(page, errors, count) rows: one bit test per rule instead of split/explode."""
+    if ("error_flags" not in df.columns and "errors" not in df.columns) or "page" not in df.columns:
         return pd.DataFrame()
-    df["errors"] = df["errors"].fillna("").astype(str)
-    df_valid = df[df["errors"].str.strip() != ""]
-    if df_valid.empty:
+    flags = _error_flags(df)
+    pages = df["page"]
+    parts = []
+    for bit, label, _ in COMPILED_SEO_RULES:
+        hit = (flags & bit) != 0
+        if hit.any():
+            counts = pages[hit].value_counts(sort=False)
+            counts = counts[counts > 0]  # categorical pages count unused categories too
+            parts.append(pd.DataFrame({"page": counts.index, "errors": label, "count": counts.to_numpy()}))
+    if not parts:
         return pd.DataFrame()
-    exploded = df_valid.assign(errors=df_valid["errors"].str.split(" | ")).explode("errors")
-    return exploded.groupby(["page", "errors"]).size().reset_index(name="count").sort_values("count", ascending=False)
-
-def build_gemini_summary(page_df, error_df, limit=20) -> str:
-    lines = []
-    top_pages = page_df.sort_values(
-        ["total_impressions", "total_clicks"], ascending=[False, False]
-    ).head(limit)
-    for _, row in top_pages.iterrows():
-        page = row["page"]
-        clicks = int(row["total_clicks"])
-        imps = int(row["total_impressions"])
-        ctr = row["avg_ctr"]
-        pos = row["avg_position"]
-        errors = error_df[error_df["page"]==page]["errors"].tolist() if not error_df.empty else []
-        error_text = ", ".join(errors) if errors else "No critical errors"
-        lines.append(f"Page {page} → {imps} impressions, {clicks} clicks, CTR {ctr:.2f}%, Avg position {pos:.1f}. Issues: {error_text}")
+    result = pd.concat(parts, ignore_index=True).sort_values(["page", "errors"])
+    return result.sort_values("count", ascending=False, kind="stable").reset_index(drop=True)
+
+# -------------------------
+# Streaming aggregation (out-of-core)
+# -------------------------
+# Per chunk only partial sums and counts per page are kept; partials are
+# folded into running totals, so nothing proportional to the row count
+# survives a chunk. Means are sum / count at the end; for a page whose rows
+# span several chunks they can differ from the in-memory mean in the last
+# bit of float rounding, everything else is identical.
+def _fold(running: pd.DataFrame, partial: pd.DataFrame) -> pd.DataFrame:
+    if running is None:
+        return partial
+    return pd.concat([running, partial]).groupby(level=0).sum()
+
+
+def _partial_page_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    grouped = df.groupby("page", dropna=True, observed=True)
+    return pd.DataFrame({
+        "total_clicks": grouped["clicks"].sum(),
+        "total_impressions": grouped["impressions"].sum(),
+        "ctr_sum": grouped["ctr"].sum(),
+        "ctr_count": grouped["ctr"].count(),
+        "position_sum": grouped["position"].sum(),
+        "position_count": grouped["position"].count(),
+    })
+
+
+def _partial_cwv(df: pd.DataFrame, cwv_cols: list) -> pd.DataFrame:
+    grouped = df.groupby("page", observed=True)[cwv_cols]
+    return grouped.sum().join(grouped.count(), rsuffix="_count")
+
+
+def _partial_errors(df: pd.DataFrame) -> pd.DataFrame:
+    flags = _error_flags(df)
+    counts = {
+        bit: df["page"][(flags & bit) != 0].value_counts(sort=False)
+        for bit, _, _ in COMPILED_SEO_RULES
+    }
+    return pd.DataFrame(counts).fillna(0).astype("int64")
+
+
+def aggregate_file_chunked(input_path: str, chunksize: int = None):
+    """
+    Stream one report and return (rows, page_agg, cwv_agg, error_agg), the
+    same frames aggregate_page_metrics / aggregate_cwv / aggregate_errors
+    give on the whole preprocessed file.
+    """
+    chunksize = chunksize or AGGREGATE_CHUNK_ROWS
+    rows, pages, cwv, errors, cwv_cols = 0, None, None, None, []
+    for chunk in read_report_chunks(input_path, chunksize):
+        chunk = detect_seo_errors(normalize_columns(chunk))
+        rows += len(chunk)
+        cwv_cols = [c for c in ["lcp", "inp", "cls"] if c in chunk.columns]
+        pages = _fold(pages, _partial_page_metrics(chunk))
+        if cwv_cols:
+            cwv = _fold(cwv, _partial_cwv(chunk, cwv_cols))
+        errors = _fold(errors, _partial_errors(chunk))
+
+    if pages is None:
+        return 0, pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+    page_agg = pd.DataFrame({
+        "total_clicks": pages["total_clicks"],
+        "total_impressions": pages["total_impressions"],
+        "avg_ctr": pages["ctr_sum"] / pages["ctr_count"],
+        "avg_position": pages["position_sum"] / pages["position_count"],
+    }).rename_axis("page").reset_index()
+
+    cwv_agg = pd.DataFrame()
+    if cwv is not None:
+        cwv_agg = pd.DataFrame({
+            col: cwv[col].where(cwv[f"{col}_count"] > 0) / cwv[f"{col}_count"].where(cwv[f"{col}_count"] > 0)
+            for col in cwv_cols
+        }).rename_axis("page").reset_index()
+
+    parts = [
+        pd.DataFrame({"page": errors.index[errors[bit] > 0], "errors": label,
+                      "count": errors.loc[errors[bit] > 0, bit].to_numpy()})
+        for bit, label, _ in COMPILED_SEO_RULES
+        if bit in errors.columns and (errors[bit] > 0).any()
+    ]
+    error_agg = pd.DataFrame()
+    if parts:
+        error_agg = pd.concat(parts, ignore_index=True).sort_values(["page", "errors"])
+        error_agg = error_agg.sort_values("count", ascending=False, kind="stable").reset_index(drop=True)
+    return rows, page_agg, cwv_agg, error_agg
+
+def parse_rank_by(spec: str) -> list:
+    """"total_impressions,avg_position:asc" -> [("total_impressions", False), ("avg_position", True)]"""
+    signals = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        column, _, direction = part.partition(":")
+        signals.append((column.strip(), direction.strip().lower() == "asc"))
+    return signals
+
+
+# Ranking signals for the pages in the Gemini summary, highest first unless
+# ":asc". Any page_df column, or error_count (issues per page from error_df).
+SUMMARY_RANK_BY = parse_rank_by(os.getenv("GEMINI_SUMMARY_RANK_BY", "total_impressions,total_clicks"))
+
+
+def _rank_keys(page_df, error_df, rank_by) -> pd.DataFrame:
+    keys = pd.DataFrame(index=page_df.index)
+    for i, (column, ascending) in enumerate(rank_by):
+        if column == "error_count":
+            counts = error_df.groupby("page")["count"].sum() if not error_df.empty else pd.Series(dtype="int64")
+            values = page_df["page"].map(counts).fillna(0)
+        else:
+            values = page_df[column]
+        keys[f"k{i}"] = -values if ascending else values
+    return keys
+
+
+def build_gemini_summary(page_df, error_df, limit=20, rank_by=None) -> str:
+    """
+    One line per top page. Pages are picked with nlargest on the ranking
+    signals and errors are looked up for those pages only, grouped once.
+    """
+    if page_df.empty:
+        return ""
+    rank_by = rank_by or SUMMARY_RANK_BY
+    keys = _rank_keys(page_df, error_df, rank_by)
+    top_pages = page_df.loc[keys.nlargest(limit, list(keys.columns)).index]
+
+    if not error_df.empty:
+        top_errors = error_df[error_df["page"].isin(top_pages["page"])]
+        error_lookup = top_errors.groupby("page", sort=False)["errors"].agg(", ".join)
+    else:
+        error_lookup = pd.Series(dtype="object")
+    error_text = top_pages["page"].map(error_lookup).fillna("No critical errors")
+
+    lines = [
+        f"Page {page} → {imps} impressions, {clicks} clicks, CTR {ctr:.2f}%, Avg position {pos:.1f}. Issues: {errors}"
+        for page, imps, clicks, ctr, pos, errors in zip(
+            top_pages["page"],
+            top_pages["total_impressions"].astype("int64"),
+            top_pages["total_clicks"].astype("int64"),
+            top_pages["avg_ctr"],
+            top_pages["avg_position"],
+            error_text,
+        )
+    ]
     return "\n".join(lines)
 
 # -------------------------
 # Process single file (preprocess + aggregate if applicable)
 # -------------------------
-def process_file(input_path: str, output_base: str, aggregate_files: list):
+def process_file(input_path: str, output_base: str, aggregate_files: list,
+                 input_base: str = r"D:\Final\output", stream: bool = None) -> dict:
+    """
+    Preprocess one report CSV. Returns a result record
+    {file, status: ok|skipped|failed, rows, outputs, seconds, error};
+    failures are reported in it, not raised.
+
+    Aggregate files are aggregated without loading them whole (chunks, or
+    DuckDB with ANALYTICS_ENGINE=duckdb) when stream=True, by default when
+    the engine is DuckDB or they are at least STREAM_AGGREGATE_BYTES large.
+    """
+    result = {"file": input_path, "status": "ok", "rows": 0, "outputs": [], "seconds": 0.0, "error": None}
+    started = time.perf_counter()
     try:
-        df = pd.read_csv(input_path, engine="python", on_bad_lines="skip")
+        if is_multi_table(input_path):
+            return _process_multi_table(input_path, output_base, input_base, result)
+
+        rel_path = os.path.relpath(input_path, start=input_base)
+        output_path = os.path.join(output_base, rel_path)
+        is_aggregate = os.path.basename(input_path) in aggregate_files
+        if stream is None:
+            stream = is_aggregate and (use_duckdb() or os.path.getsize(input_path) >= STREAM_AGGREGATE_BYTES)
+        if is_aggregate and stream and _stream_aggregate(input_path, output_path, result):
+            return result
+
+        df = read_report_csv(input_path)
         if df.empty:
             print(f"⚠️ Skipped empty file: {input_path}")
-            return
+            result["status"] = "skipped"
+            return result
 
         df = normalize_columns(df)
         df = detect_seo_errors(df)
         df = sort_seo_priority(df)
+        result["rows"] = len(df)
 
-        # Save preprocessed
-        rel_path = os.path.relpath(input_path, start=r"D:\Final\output")
-        output_path = os.path.join(output_base, rel_path)
+        # Save preprocessed (error bitmask decoded to labels only here)
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        df.to_csv(output_path, index=False)
+        with_error_labels(df).to_csv(output_path, index=False)
+        result["outputs"].append(output_path)
         print(f"✅ Preprocessed: {output_path}")
 
         # Aggregate only if in the special 3 files
-        if os.path.basename(input_path) in aggregate_files and "page" in df.columns:
-            page_agg = aggregate_page_metrics(df)
-            cwv_agg = aggregate_cwv(df)
-            error_agg = aggregate_errors(df)
-            if not cwv_agg.empty:
-                page_agg = page_agg.merge(cwv_agg, on="page", how="left")
+        if is_aggregate and "page" in df.columns:
+            _write_aggregates(output_path, aggregate_page_metrics(df), aggregate_cwv(df),
+                              aggregate_errors(df), result)
 
-            # Overwrite in same folder
-            page_agg.to_csv(output_path, index=False)
-            if not error_agg.empty:
-                error_agg.to_csv(os.path.join(os.path.dirname(output_path), "error_aggregation.csv"), index=False)
+    except Exception as e:
+        print(f"⚠️ Failed: {input_path} → {e}")
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        result["memory"] = take_memory_report()
+    return result
 
-            summary_file = os.path.join(os.path.dirname(output_path), "gemini_aggregation_summary.txt")
-            with open(summary_file, "w", encoding="utf-8") as f:
-                f.write(build_gemini_summary(page_agg, error_agg))
 
-            print(f"✅ Aggregated: {output_path}")
+def _write_aggregates(output_path: str, page_agg: pd.DataFrame, cwv_agg: pd.DataFrame,
+                      error_agg: pd.DataFrame, result: dict):
+    if not cwv_agg.empty:
+        page_agg = page_agg.merge(cwv_agg, on="page", how="left")
 
-    except Exception as e:
-        print(f"⚠️ Failed: {input_path} → {e}")
+    # Overwrite in same folder
+    page_agg.to_csv(output_path, index=False)
+    if not error_agg.empty:
+        error_path = os.path.join(os.path.dirname(output_path), "error_aggregation.csv")
+        error_agg.to_csv(error_path, index=False)
+        result["outputs"].append(error_path)
+
+    summary_file = os.path.join(os.path.dirname(output_path), "gemini_aggregation_summary.txt")
+    with open(summary_file, "w", encoding="utf-8") as f:
+        f.write(build_gemini_summary(page_agg, error_agg))
+    result["outputs"].append(summary_file)
+
+    print(f"✅ Aggregated: {output_path}")
+
+
+def _stream_aggregate(input_path: str, output_path: str, result: dict) -> bool:
+    """
+    Aggregate-only path for large files (the row-level output is replaced by
+    the aggregate anyway). False means: use the in-memory path instead.
+    """
+    header = read_header(input_path)
+    if not header or "page" not in normalize_columns(pd.DataFrame(columns=header)).columns:
+        return False
+    try:
+        if use_duckdb():
+            from sql_engine import aggregate_report
+            rows, page_agg, cwv_agg, error_agg = aggregate_report(input_path, load_seo_rules(), COLUMN_MAP)
+        else:
+            rows, page_agg, cwv_agg, error_agg = aggregate_file_chunked(input_path)
+    except Exception as e:  # malformed rows / values outside the schema
+        print(f"⚠️ Streaming aggregation not possible for {input_path} ({e}), reading it whole")
+        return False
+    if not rows:
+        return False
+
+    result["rows"] = rows
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    result["outputs"].append(output_path)
+    print(f"✅ Preprocessed (streamed, {rows} rows): {output_path}")
+    _write_aggregates(output_path, page_agg, cwv_agg, error_agg, result)
+    return True
+
+
+def _process_multi_table(input_path: str, output_base: str, input_base: str, result: dict) -> dict:
+    """Overview containers: preprocess every table, keep the container layout."""
+    tables = []
+    for entry in read_index(input_path):
+        df = read_block(input_path, entry)
+        if not df.empty:
+            df = sort_seo_priority(detect_seo_errors(normalize_columns(df)))
+            result["rows"] += len(df)
+        tables.append((entry, df))
+
+    if not result["rows"]:
+        print(f"⚠️ Skipped empty file: {input_path}")
+        result["status"] = "skipped"
+        return result
+
+    output_path = os.path.join(output_base, os.path.relpath(input_path, start=input_base))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with MultiTableWriter(output_path) as writer:
+        for entry, df in tables:
+            if entry["status"] == "error":
+                writer.write_error(entry["title"])
+            else:
+                writer.write_table(entry["title"], with_error_labels(df))
+    result["outputs"].append(output_path)
+    print(f"✅ Preprocessed {len(tables)} tables: {output_path}")
+    return result
+
+# -------------------------
+# Incremental manifest
+# -------------------------
+# output_base/.preprocess_manifest.json maps each input (relative path) to
+# its content hash, the config fingerprint and the outputs it produced. A
+# file whose hash and fingerprint match and whose outputs still exist is
+# not processed again; its aggregates are only rebuilt when it changes.
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def config_fingerprint(aggregate: bool) -> str:
+    """Everything besides the input that shapes a file's outputs."""
+    config = {
+        "version": PREPROCESS_VERSION,
+        "rules": load_seo_rules(),
+        "column_map": COLUMN_MAP,
+        "aggregate": aggregate,
+        "rank_by": SUMMARY_RANK_BY if aggregate else None,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_preprocess_manifest(output_base: str) -> dict:
+    try:
+        with open(os.path.join(output_base, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_preprocess_manifest(output_base: str, manifest: dict):
+    os.makedirs(output_base, exist_ok=True)
+    path = os.path.join(output_base, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _unchanged_result(input_path: str, entry: dict) -> dict:
+    return {"file": input_path, "status": "unchanged", "rows": entry["rows"],
+            "outputs": entry["outputs"], "seconds": 0.0, "error": None}
+
+
+def plan_incremental(files: list, manifest: dict, aggregate_files: list, input_base: str):
+    """Split files into (to_process, unchanged results, {file: (key, sha, fingerprint)})."""
+    fingerprints = {agg: config_fingerprint(agg) for agg in (False, True)}
+    to_process, unchanged, identity = [], [], {}
+    for f in files:
+        key = os.path.relpath(f, start=input_base)
+        sha = _file_sha256(f)
+        fingerprint = fingerprints[os.path.basename(f) in aggregate_files]
+        identity[f] = (key, sha, fingerprint)
+        entry = manifest.get(key)
+        if (entry and entry["sha256"] == sha and entry["config"] == fingerprint
+                and all(os.path.exists(o) for o in entry["outputs"])):
+            unchanged.append(_unchanged_result(f, entry))
+        else:
+            to_process.append(f)
+    return to_process, unchanged, identity
+
+
+def update_preprocess_manifest(manifest: dict, results: list, identity: dict) -> dict:
+    for r in results:
+        if r["file"] not in identity or r["status"] == "unchanged":
+            continue
+        key, sha, fingerprint = identity[r["file"]]
+        if r["status"] == "failed":
+            manifest.pop(key, None)
+        else:
+            manifest[key] = {"sha256": sha, "config": fingerprint, "outputs": r["outputs"],
+                             "rows": r["rows"], "processed_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    return manifest
+
+# -------------------------
+# Parallel runner
+# -------------------------
+def collect_input_files(input_dirs: list, single_files: list) -> list:
+    files = []
+    for folder in input_dirs:
+        files.extend(sorted(glob.glob(os.path.join(folder, "**", "*.csv"), recursive=True)))
+    files.extend(f for f in single_files if os.path.exists(f))
+    return files
+
+
+def _summarize(results: list, seconds: float, workers: int) -> dict:
+    by_status = {status: [r for r in results if r["status"] == status]
+                 for status in ("ok", "unchanged", "skipped", "failed")}
+    return {
+        "files": len(results),
+        "succeeded": len(by_status["ok"]),
+        "unchanged": len(by_status["unchanged"]),
+        "skipped": len(by_status["skipped"]),
+        "failed": len(by_status["failed"]),
+        "rows": sum(r["rows"] for r in results),
+        "workers": workers,
+        "seconds": round(seconds, 3),
+        "failures": [{"file": r["file"], "error": r["error"]} for r in by_status["failed"]],
+        "memory": merge_memory_reports(r.get("memory") for r in results),
+        "results": results,
+    }
+
+
+def run_preprocessing_files(files: list, output_base: str, aggregate_files: list,
+                            input_base: str = r"D:\Final\output", workers: int = None,
+                            incremental: bool = True) -> dict:
+    """
+    Run process_file over independent files on a process pool and return a
+    summary with per-file results and failures. workers=1 runs in-process.
+    With incremental=True, files unchanged since the last run (same content
+    hash and config) are reported as "unchanged" instead of reprocessed.
+    """
+    started = time.perf_counter()
+    all_files, results = files, []
+    if incremental:
+        manifest = load_preprocess_manifest(output_base)
+        files, results, identity = plan_incremental(files, manifest, aggregate_files, input_base)
+    workers = max(1, min(workers or PREPROCESS_WORKERS, len(files) or 1))
+
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(process_file, f, output_base, aggregate_files, input_base): f
+                    for f in files
+                }
+                for future in as_completed(futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:  # worker died (e.g. out of memory)
+                        results.append({
+                            "file": futures[future], "status": "failed", "rows": 0, "outputs": [],
+                            "seconds": 0.0, "error": f"{type(e).__name__}: {e}"
+                        })
+        except (AssertionError, OSError) as e:
+            # No child processes available here (e.g. a daemonic pool worker)
+            print(f"⚠️ Process pool unavailable ({e}), preprocessing serially")
+            done = {r["file"] for r in results}
+            results.extend(process_file(f, output_base, aggregate_files, input_base) for f in files if f not in done)
+            workers = 1
+    else:
+        results.extend(process_file(f, output_base, aggregate_files, input_base) for f in files)
+
+    if incremental:
+        save_preprocess_manifest(output_base, update_preprocess_manifest(manifest, results, identity))
+
+    order = {f: i for i, f in enumerate(all_files)}
+    results.sort(key=lambda r: order[r["file"]])
+    summary = _summarize(results, time.perf_counter() - started, workers)
+
+    print(
+        f"📊 Preprocessing: {summary['succeeded']} ok, {summary['unchanged']} unchanged, "
+        f"{summary['skipped']} skipped, {summary['failed']} failed in {summary['seconds']}s ({workers} workers)"
+    )
+    for failure in summary["failures"]:
+        print(f"   ❌ {failure['file']}: {failure['error']}")
+    print_memory_report(summary["memory"])
+    return summary
 
 # -------------------------
 # Main run
 # -------------------------
-def main():
+def main(workers: int = None, incremental: bool = True) -> dict:
+    input_base = r"D:\Final\output"
     output_base = r"D:\Final\preprocessed_outputs"
     input_dirs = [
         r"D:\Final\output\Acquisition Reports",
@@ -195,15 +706,9 @@ def main():
     # Files to aggregate
     aggregate_files = ["Landing page.csv", "pages.csv", "final_pages_indexing_performance_cwv.csv"]
 
-    # Process folders
-    for folder in input_dirs:
-        csv_files = glob.glob(os.path.join(folder, "**", "*.csv"), recursive=True)
-        for f in csv_files:
-            process_file(f, output_base, aggregate_files)
-
-    # Process single files
-    for f in single_files:
-        process_file(f, output_base, aggregate_files)
+    files = collect_input_files(input_dirs, single_files)
+    return run_preprocessing_files(files, output_base, aggregate_files, input_base,
+                                   workers=workers, incremental=incremental)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,167 @@
+# prompt_budget.py
+"""
+Token-budgeted compaction of the report CSVs for the Gemini prompt.
+
+Every file becomes one block:
+
+    --- FILE: final_pages_indexing_performance_cwv.csv (10000 rows, top 50 shown) ---
+    <compact CSV of the top rows by impact>
+    ... 9950 more rows: total_clicks sum=812 max=9; avg_ctr mean=0.012 median=0 max=1; ...
+
+Rows are ranked by impact (rows with errors first, then |z|, error count,
+impressions, sessions, clicks; the first two present). The rows beyond the
+top PROMPT_TOP_ROWS are summarized per column. When the blocks together
+exceed PROMPT_TOKEN_BUDGET, the largest block gives up half of its rows
+until they fit (down to summary-only blocks).
+
+Tokens are estimated as characters / PROMPT_CHARS_PER_TOKEN; no tokenizer
+call is made.
+"""
+import os
+import math
+
+import pandas as pd
+
+from csv_schemas import read_report_csv
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "60000"))
+PROMPT_TOP_ROWS = int(os.getenv("PROMPT_TOP_ROWS", "50"))
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "4"))
+FLOAT_DECIMALS = 3
+
+# Ranking signals, in order of preference; "z" is ranked by absolute value
+IMPACT_COLUMNS = ["z", "count", "total_impressions", "impressions", "sessions",
+                  "active_users", "total_clicks", "clicks"]
+# Columns where the tail sum means something (the rest get mean / median)
+ADDITIVE_HINTS = ("clicks", "impressions", "count", "sessions", "users", "revenue", "views", "conversions")
+MAX_CATEGORY_VALUES = 20
+TOP_CATEGORY_VALUES = 5
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN)
+
+
+# -------------------------
+# RANKING + ENCODING
+# -------------------------
+def rank_by_impact(df: pd.DataFrame) -> pd.DataFrame:
+    """Rows with errors first, then by the first two impact columns present, highest first."""
+    keys = pd.DataFrame(index=df.index)
+    if "errors" in df.columns:
+        keys["has_error"] = df["errors"].fillna("").astype(str).str.strip() != ""
+    for column in [c for c in IMPACT_COLUMNS if c in df.columns][:2]:
+        values = pd.to_numeric(df[column], errors="coerce")
+        keys[column] = values.abs() if column == "z" else values
+    if keys.empty:
+        return df
+    order = keys.sort_values(list(keys.columns), ascending=False, kind="stable", na_position="last").index
+    return df.loc[order]
+
+
+def compact_csv(df: pd.DataFrame) -> str:
+    """Comma-separated, no index, floats rounded, all-empty columns dropped."""
+    df = df.dropna(axis=1, how="all")
+    floats = df.select_dtypes("float").columns
+    if len(floats):
+        df = df.assign(**{c: df[c].round(FLOAT_DECIMALS) for c in floats})
+    return df.to_csv(index=False, lineterminator="\n").rstrip("\n")
+
+
+def _number(value) -> str:
+    value = round(float(value), FLOAT_DECIMALS)
+    return str(int(value)) if value.is_integer() else str(value)
+
+
+def summarize_tail(df: pd.DataFrame) -> str:
+    """One line of per-column statistics for the rows left out."""
+    parts = []
+    for column in df.columns:
+        series = df[column].dropna()
+        if series.empty:
+            continue
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            if any(hint in column.lower() for hint in ADDITIVE_HINTS):
+                parts.append(f"{column} sum={_number(series.sum())} max={_number(series.max())}")
+            else:
+                parts.append(f"{column} mean={_number(series.mean())} median={_number(series.median())} "
+                             f"max={_number(series.max())}")
+            continue
+        values = series.astype(str)
+        if column == "errors":
+            values = values.str.split(" | ", regex=False).explode().str.strip()
+            values = values[values != ""]
+        distinct = values.nunique()
+        if distinct <= MAX_CATEGORY_VALUES or column == "errors":
+            top = values.value_counts().head(TOP_CATEGORY_VALUES)
+            parts.append(f"{column}: " + ", ".join(f"{v} {n}" for v, n in top.items()))
+        else:
+            parts.append(f"{column}: {distinct} distinct")
+    return f"... {len(df)} more rows: " + "; ".join(parts)
+
+
+def render_block(name: str, ranked: pd.DataFrame, top_rows: int) -> str:
+    top_rows = min(top_rows, len(ranked))
+    lines = [f"--- FILE: {name} ({len(ranked)} rows, top {top_rows} shown) ---"]
+    if top_rows:
+        lines.append(compact_csv(ranked.head(top_rows)))
+    if top_rows < len(ranked):
+        lines.append(summarize_tail(ranked.iloc[top_rows:]))
+    return "\n".join(lines)
+
+
+# -------------------------
+# BUDGET
+# -------------------------
+def compact_frames(frames, token_budget: int = None, top_rows: int = None, label: str = "Prompt dataset"):
+    """
+    frames: [(name, DataFrame), ...]. Returns (text, report); report has one
+    entry per non-empty frame: {file, rows, rows_shown, tokens}.
+    """
+    token_budget = token_budget if token_budget is not None else PROMPT_TOKEN_BUDGET
+    top_rows = top_rows if top_rows is not None else PROMPT_TOP_ROWS
+
+    files = []
+    for name, df in frames:
+        if df.empty:
+            continue
+        ranked = rank_by_impact(df)
+        shown = min(top_rows, len(ranked))
+        block = render_block(name, ranked, shown)
+        files.append({"file": name, "ranked": ranked, "rows_shown": shown,
+                      "block": block, "tokens": estimate_tokens(block)})
+
+    # Halve the rows of the largest block until the dataset fits
+    while sum(f["tokens"] for f in files) > token_budget:
+        candidates = [f for f in files if f["rows_shown"] > 0]
+        if not candidates:
+            print(f"⚠️ {label}: summaries alone exceed the {token_budget} token budget")
+            break
+        largest = max(candidates, key=lambda f: f["tokens"])
+        largest["rows_shown"] //= 2
+        largest["block"] = render_block(largest["file"], largest["ranked"], largest["rows_shown"])
+        largest["tokens"] = estimate_tokens(largest["block"])
+
+    report = [{"file": f["file"], "rows": len(f["ranked"]), "rows_shown": f["rows_shown"],
+               "tokens": f["tokens"]} for f in files]
+    for entry in report:
+        print(f"🧮 {entry['file']}: {entry['rows_shown']}/{entry['rows']} rows, ~{entry['tokens']} tokens")
+    total = sum(entry["tokens"] for entry in report)
+    print(f"🧮 {label}: ~{total} tokens (budget {token_budget})")
+    return "\n\n".join(f["block"] for f in files), report
+
+
+def read_frames(csv_files) -> list:
+    """[(file name, DataFrame), ...] for the readable CSVs."""
+    frames = []
+    for path in csv_files:
+        try:
+            frames.append((os.path.basename(path), read_report_csv(path)))
+        except Exception as e:
+            print(f"⚠️ Not in the prompt: {os.path.basename(path)} ({e})")
+    return frames
+
+
+def compact_dataset(csv_files, token_budget: int = None, top_rows: int = None):
+    """compact_frames over report CSV files."""
+    return compact_frames(read_frames(csv_files), token_budget, top_rows)
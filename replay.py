@@ -0,0 +1,293 @@
+# replay.py
+"""
+Record/replay layer for the external APIs (GA4, GSC, PSI, Gemini, Brevo).
+
+API_MODE=live    call the real services (default)
+API_MODE=record  call the real services and save every response as a fixture
+API_MODE=replay  never touch the network: answer from the fixtures
+
+Fixtures live in fixtures/<service>/<operation>/<key>.json. The key is a hash
+of the request fields that identify the answer (dates, API keys and other
+volatile parts are left out by the call sites). In replay mode a request
+without an exact fixture raises FixtureNotFound; API_REPLAY_FALLBACK=latest
+answers it from the latest fixture of the same operation instead (with a
+warning), for smoke runs that do not check the data.
+
+API_REPLAY_LATENCY injects latency per replayed call: a number of seconds,
+"recorded" (the duration measured when recording), or per service, e.g.
+"ga4=0.3,psi=recorded,gemini=20,default=0".
+"""
+import os
+import glob
+import json
+import time
+import hashlib
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+
+API_MODE = os.getenv("API_MODE", "live").lower()
+FIXTURE_DIR = os.path.join(os.getcwd(), os.getenv("API_FIXTURE_DIR", "fixtures"))
+REPLAY_FALLBACK = os.getenv("API_REPLAY_FALLBACK", "").lower()  # "" | latest
+
+# Query parameters that carry secrets and never end up in a fixture
+SECRET_PARAMS = ("key", "api_key", "access_token")
+
+
+class FixtureNotFound(LookupError):
+    """Replay mode got a request that was never recorded."""
+
+
+def _parse_latency(spec: str) -> dict:
+    latency = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        service, _, value = part.rpartition("=")
+        latency[service or "default"] = value
+    return latency
+
+
+REPLAY_LATENCY = _parse_latency(os.getenv("API_REPLAY_LATENCY", "0"))
+
+
+def is_replay() -> bool:
+    return API_MODE == "replay"
+
+
+# -------------------------
+# FIXTURE STORAGE
+# -------------------------
+def fixture_key(key) -> str:
+    payload = json.dumps(key, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:20]
+
+
+def _fixture_path(service: str, operation: str, key) -> str:
+    return os.path.join(FIXTURE_DIR, service, operation, f"{fixture_key(key)}.json")
+
+
+def _load_fixture(service: str, operation: str, key) -> dict:
+    path = _fixture_path(service, operation, key)
+    if not os.path.exists(path):
+        candidates = glob.glob(os.path.join(FIXTURE_DIR, service, operation, "*.json"))
+        if REPLAY_FALLBACK != "latest" or not candidates:
+            raise FixtureNotFound(f"No fixture for {service}/{operation} {key} ({fixture_key(key)})")
+        path = max(candidates, key=os.path.getmtime)
+        print(f"⚠️ No fixture for {service}/{operation} {key} ({fixture_key(key)}), "
+              f"replaying {os.path.basename(path)} instead (API_REPLAY_FALLBACK=latest)")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_fixture(service: str, operation: str, key, response, duration: float):
+    path = _fixture_path(service, operation, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fixture = {
+        "service": service,
+        "operation": operation,
+        "key": key,
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "duration_seconds": round(duration, 3),
+        "response": response,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(fixture, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def _latency_seconds(service: str, fixture: dict) -> float:
+    value = REPLAY_LATENCY.get(service, REPLAY_LATENCY.get("default", "0"))
+    return fixture.get("duration_seconds", 0) if value == "recorded" else float(value)
+
+
+def _inject_latency(service: str, fixture: dict):
+    seconds = _latency_seconds(service, fixture)
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def recorded(service: str, operation: str, key, fn, encode=None, decode=None):
+    """
+    Run fn() through the record/replay layer.
+
+    key:    JSON-serializable request identity
+    encode: response -> JSON-serializable (record mode)
+    decode: JSON -> response object (replay mode)
+    """
+    if API_MODE == "replay":
+        fixture = _load_fixture(service, operation, key)
+        _inject_latency(service, fixture)
+        return decode(fixture["response"]) if decode else fixture["response"]
+
+    if API_MODE != "record":
+        return fn()
+
+    started = time.perf_counter()
+    response = fn()
+    duration = time.perf_counter() - started
+    _save_fixture(service, operation, key, encode(response) if encode else response, duration)
+    return response
+
+
+# -------------------------
+# HTTP (PSI, sitemap, robots.txt, Gemini, Brevo)
+# -------------------------
+class ReplayResponse:
+    """The subset of requests.Response the pipeline uses."""
+
+    def __init__(self, status_code: int, text: str, headers: dict = None, url: str = None):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.headers = headers or {}
+        self.url = url
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} Error (replayed) for url: {self.url}", response=self)
+
+
+def _strip_secrets(url: str) -> str:
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k not in SECRET_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _encode_http(response) -> dict:
+    return {
+        "status_code": response.status_code,
+        "headers": {"Content-Type": response.headers.get("Content-Type", "")},
+        "text": response.text,
+        "url": _strip_secrets(response.url or ""),
+    }
+
+
+def _decode_http(payload: dict) -> ReplayResponse:
+    return ReplayResponse(payload["status_code"], payload["text"], payload["headers"], payload["url"])
+
+
+def _default_key(method: str, url: str, kwargs: dict) -> dict:
+    params = {k: v for k, v in (kwargs.get("params") or {}).items() if k not in SECRET_PARAMS}
+    return {"method": method, "url": _strip_secrets(url), "params": params, "json": kwargs.get("json")}
+
+
+def http_request(service: str, operation: str, method: str, url: str, key=None, **kwargs):
+    """
+    requests.request() through the record/replay layer.
+
+    The default key is the method, the URL and params without secrets, and
+    the JSON body. Pass key= when the body is volatile (prompts, emails).
+    session= sends the request on a pooled requests.Session.
+    """
+    session = kwargs.pop("session", None) or requests
+    key = key if key is not None else _default_key(method, url, kwargs)
+    return recorded(
+        service, operation, key,
+        lambda: session.request(method, url, **kwargs),
+        encode=_encode_http,
+        decode=_decode_http,
+    )
+
+
+def http_stream(service: str, operation: str, method: str, url: str, key=None, **kwargs):
+    """
+    Streaming http_request(): yields the response body line by line as it
+    arrives (e.g. server-sent events). Record mode saves the lines once the
+    stream has completed; replay yields the recorded lines with the
+    injected latency spread over them.
+    """
+    session = kwargs.pop("session", None) or requests
+    key = key if key is not None else _default_key(method, url, kwargs)
+    if API_MODE == "replay":
+        fixture = _load_fixture(service, operation, key)
+        lines = fixture["response"]["lines"]
+        delay = _latency_seconds(service, fixture) / max(len(lines), 1)
+        for line in lines:
+            if delay > 0:
+                time.sleep(delay)
+            yield line
+        return
+
+    started = time.perf_counter()
+    lines = []
+    with session.request(method, url, stream=True, **kwargs) as response:
+        response.raise_for_status()
+        response.encoding = response.encoding or "utf-8"
+        # chunk_size=None: hand over data as soon as it arrives, not per 512 bytes
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if API_MODE == "record":
+                lines.append(line)
+            yield line
+    if API_MODE == "record":
+        _save_fixture(service, operation, key, {"status_code": response.status_code, "lines": lines},
+                      time.perf_counter() - started)
+
+
+# -------------------------
+# GOOGLE API DISCOVERY CLIENTS (GSC)
+# -------------------------
+class _RecordedGoogleRequest:
+    """
+    Stand-in for a googleapiclient resource chain, e.g.
+    service.urlInspection().index().inspect(body=...).execute()
+
+    Calls are collected until execute(), which replays the chain on the real
+    service (live/record) or answers from a fixture (replay).
+    """
+
+    def __init__(self, service: str, factory, keys: dict, chain=()):
+        self._service = service
+        self._factory = factory
+        self._keys = keys
+        self._chain = chain
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(**kwargs):
+            return _RecordedGoogleRequest(
+                self._service, self._factory, self._keys, self._chain + ((name, kwargs),)
+            )
+        return call
+
+    def _execute_live(self):
+        target = self._factory()
+        for name, kwargs in self._chain:
+            target = getattr(target, name)(**kwargs)
+        return target.execute()
+
+    def execute(self):
+        operation = ".".join(name for name, _ in self._chain)
+        kwargs = self._chain[-1][1] if self._chain else {}
+        key_fn = self._keys.get(operation)
+        key = key_fn(kwargs) if key_fn else kwargs
+        return recorded(self._service, operation, key, self._execute_live)
+
+
+def google_service(service: str, factory, keys: dict = None):
+    """
+    factory() builds the real googleapiclient service. In live mode it is
+    returned as is; otherwise a recording stand-in that only calls the
+    factory (and so needs credentials) when not replaying.
+    keys: operation ("searchanalytics.query") -> kwargs -> fixture key
+    """
+    if API_MODE == "live":
+        return factory()
+
+    cache = {}
+
+    def lazy_factory():
+        if "service" not in cache:
+            cache["service"] = factory()
+        return cache["service"]
+
+    return _RecordedGoogleRequest(service, lazy_factory, keys or {})
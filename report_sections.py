@@ -0,0 +1,221 @@
+# report_sections.py
+"""
+Map-reduce generation of the weekly report (REPORT_MODE=map_reduce).
+
+Map: one prompt per detail section, with only the data slice that section
+needs (e.g. CWV columns and CWV errors for "Core Web Vitals Issues"), run
+concurrently on REPORT_SECTION_WORKERS threads. A failed section gets a
+short placeholder; the other sections are unaffected.
+
+Reduce: one short call writes Executive Summary, Fix Priority Roadmap and
+Final SEO Verdict from the section texts.
+
+Every call goes through the LLM cache, so unchanged sections are not
+regenerated.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from llm_cache import cached_completion
+from prompt_budget import compact_frames, read_frames
+
+REPORT_SECTION_WORKERS = int(os.getenv("REPORT_SECTION_WORKERS", "4"))
+SECTION_TOKEN_BUDGET = int(os.getenv("REPORT_SECTION_TOKEN_BUDGET", "15000"))
+SECTION_TOP_ROWS = int(os.getenv("REPORT_SECTION_TOP_ROWS", "40"))
+
+CWV_ERRORS = ["Poor LCP", "Poor INP", "High CLS"]
+PAGE_METRICS = ["page", "total_clicks", "total_impressions", "avg_ctr", "avg_position"]
+SEARCH_METRICS = ["clicks", "impressions", "ctr", "position"]
+# URL Inspection verdicts other than PASS (url_indexing_status.csv comes from
+# the raw output dir: it has no "errors" column)
+PROBLEM_VERDICTS = ["FAIL", "NEUTRAL", "PARTIAL", "VERDICT_UNSPECIFIED"]
+INDEXING_COLUMNS = ["page", "coverage_state", "indexing_state", "verdict", "last_crawl"]
+
+# Data slices: (file, columns or None for all, (column, values) row filter or None).
+# A filter on "errors" keeps rows with any of the labels.
+SECTIONS = [
+    {"title": "Indexing Issues", "focus": "pages that are not indexed or return HTTP errors, by coverage state",
+     "data": [("url_indexing_status.csv", INDEXING_COLUMNS, ("verdict", PROBLEM_VERDICTS)),
+              ("error_aggregation.csv", None, ("errors", ["Indexing issue", "HTTP error"]))]},
+    {"title": "Core Web Vitals Issues", "focus": "pages with poor LCP, INP or CLS, worst and most visited first",
+     "data": [("final_pages_indexing_performance_cwv.csv", ["page", "total_impressions", "lcp", "inp", "cls"], None),
+              ("error_aggregation.csv", None, ("errors", CWV_ERRORS)),
+              ("week_over_week_anomalies.csv", None, ("metric", ["lcp", "inp", "cls"]))]},
+    {"title": "CTR Issues", "focus": "pages with many impressions but low CTR or falling clicks",
+     "data": [("final_pages_indexing_performance_cwv.csv", PAGE_METRICS, None),
+              ("error_aggregation.csv", None, ("errors", ["High impressions but no clicks"])),
+              ("week_over_week_anomalies.csv", None, ("metric", SEARCH_METRICS))]},
+    {"title": "Content Issues", "focus": "pages losing visibility or ranking poorly that need content work",
+     "data": [("final_pages_indexing_performance_cwv.csv", PAGE_METRICS, None),
+              ("week_over_week_anomalies.csv", None, None)]},
+    {"title": "Technical SEO Issues", "focus": "HTTP errors, indexing states and other technical problems",
+     "data": [("error_aggregation.csv", None, None),
+              ("url_indexing_status.csv", INDEXING_COLUMNS, ("verdict", PROBLEM_VERDICTS))]},
+    {"title": "Slow & Underperforming Pages (CRITICAL)",
+     "focus": "pages that are both slow (CWV) and underperforming in search, with what changed this week",
+     "data": [("final_pages_indexing_performance_cwv.csv", None, None),
+              ("week_over_week_anomalies.csv", None, ("direction", ["worse"]))]},
+]
+
+SUMMARY_TITLES = ["Executive Summary", "Fix Priority Roadmap", "Final SEO Verdict"]
+# Order of the sections in the finished report
+REPORT_ORDER = ["Executive Summary", "Indexing Issues", "Core Web Vitals Issues", "CTR Issues",
+                "Content Issues", "Technical SEO Issues", "Fix Priority Roadmap", "Final SEO Verdict",
+                "Slow & Underperforming Pages (CRITICAL)"]
+
+SECTION_PROMPT_TEMPLATE = """
+You are a senior SEO consultant writing ONE section of a CLIENT-READY WEEKLY SEO REPORT.
+
+SECTION: {title}
+FOCUS: {focus}
+
+RULES:
+- Bullet points only, do not repeat the section title
+- Short & clear
+- Include page/path wherever possible
+- Never say "no data" or ask for more input
+- Each FILE block lists its highest-impact rows; the "... more rows" line summarizes the remaining rows
+
+For EACH issue:
+- Page / Path (example or group)
+- Issue type
+- Observed metric
+- Impact
+- Fix
+- AI Recommendation
+- Priority (P1=Immediate, P2=High, P3=Medium)
+- Owner (SEO Team, Dev Team, Content Team)
+
+DATA:
+{data}
+"""
+
+SUMMARY_PROMPT_TEMPLATE = """
+You are a senior SEO consultant. Below are the finished detail sections of this week's SEO report.
+
+Write exactly these three sections, each starting with its title alone on a line ending with a colon:
+Executive Summary:
+Fix Priority Roadmap:
+Final SEO Verdict:
+
+RULES:
+- Bullet points only, short & clear
+- Executive Summary: the most important findings across all sections
+- Fix Priority Roadmap: the fixes in order, each with Priority (P1/P2/P3) and Owner
+- Final SEO Verdict: two or three bullets on the overall state of the site
+- Only use facts from the sections below
+
+SECTIONS:
+{sections}
+"""
+
+
+# -------------------------
+# DATA SLICES
+# -------------------------
+def _keep_rows(df: pd.DataFrame, column: str, values: list) -> pd.DataFrame:
+    if column not in df.columns:
+        return df.iloc[0:0]
+    if column == "errors":
+        labels = df["errors"].fillna("").astype(str).str.split("|", regex=False)
+        wanted = set(values)
+        return df[labels.map(lambda parts: any(p.strip() in wanted for p in parts))]
+    return df[df[column].isin(values)]
+
+
+def check_section_inputs(frames: dict) -> list:
+    """Problems with the configured slices: input files missing, filter columns missing."""
+    problems = {}
+    for section in SECTIONS:
+        for name, _, row_filter in section["data"]:
+            if name not in frames:
+                problem = f"{name} is not in the inputs"
+            elif row_filter is not None and row_filter[0] not in frames[name].columns:
+                problem = f"{name} has no '{row_filter[0]}' column"
+            else:
+                continue
+            problems.setdefault(problem, []).append(section["title"])
+    return [f"{problem} ({', '.join(titles)})" for problem, titles in problems.items()]
+
+
+def section_frames(section: dict, frames: dict) -> list:
+    """[(name, DataFrame), ...] slice of the report files for one section."""
+    sliced = []
+    for name, columns, row_filter in section["data"]:
+        df = frames.get(name)
+        if df is None or df.empty:
+            continue
+        if row_filter is not None:
+            df = _keep_rows(df, *row_filter)
+        if columns is not None:
+            df = df[[c for c in columns if c in df.columns]]
+        sliced.append((name, df))
+    return sliced
+
+
+def split_sections(text: str, titles=SUMMARY_TITLES) -> dict:
+    """Answer text -> {title: body} for the titles found in it as headings."""
+    parts, current = {}, None
+    for line in text.split("\n"):
+        heading = line.strip().strip("#*").strip().rstrip(":").strip()
+        heading = heading.lstrip("0123456789.🚨 ").strip()
+        if heading in titles:
+            current = heading
+            parts[current] = []
+        elif current is not None:
+            parts[current].append(line)
+    return {title: "\n".join(lines).strip() for title, lines in parts.items()}
+
+
+# -------------------------
+# MAP + REDUCE
+# -------------------------
+def generate_sectioned_report(generate, csv_files, model: str, template_version,
+                              force_regenerate: bool = False, workers: int = None) -> str:
+    """
+    generate(prompt) -> text (raising on failure). Returns the report text
+    with one "Title:" heading per section, in REPORT_ORDER. Raises
+    ValueError when no section could be generated.
+    """
+    workers = workers or REPORT_SECTION_WORKERS
+    mode = "refresh" if force_regenerate else None
+    frames = {name: df.rename(columns={"url": "page"}) for name, df in read_frames(csv_files)}
+    for problem in check_section_inputs(frames):
+        print(f"⚠️ Section data: {problem}")
+
+    def run_section(section):
+        data, _ = compact_frames(section_frames(section, frames), SECTION_TOKEN_BUDGET,
+                                 SECTION_TOP_ROWS, label=section["title"])
+        prompt = SECTION_PROMPT_TEMPLATE.format(title=section["title"], focus=section["focus"], data=data)
+        return cached_completion(generate, model, SECTION_PROMPT_TEMPLATE, template_version,
+                                 f"{section['title']}\n{data}", prompt, mode=mode)
+
+    texts, failed = {}, []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {section["title"]: pool.submit(run_section, section) for section in SECTIONS}
+        for title, future in futures.items():
+            try:
+                texts[title] = future.result().strip()
+            except Exception as e:
+                print(f"⚠️ Section '{title}' failed: {e}")
+                failed.append(title)
+    if not texts:
+        raise ValueError("No report section could be generated")
+    for title in failed:
+        texts[title] = "- This section could not be generated this week; review the data manually"
+
+    sections = "\n\n".join(f"{title}:\n{texts[title]}" for title in REPORT_ORDER if title in texts)
+    prompt = SUMMARY_PROMPT_TEMPLATE.format(sections=sections)
+    try:
+        summary = cached_completion(generate, model, SUMMARY_PROMPT_TEMPLATE, template_version,
+                                    sections, prompt, mode=mode)
+        texts.update(split_sections(summary))
+    except Exception as e:
+        print(f"⚠️ Summary sections failed: {e}")
+    for title in SUMMARY_TITLES:
+        texts.setdefault(title, "- See the detail sections of this report")
+
+    print(f"🧩 Report sections: {len(SECTIONS) - len(failed)}/{len(SECTIONS)} generated")
+    return "\n\n".join(f"{title}:\n{texts[title]}" for title in REPORT_ORDER)
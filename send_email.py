@@ -2,8 +2,9 @@
 import os
 import glob
 import base64
-import requests
 from dotenv import load_dotenv
+from metrics import track_call
+from replay import http_request
 
 # -------------------------
 # Load environment variables
@@ -68,7 +69,15 @@ def send_email(subject: str, body: str, attachment_dir: str = None):
     # SEND EMAIL VIA BREVO
     # -------------------------
     try:
-        response = requests.post(url, headers=headers, json=data)
+        with track_call("brevo", "send_email") as call:
+            # Keyed on the recipient only: subject and attachments change every run
+            response = http_request(
+                "brevo", "send_email", "POST", url,
+                key={"to": BREVO_RECEIVER},
+                headers=headers, json=data
+            )
+            if response.status_code not in (200, 201):
+                call["error"] = f"http_{response.status_code}"
 
         if response.status_code in (200, 201):
             print("✅ Email sent successfully via Brevo!")
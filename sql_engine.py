@@ -0,0 +1,271 @@
+# sql_engine.py
+"""
+Embedded DuckDB engine for the cross-report aggregates and joins.
+
+ANALYTICS_ENGINE=duckdb switches preprocessing aggregation and the
+indexing x performance merge from pandas to SQL. DuckDB runs in-process
+(no server), scans CSV/Parquet directly, uses DUCKDB_THREADS threads and
+spills to DUCKDB_TEMP_DIR when DUCKDB_MEMORY_LIMIT is reached.
+
+    con = connect()
+    register_output_views(con, "output")     # every report CSV + indexing history
+    con.sql("SELECT * FROM gsc_reports_performance_reports_top_pages LIMIT 5")
+"""
+import os
+import re
+import glob
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # pandas engine only
+    duckdb = None
+
+from csv_schemas import read_header, registered_dtypes
+from multi_table import is_multi_table
+
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "pandas").lower()
+DUCKDB_THREADS = os.getenv("DUCKDB_THREADS")
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT")
+DUCKDB_TEMP_DIR = os.path.join(os.getcwd(), os.getenv("DUCKDB_TEMP_DIR", "duckdb_tmp"))
+
+DUCKDB_TYPES = {"object": "VARCHAR", "int64": "BIGINT", "float64": "DOUBLE"}
+NUMERIC_COLUMNS = ["clicks", "impressions", "ctr", "position"]
+CWV_COLUMNS = ["lcp", "inp", "cls"]
+# preprocessing.RULE_NUMERIC_COLUMNS: stray tokens become NULL, as in pandas
+COERCED_COLUMNS = CWV_COLUMNS + ["fcp", "http_status"]
+
+
+def use_duckdb() -> bool:
+    if ANALYTICS_ENGINE != "duckdb":
+        return False
+    if duckdb is None:
+        print("⚠️ ANALYTICS_ENGINE=duckdb but duckdb is not installed, using pandas")
+        return False
+    return True
+
+
+def connect(database: str = ":memory:"):
+    con = duckdb.connect(database)
+    os.makedirs(DUCKDB_TEMP_DIR, exist_ok=True)
+    con.execute(f"SET temp_directory = {_literal(DUCKDB_TEMP_DIR)}")
+    if DUCKDB_THREADS:
+        con.execute(f"SET threads = {int(DUCKDB_THREADS)}")
+    if DUCKDB_MEMORY_LIMIT:
+        con.execute(f"SET memory_limit = {_literal(DUCKDB_MEMORY_LIMIT)}")
+    return con
+
+
+# -------------------------
+# SQL HELPERS
+# -------------------------
+def _ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _literal(value) -> str:
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    return repr(value)
+
+
+def read_csv_sql(path: str) -> str:
+    """read_csv() call with the registered dtypes of the report, if any."""
+    header = read_header(path)
+    dtypes = registered_dtypes(path, header) or {}
+    types = ", ".join(f"{_literal(col)}: '{DUCKDB_TYPES[dtype]}'" for col, dtype in dtypes.items())
+    options = f", types = {{{types}}}" if types else ""
+    return f"read_csv({_literal(path)}, header = true, auto_detect = true{options})"
+
+
+def view_name(rel_path: str) -> str:
+    """"GSC Reports/Performance Reports/Top pages.csv" -> gsc_reports_performance_reports_top_pages"""
+    stem = os.path.splitext(rel_path)[0].lower()
+    return re.sub(r"[^a-z0-9]+", "_", stem).strip("_")
+
+
+def register_output_views(con, output_dir: str, history_dir: str = None) -> list:
+    """
+    One view per single-table report CSV under output_dir, plus the Parquet
+    indexing history (indexing_inspections, indexing_changes,
+    indexing_current_state). Multi-table overview files are skipped.
+    """
+    from indexing_history import HISTORY_DIR
+    history_dir = history_dir or HISTORY_DIR
+    views = []
+    for path in sorted(glob.glob(os.path.join(output_dir, "**", "*.csv"), recursive=True)):
+        if os.path.getsize(path) == 0 or is_multi_table(path):
+            continue
+        name = view_name(os.path.relpath(path, output_dir))
+        con.execute(f"CREATE OR REPLACE VIEW {_ident(name)} AS SELECT * FROM {read_csv_sql(path)}")
+        views.append(name)
+
+    for table in ("inspections", "changes"):
+        pattern = os.path.join(history_dir, table, "date=*", "part.parquet")
+        if glob.glob(pattern):
+            name = f"indexing_{table}"
+            con.execute(
+                f"CREATE OR REPLACE VIEW {name} AS "
+                f"SELECT * FROM read_parquet({_literal(pattern)}, hive_partitioning = true)"
+            )
+            views.append(name)
+    state_path = os.path.join(history_dir, "current_state.parquet")
+    if os.path.exists(state_path):
+        con.execute(f"CREATE OR REPLACE VIEW indexing_current_state AS SELECT * FROM read_parquet({_literal(state_path)})")
+        views.append("indexing_current_state")
+    return views
+
+
+# -------------------------
+# PREPROCESSING AGGREGATES
+# -------------------------
+def _metric_types(con, source: str, columns: dict) -> dict:
+    """
+    The dtype pandas ends up with for each metric column: int64 only when
+    every value is an integer, float64 once one is missing or not numeric.
+    columns: canonical name -> (source name, DuckDB type).
+    """
+    checks = {}
+    for col, (name, col_type) in columns.items():
+        if col_type == "VARCHAR":
+            checks[col] = f"bool_and(COALESCE(regexp_full_match(trim({_ident(name)}), '[+-]?[0-9]+'), false))"
+        elif "INT" in col_type:
+            checks[col] = f"bool_and({_ident(name)} IS NOT NULL)"
+    types = {col: "DOUBLE" for col in columns}
+    if checks:
+        sql = ", ".join(f"{check} AS {_ident(col)}" for col, check in checks.items())
+        integral = con.execute(f"SELECT {sql} FROM {source}").fetchone()
+        types.update({col: "BIGINT" for col, ok in zip(checks, integral) if ok})
+    return types
+
+
+def _normalized_select(con, source: str, column_map: dict) -> str:
+    """
+    SQL for preprocessing.normalize_columns: lower-cased names, COLUMN_MAP
+    renames, numeric metrics coerced with missing values as 0 (DOUBLE if any
+    were missing, like pandas' fillna on a float64 column).
+    """
+    columns = con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()
+    types = {name.strip().lower(): (name, col_type) for name, col_type, *_ in columns}
+    renames = {}
+    for canonical, variants in column_map.items():
+        found = next((v for v in variants if v in types), None)
+        if found is not None:
+            renames[found] = canonical
+
+    select, seen = [], set()
+    for lower, (name, col_type) in types.items():
+        canonical = renames.get(lower, lower)
+        if canonical in NUMERIC_COLUMNS or canonical in seen:
+            continue
+        if canonical in COERCED_COLUMNS and col_type == "VARCHAR":
+            select.append(f"TRY_CAST({_ident(name)} AS DOUBLE) AS {_ident(canonical)}")
+        else:
+            select.append(f"{_ident(name)} AS {_ident(canonical)}")
+        seen.add(canonical)
+
+    inverse = {canonical: lower for lower, canonical in renames.items()}
+    metrics = {}
+    for col in NUMERIC_COLUMNS:
+        lower = inverse.get(col, col)
+        if lower in types:
+            metrics[col] = types[lower]
+        else:
+            select.append(f"0 AS {col}")
+    for col, metric_type in _metric_types(con, source, metrics).items():
+        select.append(f"COALESCE(TRY_CAST({_ident(metrics[col][0])} AS {metric_type}), 0) AS {col}")
+    return f"SELECT {', '.join(select)} FROM {source}"
+
+
+def _rule_condition(conditions: list) -> str:
+    sql = []
+    for col, op, value in conditions:
+        # pandas "!=" is True against missing values, every other comparison False
+        operator = "IS DISTINCT FROM" if op == "!=" else op.replace("==", "=")
+        sql.append(f"({_ident(col)} {operator} {_literal(value)})")
+    return " AND ".join(sql)
+
+
+def _sum_type(col_type: str) -> str:
+    """SUM(BIGINT) is HUGEINT in DuckDB; keep pandas' int64 / float64."""
+    return "BIGINT" if "INT" in col_type else "DOUBLE"
+
+
+def aggregate_report(path: str, rules: list, column_map: dict):
+    """
+    SQL version of the preprocessing aggregates for one report file:
+    (rows, page_agg, cwv_agg, error_agg) like preprocessing.aggregate_file_chunked.
+    rules: the SEO rule definitions ({"label", "when"}), evaluated in SQL.
+    """
+    con = connect()
+    try:
+        con.execute(f"CREATE TEMP VIEW raw_report AS SELECT * FROM {read_csv_sql(path)}")
+        con.execute(f"CREATE TEMP VIEW report AS {_normalized_select(con, 'raw_report', column_map)}")
+        columns = {name: col_type for name, col_type, *_ in con.execute("DESCRIBE report").fetchall()}
+        rows = con.execute("SELECT COUNT(*) FROM report").fetchone()[0]
+        if not rows or "page" not in columns:
+            return rows, pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+        page_agg = con.execute(f"""
+            SELECT page,
+                   CAST(SUM(clicks) AS {_sum_type(columns['clicks'])}) AS total_clicks,
+                   CAST(SUM(impressions) AS {_sum_type(columns['impressions'])}) AS total_impressions,
+                   AVG(ctr) AS avg_ctr,
+                   AVG(position) AS avg_position
+            FROM report WHERE page IS NOT NULL
+            GROUP BY page ORDER BY page
+        """).df()
+
+        cwv_cols = [c for c in CWV_COLUMNS if c in columns]
+        cwv_agg = pd.DataFrame()
+        if cwv_cols:
+            averages = ", ".join(f"AVG({c}) AS {c}" for c in cwv_cols)
+            cwv_agg = con.execute(
+                f"SELECT page, {averages} FROM report WHERE page IS NOT NULL GROUP BY page ORDER BY page"
+            ).df()
+
+        per_rule = [
+            f"SELECT page, {_literal(rule['label'])} AS errors, COUNT(*) AS count "
+            f"FROM report WHERE page IS NOT NULL AND {_rule_condition(rule['when'])} GROUP BY page"
+            for rule in rules
+            if all(col in columns for col, _, _ in rule["when"])
+        ]
+        error_agg = pd.DataFrame()
+        if per_rule:
+            error_agg = con.execute(
+                " UNION ALL ".join(per_rule) + " ORDER BY count DESC, page, errors"
+            ).df()
+            error_agg = error_agg.astype({"count": "int64"}) if not error_agg.empty else pd.DataFrame()
+        return rows, page_agg, cwv_agg, error_agg
+    finally:
+        con.close()
+
+
+# -------------------------
+# INDEXING x PERFORMANCE
+# -------------------------
+def merge_indexing_with_performance_sql(indexing_csv: str, perf_csv: str, out: str, normalize_url) -> str:
+    """
+    Left join of the indexing status onto GSC top pages by normalized URL,
+    in indexing row order, written straight to CSV by DuckDB.
+    """
+    con = connect()
+    try:
+        con.create_function("normalize_url", normalize_url, ["VARCHAR"], "VARCHAR")
+        con.execute(f"CREATE TEMP TABLE indexing AS SELECT * FROM {read_csv_sql(indexing_csv)}")
+        con.execute(f"CREATE TEMP TABLE gsc AS SELECT * FROM {read_csv_sql(perf_csv)}")
+        con.execute(f"""
+            COPY (
+                SELECT i.*, g.* EXCLUDE (gsc_row, "Top pages", url_norm)
+                FROM indexing i
+                LEFT JOIN (SELECT rowid AS gsc_row, *, normalize_url("Top pages") AS url_norm FROM gsc) g
+                  ON normalize_url(i.url) = g.url_norm
+                ORDER BY i.rowid, g.gsc_row
+            ) TO {_literal(out)} (HEADER, DELIMITER ',')
+        """)
+        return out
+    finally:
+        con.close()
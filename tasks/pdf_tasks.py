@@ -1,11 +1,14 @@
 # tasks/pdf_tasks.py
 import os
 import sys
-import requests
-import pandas as pd
+import shutil
 from celery_pdf_app import celery_pdf_app
 from send_email import send_email
-from pdf_utils import generate_seo_pdf
+from pdf_utils import generate_seo_pdf, generate_seo_pdf_from_stream
+from artifact_store import snapshot, checkpoint, start_run, finish_run, find_resumable_run
+from metrics import observe_files_written
+from gemini_client import GeminiClient, GeminiError
+from datetime import date, datetime, timedelta
 
 # Add parent directory to path to import preprocessing
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -15,30 +18,19 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # If preprocessing.py is in root, this should work
 try:
     # Try importing from preprocessing.py file in root
-    from preprocessing import (
-        normalize_columns,
-        detect_seo_errors,
-        sort_seo_priority,
-        aggregate_page_metrics,
-        aggregate_cwv,
-        aggregate_errors,
-        build_gemini_summary,
-        process_file,
-        main as run_preprocessing
-    )
+    from preprocessing import main as run_preprocessing
 except ImportError:
     # If that fails, try importing from preprocessing folder
-    from preprocessing.preprocessing import (
-        normalize_columns,
-        detect_seo_errors,
-        sort_seo_priority,
-        aggregate_page_metrics,
-        aggregate_cwv,
-        aggregate_errors,
-        build_gemini_summary,
-        process_file,
-        main as run_preprocessing
-    )
+    from preprocessing.preprocessing import main as run_preprocessing
+
+from DB.db_utils import start_report_run, finish_report_run, track_stage, count_csv_rows
+from weekly_rollups import update_weekly_rollups
+from prompt_budget import compact_dataset
+from llm_cache import cached_completion
+from report_sections import generate_sectioned_report
+from findings import (
+    compute_findings, findings_prompt, render_findings_report, report_inputs, FINDINGS_PROMPT_TEMPLATE
+)
 
 # -------------------------
 # PATHS
@@ -46,6 +38,10 @@ except ImportError:
 BASE_DIR = r"D:\Final"
 PREPROCESSED_DIR = os.path.join(BASE_DIR, "preprocessed_outputs")
 OUTPUT_DIR = PREPROCESSED_DIR
+RAW_OUTPUT_DIR = os.path.join(BASE_DIR, "output")
+ROLLUP_DIR = os.path.join(BASE_DIR, "weekly_rollups")
+ANOMALIES_CSV = os.path.join(PREPROCESSED_DIR, "week_over_week_anomalies.csv")
+INDEXING_STATUS_CSV = os.path.join(RAW_OUTPUT_DIR, "url_indexing_status.csv")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # -------------------------
@@ -53,72 +49,26 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 # -------------------------
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = "gemini-2.5-flash"
-TIMEOUT = 180
-
-# -------------------------
-# GEMINI CALL
-# -------------------------
-def call_gemini(prompt: str) -> str:
-    headers = {"Content-Type": "application/json"}
-    payload = {"contents": [{"parts": [{"text": prompt}]}]}
-
-    try:
-        r = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}",
-            headers=headers,
-            json=payload,
-            timeout=TIMEOUT
-        )
-        r.raise_for_status()
-        data = r.json()
-        parts = data.get("candidates", [{}])[0].get("content", {}).get("parts", [])
-        return parts[0].get("text", "") if parts else ""
-    except Exception:
-        return ""
+TIMEOUT = 180  # total deadline per answer, retries included
 
-# -------------------------
-# READ FULL DATA
-# -------------------------
-def build_safe_dataset(csv_files):
-    blocks = []
-
-    for f in csv_files:
-        try:
-            df = pd.read_csv(f)
-            if df.empty:
-                continue
-            blocks.append(
-                f"\n--- FILE: {os.path.basename(f)} ---\n" + df.to_string(index=False)
-            )
-        except Exception:
-            continue
+# Pooled session, retries on 429/5xx, circuit breaker (gemini_client.py)
+GEMINI = GeminiClient(GEMINI_MODEL, GEMINI_API_KEY)
 
-    return "\n".join(blocks)
+# single: one prompt for the whole report; map_reduce: one prompt per section
+# (report_sections.py) plus a short summary call; findings: Gemini only writes
+# commentary around the precomputed findings (findings.py); local: no Gemini
+REPORT_MODE = os.getenv("REPORT_MODE", "single").lower()
+# Stream the single-prompt answer (streamGenerateContent) straight into the PDF
+GEMINI_STREAM = os.getenv("GEMINI_STREAM", "").lower() in ("1", "true", "yes")
+SECTION_TIMEOUT = int(os.getenv("REPORT_SECTION_TIMEOUT", "90"))
 
 # -------------------------
-# CELERY TASK - NOW INCLUDES PREPROCESSING
+# REPORT PROMPT
 # -------------------------
-@celery_pdf_app.task(name="tasks.generate_pdf_report")
-def generate_pdf_report():
-    try:
-        # STEP 1: Run preprocessing first
-        print("🔄 Running preprocessing...")
-        run_preprocessing()  # This runs the entire preprocessing pipeline
-        print("✅ Preprocessing completed")
-        
-        # STEP 2: Now work with preprocessed files
-        csv_files = sorted([
-            os.path.join(PREPROCESSED_DIR, f)
-            for f in os.listdir(PREPROCESSED_DIR)
-            if f.endswith(".csv")
-        ])
-
-        if not csv_files:
-            raise ValueError("No CSV files found")
-
-        full_data = build_safe_dataset(csv_files)
-
-        prompt = f"""
+# Bump the version when the prompt changes meaning; cached answers are keyed
+# on it (and on the template text).
+PROMPT_TEMPLATE_VERSION = 1
+REPORT_PROMPT_TEMPLATE = """
 You are a senior SEO consultant.
 
 DATA BELOW IS AGGREGATED GA4 + GSC DATA.
@@ -134,6 +84,8 @@ RULES:
 - Provide a priority level (P1=Immediate, P2=High, P3=Medium)
 - Suggest an owner (e.g., SEO Team, Dev Team, Content Team)
 - Never say "no data" or ask for more input
+- Use week_over_week_anomalies.csv (z = deviation from the page's recent weeks) to say what changed since last week
+- Each FILE block lists its highest-impact rows; the "... more rows" line summarizes the remaining rows
 
 STRUCTURE:
 1. Executive Summary
@@ -160,44 +112,146 @@ DATA:
 {full_data}
 """
 
-        print("🤖 Calling Gemini AI...")
-        seo_report = call_gemini(prompt)
+# -------------------------
+# GEMINI CALL
+# -------------------------
+def call_gemini(prompt: str, timeout: int = TIMEOUT) -> str:
+    """Answer text, or "" when Gemini failed (the classified error is logged)."""
+    try:
+        return GEMINI.generate(prompt, deadline=timeout)
+    except GeminiError as e:
+        print(f"⚠️ Gemini failed ({type(e).__name__}): {e}")
+        return ""
 
-        if not seo_report.strip():
-            seo_report = """
-Executive Summary
-- SEO data available but AI insight generation partially limited
+# -------------------------
+# READ FULL DATA
+# -------------------------
+def build_safe_dataset(csv_files, token_budget=None):
+    """Top rows per file by impact plus a long-tail summary, within PROMPT_TOKEN_BUDGET."""
+    dataset, _ = compact_dataset(csv_files, token_budget=token_budget)
+    return dataset
 
-Technical SEO Issues
-- Site-wide performance and indexing signals require manual validation
-"""
+class StreamInterrupted(Exception):
+    """The Gemini stream broke off; text is what arrived (already in the PDF)."""
 
-        print("📄 Generating PDF...")
-        pdf_path = os.path.join(OUTPUT_DIR, "Weekly_SEO_Report.pdf")
-        if os.path.exists(pdf_path):
-            os.remove(pdf_path)
-
-        generate_seo_pdf(pdf_path, seo_report)
-
-        print("📧 Sending email...")
-        
-        # Get current date for email body
-        from datetime import datetime
-        import shutil
-        current_date = datetime.now().strftime("%B %d, %Y")  # e.g., "January 27, 2026"
-        
-        # Create separate folder for email attachments (PDF only)
-        EMAIL_DIR = os.path.join(BASE_DIR, "email_attachments")
-        os.makedirs(EMAIL_DIR, exist_ok=True)
-        
-        # Clear previous files and copy only the PDF
-        for old_file in os.listdir(EMAIL_DIR):
-            os.remove(os.path.join(EMAIL_DIR, old_file))
-        
-        shutil.copy(pdf_path, EMAIL_DIR)
-        print(f"📎 PDF copied to email directory: {EMAIL_DIR}")
-        
-        email_body = f"""
+    def __init__(self, text: str):
+        super().__init__(f"Gemini stream interrupted after {len(text)} characters")
+        self.text = text
+
+
+def stream_gemini(prompt: str, timeout: int = TIMEOUT):
+    """streamGenerateContent over server-sent events: yields text chunks as they arrive."""
+    return GEMINI.stream(prompt, deadline=timeout)
+
+
+def call_gemini_checked(prompt: str, timeout: int = TIMEOUT) -> str:
+    """Like call_gemini but raises the GeminiError (empty answers too), so it is not checkpointed."""
+    return GEMINI.generate(prompt, deadline=timeout)
+
+
+def generate_report_text(full_data: str, prompt: str, force_regenerate: bool = False,
+                         generate=call_gemini_checked) -> str:
+    """Gemini answer for the prompt, from the LLM cache when model, template and data are unchanged."""
+    return cached_completion(
+        generate, GEMINI_MODEL, REPORT_PROMPT_TEMPLATE, PROMPT_TEMPLATE_VERSION,
+        full_data, prompt, mode="refresh" if force_regenerate else None,
+    )
+
+
+def stream_report_text(full_data: str, prompt: str, pdf_path: str, streamed: dict,
+                       force_regenerate: bool = False) -> str:
+    """
+    generate_report_text with the answer streamed into the PDF as it arrives
+    (cache hits are returned as text, the PDF is then built as usual).
+    streamed["pdf"] is set when the PDF was written from the stream. A broken
+    stream raises StreamInterrupted with the partial text, which is neither
+    cached nor checkpointed.
+    """
+    def generate(prompt):
+        text, complete = generate_seo_pdf_from_stream(pdf_path, stream_gemini(prompt))
+        if text.strip():
+            streamed["pdf"] = pdf_path
+        if not complete:
+            raise StreamInterrupted(text)
+        if not text.strip():
+            raise ValueError("Empty Gemini response")
+        return text
+
+    return generate_report_text(full_data, prompt, force_regenerate, generate=generate)
+
+
+def generate_findings_commentary(findings_data: str, prompt: str, force_regenerate: bool = False) -> str:
+    """Findings mode: Gemini's commentary on the findings table, cached like the full report."""
+    return cached_completion(
+        call_gemini_checked, GEMINI_MODEL, FINDINGS_PROMPT_TEMPLATE, PROMPT_TEMPLATE_VERSION,
+        findings_data, prompt, mode="refresh" if force_regenerate else None,
+    )
+
+
+def generate_sectioned_report_text(csv_files, force_regenerate: bool = False) -> str:
+    """Map-reduce mode: one Gemini call per section, then the summary sections."""
+    return generate_sectioned_report(
+        lambda prompt: call_gemini_checked(prompt, SECTION_TIMEOUT), report_inputs(csv_files, INDEXING_STATUS_CSV),
+        GEMINI_MODEL, PROMPT_TEMPLATE_VERSION, force_regenerate=force_regenerate,
+    )
+
+
+def list_preprocessed_csvs():
+    return sorted([
+        os.path.join(PREPROCESSED_DIR, f)
+        for f in os.listdir(PREPROCESSED_DIR)
+        if f.endswith(".csv")
+    ])
+
+
+def preprocess_outputs():
+    """Run the preprocessing pipeline and return the preprocessed CSV paths."""
+    print("🔄 Running preprocessing...")
+    summary = run_preprocessing()  # This runs the entire preprocessing pipeline
+    if summary["files"] and summary["failed"] == summary["files"]:
+        raise RuntimeError(f"Preprocessing failed for all {summary['files']} files")
+    print("✅ Preprocessing completed")
+
+    # Week-over-week: only this week's files are rolled up, earlier weeks come from ROLLUP_DIR
+    try:
+        update_weekly_rollups(
+            os.path.join(RAW_OUTPUT_DIR, "final_pages_indexing_performance_cwv.csv"),
+            os.path.join(RAW_OUTPUT_DIR, "GSC Reports", "Performance Reports", "Queries by page.csv"),
+            week=date.today() - timedelta(days=1),
+            anomalies_csv=ANOMALIES_CSV,
+            rollup_dir=ROLLUP_DIR,
+        )
+    except Exception as e:
+        print(f"⚠️ Weekly rollup failed, report without week-over-week changes: {e}")
+        if os.path.exists(ANOMALIES_CSV):
+            os.remove(ANOMALIES_CSV)  # never report last week's anomalies as this week's
+    return list_preprocessed_csvs()
+
+
+# -------------------------
+# EMAIL TASK (I/O queue)
+# -------------------------
+@celery_pdf_app.task(name="tasks.send_pdf_report_email")
+def send_pdf_report_email(report_id, pdf_path, csv_files=None, run_id=None):
+    try:
+        with track_stage(report_id, "send_email") as stage:
+            print("📧 Sending email...")
+
+            # Get current date for email body
+            current_date = datetime.now().strftime("%B %d, %Y")  # e.g., "January 27, 2026"
+
+            # Create separate folder for email attachments (PDF only)
+            EMAIL_DIR = os.path.join(BASE_DIR, "email_attachments")
+            os.makedirs(EMAIL_DIR, exist_ok=True)
+
+            # Clear previous files and copy only the PDF
+            for old_file in os.listdir(EMAIL_DIR):
+                os.remove(os.path.join(EMAIL_DIR, old_file))
+
+            shutil.copy(pdf_path, EMAIL_DIR)
+            print(f"📎 PDF copied to email directory: {EMAIL_DIR}")
+
+            email_body = f"""
         <html>
         <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
             <h2 style="color: #2c3e50;">Hello Team,</h2>
@@ -218,16 +272,151 @@ Technical SEO Issues
         </body>
         </html>
         """
-        
-        send_email(
-            subject=f"Weekly SEO Report - {current_date}",
-            body=email_body,
-            attachment_dir=EMAIL_DIR  # Only PDF here!
+
+            sent = send_email(
+                subject=f"Weekly SEO Report - {current_date}",
+                body=email_body,
+                attachment_dir=EMAIL_DIR  # Only PDF here!
+            )
+            if not sent:
+                stage["status"] = "failed"
+
+        finish_report_run(
+            report_id,
+            "sent" if sent else "generated",
+            pdf_path=pdf_path,
+            csv_paths=csv_files
+        )
+        if run_id:
+            finish_run(run_id, "complete" if sent else "partial")
+        return {"status": "success", "pdf": pdf_path, "email_sent": sent, "report_id": report_id}
+
+    except Exception as e:
+        print(f"❌ Error sending PDF report: {str(e)}")
+        finish_report_run(report_id, "failed", pdf_path=pdf_path)
+        if run_id:
+            finish_run(run_id, "failed")
+        return {"status": "failed", "error": str(e), "report_id": report_id}
+
+
+# -------------------------
+# CELERY TASK - NOW INCLUDES PREPROCESSING
+# -------------------------
+@celery_pdf_app.task(bind=True, name="tasks.generate_pdf_report")
+def generate_pdf_report(self, run_id=None, force_regenerate=False):
+    """
+    Preprocess, ask Gemini, build the PDF and hand it to the email task.
+
+    Preprocessing, the Gemini answer and the PDF are checkpointed: rerunning
+    after a failure (or with an explicit run_id) resumes an unfinished run
+    for the same week from the first stage that did not complete.
+
+    The Gemini answer is also reused across runs when the dataset and prompt
+    did not change (llm_cache); force_regenerate=True asks Gemini again.
+    Without an answer the report is rendered from the precomputed findings.
+    """
+    report_id = None
+    try:
+        today = date.today()
+        params = {"week_end": today.isoformat()}
+        run_id = run_id or find_resumable_run("seo_pdf", params)
+        if run_id:
+            print(f"♻️ Resuming run {run_id}")
+        run_id = start_run("seo_pdf", params, run_id=run_id)
+        report_id = start_report_run(
+            "weekly", today - timedelta(days=7), today, run_id=run_id, task_id=self.request.id
         )
 
+        # STEP 1: Run preprocessing first
+        with track_stage(report_id, "preprocessing") as stage:
+            csv_files = checkpoint(
+                run_id, "preprocessing", preprocess_outputs, outputs=lambda paths: paths
+            )
+
+            # STEP 2: Now work with preprocessed files
+
+            if not csv_files:
+                raise ValueError("No CSV files found")
+            stage["rows"] = count_csv_rows(csv_files)
+            stage["artifacts"] = csv_files
+
+        # Issues, metrics, priorities and owners computed locally; also the
+        # report when Gemini is unavailable
+        with track_stage(report_id, "findings") as stage:
+            findings = compute_findings(report_inputs(csv_files, INDEXING_STATUS_CSV))
+            stage["rows"] = len(findings)
+
+        if REPORT_MODE == "findings":
+            full_data, prompt = findings_prompt(findings)
+        elif REPORT_MODE not in ("map_reduce", "local"):
+            with track_stage(report_id, "build_dataset"):
+                full_data = build_safe_dataset(csv_files)
+                prompt = REPORT_PROMPT_TEMPLATE.format(full_data=full_data)
+
+        pdf_path = os.path.join(OUTPUT_DIR, "Weekly_SEO_Report.pdf")
+        streamed = {}
+        with track_stage(report_id, "gemini"):
+            if REPORT_MODE != "local":
+                print("🤖 Calling Gemini AI...")
+            try:
+                if REPORT_MODE == "local":
+                    seo_report = ""
+                elif REPORT_MODE == "findings":
+                    seo_report = checkpoint(run_id, "gemini", generate_findings_commentary, full_data, prompt,
+                                            force_regenerate)
+                elif REPORT_MODE == "map_reduce":
+                    # Section data slices are built inside, per section
+                    seo_report = checkpoint(run_id, "gemini", generate_sectioned_report_text, csv_files,
+                                            force_regenerate)
+                elif GEMINI_STREAM:
+                    seo_report = checkpoint(run_id, "gemini", stream_report_text, full_data, prompt,
+                                            pdf_path, streamed, force_regenerate)
+                else:
+                    seo_report = checkpoint(run_id, "gemini", generate_report_text, full_data, prompt,
+                                            force_regenerate)
+            except StreamInterrupted as e:
+                print(f"⚠️ {e}; keeping the partial report")
+                seo_report = e.text
+            except (ValueError, GeminiError) as e:
+                print(f"⚠️ No Gemini report ({type(e).__name__}): {e}")
+                seo_report = ""
+
+        if REPORT_MODE == "findings" and seo_report.strip():
+            seo_report = render_findings_report(findings, commentary=seo_report)
+        if not seo_report.strip():
+            print("📋 Report rendered from the precomputed findings")
+            seo_report = render_findings_report(findings)
+
+        with track_stage(report_id, "pdf_build") as stage:
+            print("📄 Generating PDF...")
+
+            def build_pdf():
+                if streamed.get("pdf") == pdf_path and os.path.exists(pdf_path):
+                    print("📄 PDF already assembled from the Gemini stream")
+                else:
+                    if os.path.exists(pdf_path):
+                        os.remove(pdf_path)
+                    generate_seo_pdf(pdf_path, seo_report)
+                observe_files_written("pdf", [pdf_path])
+                return pdf_path
+
+            checkpoint(run_id, "pdf_build", build_pdf, outputs=[pdf_path])
+            stage["artifacts"] = [pdf_path]
+
+        # Version the preprocessed inputs together with the PDF built from them
+        with track_stage(report_id, "snapshot") as stage:
+            manifest = snapshot(PREPROCESSED_DIR, kind="seo_pdf", run_id=run_id)
+            stage["rows"] = len(manifest["files"])
+
+        # Email delivery is I/O-bound: it runs on the I/O queue and closes the run
+        send_pdf_report_email.delay(report_id, pdf_path, csv_files, run_id)
+
         print("✅ PDF Report generation completed successfully!")
-        return {"status": "success", "pdf": pdf_path}
+        return {"status": "success", "pdf": pdf_path, "run_id": run_id, "report_id": report_id}
 
     except Exception as e:
         print(f"❌ Error: {str(e)}")
-        return {"status": "failed", "error": str(e)}
+        finish_report_run(report_id, "failed")
+        if run_id:
+            finish_run(run_id, "failed")
+        return {"status": "failed", "error": str(e), "report_id": report_id}
@@ -3,13 +3,22 @@ import os
 import glob
 from datetime import date, timedelta
 from dotenv import load_dotenv
-from celery_app import celery_app   
-from ga4_utils import fetch_ga4_full
+from celery import chain, chord
+from celery_app import celery_app, REDIS_URL
+from ga4_utils import GA4_SECTIONS, fetch_ga4_section
 from gsc_utils import fetch_gsc_full
 from send_email import send_email as send_email_util
+from artifact_store import (
+    snapshot, changes_since_previous, checkpoint,
+    start_run, finish_run, find_resumable_run
+)
+from metrics import observe_files_written
+from indexing_history import backfill_daily_files, export_current_state, newly_deindexed
+from DB.db_utils import start_report_run, finish_report_run, track_stage, count_csv_rows
 import time
 from io import BytesIO
 import pandas as pd
+import redis
 import requests
 from lxml import etree
 from google.oauth2 import service_account
@@ -33,51 +42,65 @@ SITE = GSC_SITE_URL
 INSPECTION_SCOPE = "https://www.googleapis.com/auth/webmasters"
 
 
+# -------------------------
+# RUN LOCK
+# -------------------------
+# One fetch run at a time: runs share OUTPUT_DIR, the daily indexing files and
+# the indexing history. Taken by fetch_and_email_report, released when the run
+# closes (email_seo_report) or fails; the TTL frees it if a worker dies. Keep
+# it above RESUME_STALE_SECONDS so a slow run is not "resumed" next to itself.
+FETCH_LOCK_KEY = "seo_fetch:lock"
+FETCH_LOCK_SECONDS = int(os.getenv("FETCH_LOCK_SECONDS", str(12 * 3600)))
+
+# Compare-and-delete: only the holder releases the lock
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def acquire_fetch_lock(token: str) -> bool:
+    return bool(redis.Redis.from_url(REDIS_URL).set(FETCH_LOCK_KEY, token, nx=True, ex=FETCH_LOCK_SECONDS))
+
+
+def release_fetch_lock(token: str):
+    if not token:
+        return
+    try:
+        redis.Redis.from_url(REDIS_URL).eval(_RELEASE_SCRIPT, 1, FETCH_LOCK_KEY, token)
+    except redis.RedisError as e:
+        print(f"⚠️ Could not release the fetch lock (expires in {FETCH_LOCK_SECONDS}s): {e}")
+
+
 # -------------------------
 # MERGE DAILY FILES INTO WEEKLY
 # -------------------------
 def merge_daily_indexing_files():
     """
-    Merge all daily url_indexing_status_YYYY-MM-DD.csv files into url_indexing_status.csv
-    and delete daily files older than 7 days.
+    Refresh url_indexing_status.csv from the indexing history and delete daily
+    url_indexing_status_YYYY-MM-DD.csv files older than 7 days.
+
+    Daily files are applied to the history when they are written; only files
+    it has not seen yet are read here. Deleting them loses nothing: every
+    inspection stays in the history's date partitions.
     """
     try:
         # Pattern for daily files
         daily_pattern = os.path.join(OUTPUT_DIR, "url_indexing_status_*.csv")
         daily_files = glob.glob(daily_pattern)
-        
-        if not daily_files:
-            print("ℹ️ No daily indexing files found to merge.")
-            return
-        
-        print(f"📂 Found {len(daily_files)} daily indexing files")
-        
-        # Merge all daily files
-        all_data = []
-        for file_path in daily_files:
-            try:
-                df = pd.read_csv(file_path)
-                if not df.empty:
-                    all_data.append(df)
-                    print(f"✅ Read: {os.path.basename(file_path)}")
-            except Exception as e:
-                print(f"⚠️ Failed to read {file_path}: {e}")
-        
-        if not all_data:
-            print("⚠️ No valid data found in daily files")
+
+        applied = backfill_daily_files(OUTPUT_DIR)
+        if applied:
+            print(f"📂 Applied {len(applied)} daily indexing files to the history")
+
+        weekly_file = export_current_state(os.path.join(OUTPUT_DIR, "url_indexing_status.csv"))
+        if not weekly_file:
+            print("ℹ️ No indexing history found to merge.")
             return
-        
-        # Combine all dataframes
-        merged_df = pd.concat(all_data, ignore_index=True)
-        
-        # Remove duplicates (keep latest entry per URL)
-        if 'url' in merged_df.columns:
-            merged_df = merged_df.drop_duplicates(subset=['url'], keep='last')
-        
-        # Save merged file
-        weekly_file = os.path.join(OUTPUT_DIR, "url_indexing_status.csv")
-        merged_df.to_csv(weekly_file, index=False)
-        print(f"✅ Merged file saved: {weekly_file} ({len(merged_df)} rows)")
+
+        print(f"✅ Merged file saved: {weekly_file} ({count_csv_rows([weekly_file])} rows)")
         
         # -------------------------
         # DELETE DAILY FILES OLDER THAN 7 DAYS
@@ -109,61 +132,208 @@ def merge_daily_indexing_files():
         print(f"❌ Error in merge_daily_indexing_files: {e}")
 
 
-# 🔥 CELERY TASK
-@celery_app.task(name="tasks.seo_tasks.fetch_and_email_report")
-def fetch_and_email_report():
-    """Fetch GA4 + GSC reports, sitemap indexing, merge, and send email."""
+# -------------------------
+# I/O TASKS (threaded pool, seo_io queue)
+# -------------------------
+@celery_app.task(name="tasks.seo_tasks.fetch_ga4_section")
+def fetch_ga4_section_task(section, report_id, start_date, end_date, run_id=None):
+    """Fetch one GA4 report section. Failures are returned, not raised, so the other sections still finish."""
     try:
-        today = date.today()
+        with track_stage(report_id, f"ga4_{section}") as stage:
+            files = checkpoint(
+                run_id, f"ga4_{section}", fetch_ga4_section,
+                section,
+                SERVICE_ACCOUNT_FILE,
+                GA4_PROPERTY_ID,
+                OUTPUT_DIR,
+                start_date=start_date,
+                end_date=end_date,
+                outputs=lambda paths: paths
+            )
+            stage["rows"] = count_csv_rows(files)
+            stage["artifacts"] = files
+            observe_files_written("ga4_csv", files)
+        return {"source": "ga4", "section": section, "files": files}
+    except Exception as exc:
+        print(f"❌ GA4 section {section} failed: {exc}")
+        return {"source": "ga4", "section": section, "files": [], "error": str(exc)}
 
-        # -------------------------
-        # GA4 Reports
-        # -------------------------
-        ga4_end = today - timedelta(days=1)
-        ga4_start = ga4_end - timedelta(days=6)
-        ga4_files = fetch_ga4_full(
-            SERVICE_ACCOUNT_FILE,
-            GA4_PROPERTY_ID,
-            OUTPUT_DIR,
-            start_date=ga4_start.isoformat(),
-            end_date=ga4_end.isoformat()
-        )
 
-        # -------------------------
-        # GSC Performance Reports
-        # -------------------------
-        gsc_end = today - timedelta(days=2)
-        gsc_start = gsc_end - timedelta(days=6)
-        gsc_files = fetch_gsc_full(
-            SERVICE_ACCOUNT_FILE,
-            project_id=None,
-            site_url=GSC_SITE_URL,
-            start_date=gsc_start.isoformat(),
-            end_date=gsc_end.isoformat(),
-            base_output_dir=OUTPUT_DIR
-        )
+@celery_app.task(name="tasks.seo_tasks.fetch_gsc_reports")
+def fetch_gsc_reports_task(report_id, start_date, end_date, run_id=None):
+    """GSC performance + sitemap/inspection/CWV pipeline (checkpointed per step)."""
+    try:
+        with track_stage(report_id, "gsc_fetch") as stage:
+            files = fetch_gsc_full(
+                SERVICE_ACCOUNT_FILE,
+                project_id=None,
+                site_url=GSC_SITE_URL,
+                start_date=start_date,
+                end_date=end_date,
+                base_output_dir=OUTPUT_DIR,
+                run_id=run_id
+            )
+            stage["rows"] = count_csv_rows(files)
+            stage["artifacts"] = files
+            observe_files_written("gsc_csv", files)
+        return {"source": "gsc", "section": "gsc", "files": files}
+    except Exception as exc:
+        print(f"❌ GSC fetch failed: {exc}")
+        return {"source": "gsc", "section": "gsc", "files": [], "error": str(exc)}
+
+
+@celery_app.task(name="tasks.seo_tasks.email_seo_report")
+def email_seo_report(context):
+    """
+    Send the raw CSV reports and close the run. The run stays resumable
+    ('partial') when a section failed or the email did not go out.
+    """
+    report_id = context["report_id"]
+    try:
+        with track_stage(report_id, "send_email") as stage:
+            subject = f"📊 Weekly GA4 & GSC Reports ({context['ga4_start']} → {context['ga4_end']})"
+            body = "<p>Attached is the complete set of GA4, GSC, and URL inspection analytics reports.</p>"
+            sent = send_email_util(subject=subject, body=body, attachment_dir=OUTPUT_DIR)
+            if not sent:
+                stage["status"] = "failed"
+
+        finish_report_run(report_id, "sent" if sent else "generated", csv_paths=context["files"])
+        finish_run(context["run_id"], "complete" if sent and not context["failed_sections"] else "partial")
+        return {**context, "status": "success", "email_sent": sent}
+
+    except Exception as exc:
+        print("❌ Error in email_seo_report:", exc)
+        finish_report_run(report_id, "failed")
+        finish_run(context["run_id"], "failed")
+        return {**context, "status": "error", "error": str(exc)}
+    finally:
+        release_fetch_lock(context.get("lock_token"))
+
+
+# -------------------------
+# CPU TASKS (prefork pool, seo_cpu queue)
+# -------------------------
+@celery_app.task(name="tasks.seo_tasks.finalize_seo_report")
+def finalize_seo_report(results, context):
+    """Merge indexing files and version the run outputs once every fetch has finished."""
+    report_id = context["report_id"]
+    try:
+        ga4_files = [f for r in results if r["source"] == "ga4" for f in r["files"]]
+        gsc_files = [f for r in results if r["source"] == "gsc" for f in r["files"]]
+        failed = {r["section"]: r["error"] for r in results if r.get("error")}
+        if failed:
+            print(f"⚠️ Sections failed: {failed}")
 
         # -------------------------
         # MERGE DAILY INDEXING FILES
         # -------------------------
-        print("🔄 Starting daily indexing file merge...")
-        merge_daily_indexing_files()
+        with track_stage(report_id, "merge_indexing") as stage:
+            print("🔄 Starting daily indexing file merge...")
+            weekly_file = os.path.join(OUTPUT_DIR, "url_indexing_status.csv")
+            checkpoint(
+                context["run_id"], "merge_indexing", merge_daily_indexing_files,
+                outputs=[weekly_file]
+            )
+            stage["rows"] = count_csv_rows([weekly_file])
+            stage["artifacts"] = [weekly_file]
+
+            deindexed = newly_deindexed(days=7)
+            if not deindexed.empty:
+                print(f"🚨 {len(deindexed)} URLs deindexed in the last 7 days")
 
         # -------------------------
-        # SEND EMAIL
+        # VERSION RUN OUTPUTS
         # -------------------------
-        subject = f"📊 Weekly GA4 & GSC Reports ({ga4_start} → {ga4_end})"
-        body = "<p>Attached is the complete set of GA4, GSC, and URL inspection analytics reports.</p>"
-        send_email_util(subject=subject, body=body, attachment_dir=OUTPUT_DIR)
+        with track_stage(report_id, "snapshot") as stage:
+            manifest = snapshot(OUTPUT_DIR, kind="seo_fetch", run_id=context["run_id"])
+            changes = changes_since_previous(manifest)
+            print(
+                f"🗄️ Changed since last run: {len(changes['added'])} added, "
+                f"{len(changes['changed'])} changed, {len(changes['unchanged'])} unchanged"
+            )
+            stage["rows"] = len(manifest["files"])
 
-        print(f"✅ Task completed: GA4 {len(ga4_files)} files, GSC {len(gsc_files)} files.")
+        print(f"✅ Fetch completed: GA4 {len(ga4_files)} files, GSC {len(gsc_files)} files.")
         return {
-            "status": "success",
+            **context,
             "ga4_files_count": len(ga4_files),
             "gsc_files_count": len(gsc_files),
-            "output_dir": OUTPUT_DIR
+            "failed_sections": failed,
+            "newly_deindexed": deindexed["url"].tolist() if not deindexed.empty else [],
+            "files": ga4_files + gsc_files
         }
 
+    except Exception as exc:
+        print("❌ Error in finalize_seo_report:", exc)
+        finish_report_run(report_id, "failed")
+        finish_run(context["run_id"], "failed")
+        release_fetch_lock(context.get("lock_token"))
+        raise
+
+
+# 🔥 CELERY TASK
+@celery_app.task(bind=True, name="tasks.seo_tasks.fetch_and_email_report")
+def fetch_and_email_report(self, run_id=None):
+    """
+    Fetch GA4 + GSC reports, sitemap indexing, merge, and send email.
+
+    The GA4 sections and the GSC pipeline are fanned out as parallel I/O tasks;
+    merging and versioning run on the CPU queue once they all finish, then
+    the email goes out from the I/O queue.
+
+    An unfinished run for the same date window (failed, partial or crashed)
+    is resumed: stages with a checkpoint are skipped. Pass run_id to resume
+    a specific run. While another fetch run holds the run lock, the call is
+    skipped.
+    """
+    report_id = None
+    lock_token = self.request.id or f"local-{os.getpid()}-{time.time()}"
+    if not acquire_fetch_lock(lock_token):
+        print("⏭️ Another fetch run is still in progress, skipping")
+        return {"status": "skipped", "reason": "fetch run in progress"}
+    try:
+        today = date.today()
+        ga4_end = today - timedelta(days=1)
+        ga4_start = ga4_end - timedelta(days=6)
+        gsc_end = today - timedelta(days=2)
+        gsc_start = gsc_end - timedelta(days=6)
+
+        params = {"ga4_start": ga4_start.isoformat(), "gsc_start": gsc_start.isoformat()}
+        run_id = run_id or find_resumable_run("seo_fetch", params)
+        if run_id:
+            print(f"♻️ Resuming run {run_id}")
+        run_id = start_run("seo_fetch", params, run_id=run_id)
+        report_id = start_report_run(
+            "raw_fetch", ga4_start, ga4_end, run_id=run_id, task_id=self.request.id
+        )
+        context = {
+            "run_id": run_id,
+            "report_id": report_id,
+            "ga4_start": ga4_start.isoformat(),
+            "ga4_end": ga4_end.isoformat(),
+            "output_dir": OUTPUT_DIR,
+            "lock_token": lock_token,
+        }
+
+        fetches = [
+            fetch_ga4_section_task.s(section, report_id, ga4_start.isoformat(), ga4_end.isoformat(), run_id)
+            for section in GA4_SECTIONS
+        ]
+        fetches.append(
+            fetch_gsc_reports_task.s(report_id, gsc_start.isoformat(), gsc_end.isoformat(), run_id)
+        )
+
+        result = chord(fetches)(
+            chain(finalize_seo_report.s(context), email_seo_report.s())
+        )
+
+        print(f"🚀 Queued {len(fetches)} fetch tasks for run {run_id}")
+        return {**context, "status": "queued", "result_id": result.id}
+
     except Exception as exc:
         print("❌ Error in fetch_and_email_report:", exc)
-        return {"status": "error", "error": str(exc)}
+        finish_report_run(report_id, "failed")
+        if run_id:
+            finish_run(run_id, "failed")
+        release_fetch_lock(lock_token)
+        return {"status": "error", "error": str(exc), "report_id": report_id}
@@ -0,0 +1,211 @@
+# weekly_rollups.py
+"""
+Materialized weekly rollups and week-over-week anomaly detection.
+
+Layout (Parquet, one partition per ISO week, keyed by its Monday):
+
+    weekly_rollups/
+        pages/week=YYYY-MM-DD/part.parquet     page: clicks, impressions, ctr, position, lcp, inp, cls
+        queries/week=YYYY-MM-DD/part.parquet   page, query: clicks, impressions, ctr, position
+
+Each week is rolled up once from that week's report files. The comparison
+for a week reads its own partition, the previous week and the
+ROLLUP_BASELINE_WEEKS partitions before it; no historical CSV is reprocessed.
+Anomalies are rolling z-scores of this week's value against those baseline
+weeks.
+"""
+import os
+import glob
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from csv_schemas import read_report_csv
+from preprocessing.preprocessing import normalize_columns
+
+ROLLUP_DIR = os.path.join(os.getcwd(), os.getenv("WEEKLY_ROLLUP_DIR", "weekly_rollups"))
+BASELINE_WEEKS = int(os.getenv("ROLLUP_BASELINE_WEEKS", "8"))
+MIN_BASELINE_WEEKS = 3
+ANOMALY_Z = float(os.getenv("ROLLUP_ANOMALY_Z", "3.0"))
+
+KEYS = {"pages": ["page"], "queries": ["page", "query"]}
+METRICS = {
+    "pages": ["clicks", "impressions", "ctr", "position", "lcp", "inp", "cls"],
+    "queries": ["clicks", "impressions", "ctr", "position"],
+}
+# Direction of "better" per metric (position and CWV: lower is better)
+HIGHER_IS_BETTER = {"clicks": True, "impressions": True, "ctr": True,
+                    "position": False, "lcp": False, "inp": False, "cls": False}
+
+
+# -------------------------
+# STORAGE HELPERS
+# -------------------------
+def week_start(day=None) -> str:
+    """Monday of the ISO week containing `day` (date or ISO string; default today)."""
+    day = date.fromisoformat(day) if isinstance(day, str) else (day or date.today())
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def _shift_week(week: str, weeks: int) -> str:
+    return (date.fromisoformat(week) + timedelta(weeks=weeks)).isoformat()
+
+
+def _partition_path(kind: str, week: str, rollup_dir: str = ROLLUP_DIR) -> str:
+    return os.path.join(rollup_dir, kind, f"week={week}", "part.parquet")
+
+
+def _write_parquet(df: pd.DataFrame, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def rollup_weeks(kind: str = "pages", rollup_dir: str = ROLLUP_DIR) -> list:
+    paths = glob.glob(os.path.join(rollup_dir, kind, "week=*", "part.parquet"))
+    return sorted(os.path.basename(os.path.dirname(p))[len("week="):] for p in paths)
+
+
+def read_week(kind: str, week: str, rollup_dir: str = ROLLUP_DIR) -> pd.DataFrame:
+    path = _partition_path(kind, week, rollup_dir)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=KEYS[kind] + METRICS[kind])
+    return pd.read_parquet(path)
+
+
+# -------------------------
+# WRITE PATH
+# -------------------------
+def rollup_frame(df: pd.DataFrame, kind: str = "pages") -> pd.DataFrame:
+    """
+    One row per page (or page x query): summed clicks/impressions, CTR as
+    clicks / impressions, impression-weighted position, mean CWV.
+    """
+    keys, metrics = KEYS[kind], METRICS[kind]
+    df = normalize_columns(df)
+    if any(k not in df.columns for k in keys):
+        raise ValueError(f"{kind} rollup needs columns {keys}")
+
+    df = df.dropna(subset=keys)
+    df = df.assign(weighted_position=df["position"] * df["impressions"])
+    cwv_cols = [c for c in metrics if c in ("lcp", "inp", "cls") and c in df.columns]
+    grouped = df.groupby(keys, sort=True)
+    rollup = grouped[["clicks", "impressions", "weighted_position"]].sum()
+    rollup["mean_position"] = grouped["position"].mean()
+    if cwv_cols:
+        rollup = rollup.join(grouped[cwv_cols].mean())
+
+    impressions = rollup["impressions"].where(rollup["impressions"] > 0)
+    rollup["ctr"] = (rollup["clicks"] / impressions).fillna(0.0)
+    rollup["position"] = (rollup["weighted_position"] / impressions).fillna(rollup["mean_position"])
+    return rollup.reset_index().reindex(columns=keys + metrics)
+
+
+def append_week(source, kind: str = "pages", week: str = None, rollup_dir: str = ROLLUP_DIR) -> dict:
+    """Roll up one week's report (CSV path or DataFrame); rerunning a week replaces it."""
+    week = week_start(week)
+    if isinstance(source, str):
+        source = read_report_csv(source)
+    rollup = rollup_frame(source, kind)
+    _write_parquet(rollup, _partition_path(kind, week, rollup_dir))
+    print(f"📅 Weekly {kind} rollup {week}: {len(rollup)} rows")
+    return {"kind": kind, "week": week, "rows": len(rollup)}
+
+
+# -------------------------
+# DELTAS + ANOMALIES
+# -------------------------
+def _baseline(kind: str, week: str, rollup_dir: str = ROLLUP_DIR) -> pd.DataFrame:
+    """Per-key mean, std and count of each metric over the weeks before `week`."""
+    keys, metrics = KEYS[kind], METRICS[kind]
+    weeks = [w for w in rollup_weeks(kind, rollup_dir) if w < week][-BASELINE_WEEKS:]
+    frames = [read_week(kind, w, rollup_dir) for w in weeks]
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(index=pd.MultiIndex.from_tuples([], names=keys) if len(keys) > 1
+                            else pd.Index([], name=keys[0]))
+    stats = pd.concat(frames, ignore_index=True).groupby(keys)[metrics].agg(["mean", "std", "count"])
+    stats.columns = [f"{metric}_baseline_{stat}" for metric, stat in stats.columns]
+    return stats
+
+
+def week_over_week(kind: str = "pages", week: str = None, rollup_dir: str = ROLLUP_DIR) -> pd.DataFrame:
+    """
+    This week's rollup with, per metric: previous week value, delta,
+    relative delta, baseline mean and rolling z-score (NaN with fewer than
+    MIN_BASELINE_WEEKS baseline weeks or no variation).
+    """
+    week = week_start(week)
+    keys, metrics = KEYS[kind], METRICS[kind]
+    current = read_week(kind, week, rollup_dir).set_index(keys)
+    previous = read_week(kind, _shift_week(week, -1), rollup_dir).set_index(keys)
+    baseline = _baseline(kind, week, rollup_dir)
+
+    out = current[metrics].join(previous[metrics].add_suffix("_prev"), how="left").join(baseline, how="left")
+    for metric in metrics:
+        prev = out[f"{metric}_prev"]
+        out[f"{metric}_delta"] = out[metric] - prev
+        out[f"{metric}_pct"] = out[f"{metric}_delta"] / prev.where(prev != 0)
+
+        mean_col, std_col, count_col = (f"{metric}_baseline_{s}" for s in ("mean", "std", "count"))
+        if mean_col not in out.columns:
+            out[f"{metric}_z"] = np.nan
+            continue
+        std = out[std_col].where((out[count_col] >= MIN_BASELINE_WEEKS) & (out[std_col] > 0))
+        out[f"{metric}_z"] = (out[metric] - out[mean_col]) / std
+    return out.reset_index()
+
+
+def anomalies(kind: str = "pages", week: str = None, threshold: float = None,
+              rollup_dir: str = ROLLUP_DIR) -> pd.DataFrame:
+    """Long format: one row per (key, metric) with |z| >= threshold, largest first."""
+    threshold = threshold if threshold is not None else ANOMALY_Z
+    keys, metrics = KEYS[kind], METRICS[kind]
+    wow = week_over_week(kind, week, rollup_dir)
+    if wow.empty:
+        return pd.DataFrame(columns=keys + ["metric", "value", "previous", "baseline_mean", "z", "direction"])
+
+    parts = []
+    for metric in metrics:
+        z = wow[f"{metric}_z"]
+        hit = z.abs() >= threshold
+        if not hit.any():
+            continue
+        part = wow.loc[hit, keys].copy()
+        part["metric"] = metric
+        part["value"] = wow.loc[hit, metric]
+        part["previous"] = wow.loc[hit, f"{metric}_prev"]
+        part["baseline_mean"] = wow.loc[hit, f"{metric}_baseline_mean"]
+        part["z"] = z[hit]
+        improved = (z[hit] > 0) == HIGHER_IS_BETTER[metric]
+        part["direction"] = np.where(improved, "better", "worse")
+        parts.append(part)
+    if not parts:
+        return pd.DataFrame(columns=keys + ["metric", "value", "previous", "baseline_mean", "z", "direction"])
+    result = pd.concat(parts, ignore_index=True)
+    return result.reindex(result["z"].abs().sort_values(ascending=False).index).reset_index(drop=True)
+
+
+# -------------------------
+# PIPELINE ENTRY POINT
+# -------------------------
+def update_weekly_rollups(page_csv: str, query_csv: str = None, week: str = None,
+                          anomalies_csv: str = None, limit: int = 50,
+                          rollup_dir: str = ROLLUP_DIR) -> pd.DataFrame:
+    """
+    Roll up this week's page (and, if present, page x query) report and
+    return the page anomalies; optionally write the top `limit` of them to
+    anomalies_csv so they go into the report dataset.
+    """
+    week = week_start(week)
+    append_week(page_csv, "pages", week, rollup_dir)
+    if query_csv and os.path.exists(query_csv):
+        append_week(query_csv, "queries", week, rollup_dir)
+
+    found = anomalies("pages", week, rollup_dir=rollup_dir)
+    print(f"📈 Week {week}: {len(found)} page anomalies (|z| >= {ANOMALY_Z})")
+    if anomalies_csv:
+        found.head(limit).to_csv(anomalies_csv, index=False)
+    return found